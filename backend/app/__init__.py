@@ -1,12 +1,10 @@
-from flask import Flask, send_from_directory
+from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
-from flask_jwt_extended import JWTManager
+from flask_jwt_extended import JWTManager, verify_jwt_in_request, get_jwt_identity
 from flask_cors import CORS
 from config import Config
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
-import logging
-from logging.handlers import RotatingFileHandler
 import os
 from flasgger import Swagger
 from flask_migrate import Migrate
@@ -15,7 +13,21 @@ db = SQLAlchemy()
 jwt = JWTManager()
 migrate = Migrate()
 
-jwt_blacklist = set()
+def clave_limite():
+    """
+    Identifica al cliente para el rate limiting: el usuario del JWT si la
+    solicitud está autenticada (los tablets comparten IP por NAT), si no la IP.
+    """
+    try:
+        verify_jwt_in_request(optional=True)
+        usuario_id = get_jwt_identity()
+    except Exception:
+        usuario_id = None
+    if usuario_id:
+        return f"usuario:{usuario_id}"
+    return f"ip:{get_remote_address()}"
+
+limiter = Limiter(key_func=clave_limite)
 
 def create_app():
     app = Flask(__name__)
@@ -26,27 +38,12 @@ def create_app():
     jwt.init_app(app)
     CORS(app, supports_credentials=True, resources={r"/*": {"origins": "*"}})
 
-    # Configuración de Flask-Limiter
-    limiter = Limiter(
-        get_remote_address,
-        app=app,
-        default_limits=["1000 per day"]
-    )
-
-    # Configuración de logging
-    logs_dir = os.path.join(os.path.dirname(__file__), '..', 'logs')
-    os.makedirs(logs_dir, exist_ok=True)
-    log_file = os.path.join(logs_dir, 'app_auditoria.log')
+    # Configuración de Flask-Limiter (almacenamiento y estrategia en Config)
+    limiter.init_app(app)
 
-    handler = RotatingFileHandler(log_file, maxBytes=2*1024*1024, backupCount=5)
-    formatter = logging.Formatter(
-        '[%(asctime)s] %(levelname)s in %(module)s: %(message)s'
-    )
-    handler.setFormatter(formatter)
-    handler.setLevel(logging.INFO)
-
-    logging.getLogger().setLevel(logging.INFO)
-    logging.getLogger().addHandler(handler)
+    # Logging estructurado (JSON) escrito por un hilo aparte desde una cola acotada
+    from app.utils.registro import configurar_logging
+    configurar_logging(app)
 
     # Inicializa Swagger
     Swagger(app)
@@ -56,23 +53,74 @@ def create_app():
     from app.routes.despachos import despachos_bp
     from app.routes.recepciones import recepciones_bp
     from app.routes.historial import historial_bp
+    from app.routes.subidas import subidas_bp
+    from app.routes.sincronizacion import sincronizacion_bp
+    from app.routes.admin import admin_bp
+    from app.routes.mapa import mapa_bp
+    from app.routes.reportes import reportes_bp
 
     app.register_blueprint(auth_bp, url_prefix="/auth")
     app.register_blueprint(despachos_bp, url_prefix="/despachos")
     app.register_blueprint(recepciones_bp, url_prefix="/recepciones")
     app.register_blueprint(historial_bp)
+    app.register_blueprint(subidas_bp, url_prefix="/subidas")
+    app.register_blueprint(sincronizacion_bp, url_prefix="/sincronizar")
+    app.register_blueprint(admin_bp, url_prefix="/admin")
+    app.register_blueprint(mapa_bp, url_prefix="/mapa")
+    app.register_blueprint(reportes_bp, url_prefix="/reportes")
+
+    # Comandos de mantenimiento (flask <comando>)
+    from app.comandos import (
+        migrar_archivos, limpiar_subidas, purgar_tokens, purgar_reportes, benchmark_hash, importar_guias,
+        actualizar_estadisticas, asignar_zonas,
+    )
+    from app.utils.file_handler import servir_archivo
+    app.cli.add_command(migrar_archivos)
+    app.cli.add_command(limpiar_subidas)
+    app.cli.add_command(purgar_tokens)
+    app.cli.add_command(purgar_reportes)
+    app.cli.add_command(benchmark_hash)
+    app.cli.add_command(importar_guias)
+    app.cli.add_command(actualizar_estadisticas)
+    app.cli.add_command(asignar_zonas)
 
     # 👉 Ruta pública para servir imágenes
     UPLOAD_FOLDER = os.path.join(os.getcwd(), 'app', 'uploads')
 
     @app.route('/uploads/<path:filename>', endpoint='uploaded_file')
     def uploaded_file(filename):
-        return send_from_directory(UPLOAD_FOLDER, filename)
+        return servir_archivo(UPLOAD_FOLDER, filename)
+
+    # Configuración de revocación de tokens JWT (compartida entre workers)
+    from app.utils.revocacion import revocacion
+    revocacion.init_app(app)
+
+    # Eventos de auditoría en la tabla audit_event, escritos en lotes por un hilo
+    from app.utils.auditoria import auditoria
+    auditoria.init_app(app)
+
+    # Principales (rol y nombre) cacheados por proceso para las verificaciones de permisos
+    from app.utils.principales import principales
+    principales.init_app(app)
+
+    # Hashing de contraseñas en un pool de hilos acotado
+    from app.utils.contrasenas import pool_hash
+    pool_hash.init_app(app)
+
+    # Caché de páginas del historial, invalidada por versión de usuario
+    from app.utils.cache_historial import cache_historial
+    cache_historial.init_app(app)
+
+    # Índice punto-en-polígono de zonas, cargado por proceso en el primer uso
+    from app.utils.zonas import zonas
+    zonas.init_app(app)
+
+    # Reportes PDF renderizados en un pool de hilos, cacheados en REPORTES_DIR
+    from app.utils.reportes import reportes
+    reportes.init_app(app)
 
-    # Configuración de revocación de tokens JWT
     @jwt.token_in_blocklist_loader
     def check_if_token_revoked(jwt_header, jwt_payload):
-        jti = jwt_payload["jti"]
-        return jti in jwt_blacklist
+        return revocacion.esta_revocado(jwt_payload["jti"], jwt_payload["exp"])
 
     return app
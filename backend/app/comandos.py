@@ -0,0 +1,225 @@
+import os
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from app.models import FotoDespacho, FotoRecepcion
+
+
+@click.command("migrar-archivos")
+@click.option("--lote", default=200, show_default=True, help="Fotos por commit.")
+@with_appcontext
+def migrar_archivos(lote):
+    """Mueve las fotos del directorio plano de uploads al almacenamiento por hash."""
+    from app.utils.file_handler import migrar_archivos_existentes
+
+    resumen = migrar_archivos_existentes(
+        current_app.config["UPLOAD_FOLDER"], [FotoDespacho, FotoRecepcion], lote
+    )
+    click.echo(
+        f"Fotos migradas: {resumen['migradas']}, duplicadas: {resumen['duplicados']}, "
+        f"archivos faltantes: {resumen['faltantes']}"
+    )
+
+
+@click.command("limpiar-subidas")
+@click.option("--horas", default=24, show_default=True, help="Horas sin actividad para considerar abandonada una subida.")
+@with_appcontext
+def limpiar_subidas(horas):
+    """Elimina las subidas reanudables abandonadas y sus archivos parciales."""
+    from app.routes.subidas import limpiar_subidas_abandonadas
+
+    eliminadas = limpiar_subidas_abandonadas(horas)
+    click.echo(f"Subidas abandonadas eliminadas: {eliminadas}")
+
+
+@click.command("purgar-tokens")
+@with_appcontext
+def purgar_tokens():
+    """Elimina del registro de revocación los tokens que ya expiraron."""
+    from app.utils.revocacion import revocacion
+
+    eliminados = revocacion.purgar_expirados()
+    click.echo(f"Tokens revocados expirados eliminados: {eliminados}")
+
+
+@click.command("purgar-reportes")
+@click.option("--dias", default=None, type=int, help="Días sin uso (por defecto REPORTES_RETENCION_DIAS).")
+@with_appcontext
+def purgar_reportes(dias):
+    """Elimina de REPORTES_DIR los reportes PDF que nadie ha pedido en los últimos días."""
+    from app.utils.reportes import reportes
+
+    eliminados = reportes.purgar(dias if dias is not None else current_app.config["REPORTES_RETENCION_DIAS"])
+    click.echo(f"Reportes eliminados: {eliminados}")
+
+
+@click.command("benchmark-hash")
+@click.option("--metodo", "metodos", multiple=True,
+              help="Método a medir (repetible). Por defecto el configurado y algunos comunes.")
+@click.option("--segundos", default=3.0, show_default=True, help="Duración de cada medición.")
+@click.option("--hilos", default=None, type=click.IntRange(min=1),
+              help="Hilos del pool de hash (por defecto PASSWORD_HASH_WORKERS).")
+@click.option("--concurrentes", multiple=True, type=click.IntRange(min=1),
+              help="Logins simultáneos (repetible). Por defecto los hilos, PASSWORD_HASH_MAX_PENDING y el doble.")
+@with_appcontext
+def benchmark_hash(metodos, segundos, hilos, concurrentes):
+    """
+    Mide cuántos logins por segundo verifica un worker con cada método de
+    hash, pasando por un PoolHash igual al de /auth/login (mismo número de
+    hilos y de cupos): con más logins simultáneos que cupos, los que sobran
+    se cuentan como rechazados (429 en el login real).
+    """
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    from werkzeug.security import generate_password_hash
+    from app.utils.contrasenas import PoolHash, HashSaturado, metodo_canonico, metodo_configurado
+
+    pool = PoolHash()
+    pool.workers = hilos or current_app.config["PASSWORD_HASH_WORKERS"]
+    pool.max_pendientes = current_app.config["PASSWORD_HASH_MAX_PENDING"]
+    concurrentes = sorted(set(concurrentes or (pool.workers, pool.max_pendientes, pool.max_pendientes * 2)))
+    metodos = metodos or (metodo_configurado(), "scrypt:16384:8:1", "pbkdf2:sha256:600000", "pbkdf2:sha256:100000")
+    click.echo(f"{'método':<28}{'concurrentes':>13}{'logins/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'rechazados':>12}")
+    for metodo in dict.fromkeys(metodo_canonico(m) for m in metodos):
+        password_hash = generate_password_hash("Benchmark1234", method=metodo)
+        for n in concurrentes:
+            fin = time.monotonic() + segundos
+
+            def login():
+                latencias, rechazados = [], 0
+                while time.monotonic() < fin:
+                    inicio = time.perf_counter()
+                    try:
+                        pool.verificar(password_hash, "Benchmark1234")
+                    except HashSaturado:
+                        rechazados += 1
+                        time.sleep(0.01)  # como un cliente que reintenta tras el 429
+                        continue
+                    latencias.append(time.perf_counter() - inicio)
+                return latencias, rechazados
+
+            inicio = time.monotonic()
+            with ThreadPoolExecutor(max_workers=n) as clientes:
+                resultados = list(clientes.map(lambda _: login(), range(n)))
+            duracion = time.monotonic() - inicio
+            latencias = sorted(latencia for parte, _ in resultados for latencia in parte)
+            rechazados = sum(r for _, r in resultados)
+            if not latencias:
+                click.echo(f"{metodo:<28}{n:>13}{'sin muestras, aumente --segundos':>42}")
+                continue
+            p50 = latencias[len(latencias) // 2] * 1000
+            p95 = latencias[int(len(latencias) * 0.95)] * 1000
+            click.echo(f"{metodo:<28}{n:>13}{len(latencias) / duracion:>10.1f}{p50:>10.1f}{p95:>10.1f}{rechazados:>12}")
+
+
+@click.command("importar-guias")
+@click.argument("archivo", type=click.Path(exists=True, dir_okay=False))
+@click.option("--tipo", type=click.Choice(["despacho", "recepcion"]), required=True)
+@click.option("--usuario", "rut_usuario", required=True, help="RUT del usuario al que se asignan las guías.")
+@click.option("--lote", default=5000, show_default=True, help="Filas por lote (un COPY/commit por lote).")
+@click.option("--errores", "archivo_errores", type=click.Path(dir_okay=False),
+              help="CSV donde dejar las filas rechazadas (línea, motivo).")
+@click.option("--solo-validar", is_flag=True, help="Valida el archivo sin insertar.")
+@with_appcontext
+def importar_guias(archivo, tipo, rut_usuario, lote, archivo_errores, solo_validar):
+    """Importa guías históricas desde un CSV o XLSX del ERP."""
+    import csv
+    from app.models import Usuario, Despacho, Recepcion
+    from app.utils.importacion import importar_guias as importar
+    from app.utils.auditoria import auditoria
+    from app.utils.cache_historial import cache_historial
+
+    usuario = Usuario.por_rut(rut_usuario)
+    if usuario is None:
+        raise click.BadParameter(f"No existe un usuario con RUT {rut_usuario}", param_hint="--usuario")
+
+    modelo = Despacho if tipo == "despacho" else Recepcion
+    try:
+        validas, errores = importar(archivo, modelo, usuario.id, lote, solo_validar)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+    if archivo_errores:
+        with open(archivo_errores, "w", newline="", encoding="utf-8") as salida:
+            escritor = csv.writer(salida)
+            escritor.writerow(["linea", "motivo"])
+            escritor.writerows(errores)
+    else:
+        for linea, motivo in errores[:50]:
+            click.echo(f"Línea {linea}: {motivo}", err=True)
+        if len(errores) > 50:
+            click.echo(f"... y {len(errores) - 50} más (use --errores para el detalle)", err=True)
+
+    accion = "válidas" if solo_validar else "importadas"
+    click.echo(f"Filas {accion}: {validas}, rechazadas: {len(errores)}")
+    if not solo_validar and validas:
+        # Con "redis" invalida a todos los workers; con "memory" sólo a este proceso,
+        # los workers del servidor ven la importación al cambiar la ventana de TTL
+        cache_historial.invalidar(usuario.id)
+        auditoria.registrar("importar", tipo, referencia=os.path.basename(archivo), usuario_id=usuario.id,
+                            detalle={"insertadas": validas, "rechazadas": len(errores)})
+
+
+@click.command("actualizar-estadisticas")
+@click.option("--horas", default=2, show_default=True, help="Horas hacia atrás a recalcular (cron cada pocos minutos).")
+@click.option("--desde", type=click.DateTime(["%Y-%m-%d"]), help="Recalcula desde esta fecha.")
+@click.option("--todo", is_flag=True, help="Recalcula todo el historial (cron diario).")
+@with_appcontext
+def actualizar_estadisticas(horas, desde, todo):
+    """
+    Recalcula el resumen por hora que usan los endpoints /admin/estadisticas.
+    La ventana de --horas sólo ve los movimientos recientes: los cambios en
+    fechas pasadas (sincronizaciones offline, fotos tardías, ediciones) se
+    corrigen con la corrida diaria con --todo.
+    """
+    from datetime import datetime, timedelta
+    from app.utils.estadisticas import actualizar_estadisticas as actualizar
+
+    if todo:
+        filas = actualizar()
+        click.echo(f"Estadísticas recalculadas para todo el historial: {filas} filas")
+        return
+    desde = desde or datetime.utcnow() - timedelta(hours=horas)
+    filas = actualizar(desde)
+    click.echo(f"Estadísticas recalculadas desde {desde:%Y-%m-%d %H:00}: {filas} filas")
+
+
+@click.command("asignar-zonas")
+@click.option("--lote", default=1000, show_default=True, help="Filas por transacción.")
+@click.option("--todas", is_flag=True, help="Reetiqueta también las que ya tienen zona (tras cambiar el GeoJSON).")
+@with_appcontext
+def asignar_zonas(lote, todas):
+    """Etiqueta con su zona los movimientos existentes que tienen coordenadas."""
+    from sqlalchemy import select, update
+    from app import db
+    from app.models import Despacho, Recepcion
+    from app.utils.zonas import zonas
+
+    if not zonas.activas:
+        raise click.UsageError("Configure ZONAS_GEOJSON con el GeoJSON de zonas")
+    zonas.indice()
+
+    for modelo in (Despacho, Recepcion):
+        ultimo_id = 0
+        revisadas = asignadas = 0
+        while True:
+            query = select(modelo.id, modelo.latitud, modelo.longitud, modelo.zona).where(
+                modelo.id > ultimo_id, modelo.latitud.is_not(None), modelo.longitud.is_not(None)
+            )
+            if not todas:
+                query = query.where(modelo.zona.is_(None))
+            filas = db.session.execute(query.order_by(modelo.id).limit(lote)).all()
+            if not filas:
+                break
+            cambios = []
+            for id, latitud, longitud, zona in filas:
+                nueva = zonas.zona_de(latitud, longitud)
+                if nueva != zona:
+                    cambios.append({"id": id, "zona": nueva})
+            if cambios:
+                db.session.execute(update(modelo), cambios)
+            db.session.commit()
+            revisadas += len(filas)
+            asignadas += len(cambios)
+            ultimo_id = filas[-1].id
+        click.echo(f"{modelo.__tablename__}: {revisadas} revisadas, {asignadas} actualizadas")
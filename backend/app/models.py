@@ -1,11 +1,20 @@
 from app import db
 from datetime import datetime
+import logging
 from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import DDL, event
 from sqlalchemy.orm import validates
+from app.utils.rut import partes_rut
+from app.utils.geohash import codificar as codificar_geohash
+from app.utils.zonas import zonas
+from app.utils.busqueda import vector_observacion, ddl_fts_sqlite
 
 class Usuario(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     rut = db.Column(db.String(12), unique=True, nullable=False)
+    # RUT normalizado (se completa al asignar rut): las búsquedas usan estas columnas
+    rut_cuerpo = db.Column(db.Integer, nullable=True, index=True)
+    rut_dv = db.Column(db.String(1), nullable=True)
     correo = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(256), nullable=False)
 
@@ -14,11 +23,28 @@ class Usuario(db.Model):
     tipo_usuario = db.Column(db.String(20), nullable=False, default='usuario')  # 'usuario' o 'admin'
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        from app.utils.contrasenas import metodo_configurado
+        self.password_hash = generate_password_hash(password, method=metodo_configurado())
 
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
 
+    @classmethod
+    def por_rut(cls, rut):
+        """
+        Usuario por RUT normalizado. Las filas antiguas pueden tener el mismo
+        RUT escrito de dos formas: entonces se usa el escrito igual y, si
+        ninguno lo está, no se elige ninguno.
+        """
+        cuerpo, dv = partes_rut(rut)
+        if cuerpo is None:
+            return None
+        usuarios = cls.query.filter_by(rut_cuerpo=cuerpo, rut_dv=dv).all()
+        if len(usuarios) <= 1:
+            return usuarios[0] if usuarios else None
+        logging.error("RUT %s-%s duplicado en usuarios %s", cuerpo, dv, [u.id for u in usuarios])
+        return next((u for u in usuarios if u.rut == rut), None)
+
     # ✅ Validación de tipo_usuario
     @validates('tipo_usuario')
     def validate_tipo_usuario(self, key, value):
@@ -26,38 +52,192 @@ class Usuario(db.Model):
             raise ValueError("tipo_usuario debe ser 'admin' o 'usuario'")
         return value
 
+    @validates('rut')
+    def normalizar_rut(self, key, value):
+        self.rut_cuerpo, self.rut_dv = partes_rut(value)
+        return value
+
+class ArchivoBlob(db.Model):
+    # Contenido de una foto guardado una sola vez, identificado por su SHA-256
+    sha256 = db.Column(db.String(64), primary_key=True)
+    ruta = db.Column(db.String(200), nullable=False, unique=True)
+    tamano = db.Column(db.Integer, nullable=False)
+    referencias = db.Column(db.Integer, nullable=False, default=0)
+    fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
+
 class Despacho(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     numero_guia = db.Column(db.String(50), nullable=False)
     rut_empresa = db.Column(db.String(12), nullable=False)
+    rut_empresa_cuerpo = db.Column(db.Integer, nullable=True)  # RUT normalizado, ver normalizar_rut
+    rut_empresa_dv = db.Column(db.String(1), nullable=True)
     fecha = db.Column(db.DateTime, default=datetime.utcnow)
     usuario_id = db.Column(db.Integer, db.ForeignKey("usuario.id"), nullable=False)
     fotos = db.relationship('FotoDespacho', backref='despacho', lazy=True)
+    # Clave generada por el dispositivo para no duplicar movimientos al reintentar
+    clave_idempotencia = db.Column(db.String(64), nullable=True)
     latitud = db.Column(db.Float) 
     longitud = db.Column(db.Float)
+    geohash = db.Column(db.String(12), nullable=True)  # celda de latitud/longitud, ver ubicar
+    zona = db.Column(db.String(100), nullable=True)  # comuna/sitio que contiene el punto, ver ubicar
     observacion = db.Column(db.Text, nullable=True)
 
+    __table_args__ = (
+        db.UniqueConstraint('usuario_id', 'clave_idempotencia', name='uq_despacho_usuario_clave'),
+    )
+
+    @validates('rut_empresa')
+    def normalizar_rut(self, key, value):
+        self.rut_empresa_cuerpo, self.rut_empresa_dv = partes_rut(value)
+        return value
+
+    @validates('latitud', 'longitud')
+    def ubicar(self, key, value):
+        latitud = value if key == 'latitud' else self.latitud
+        longitud = value if key == 'longitud' else self.longitud
+        self.geohash = codificar_geohash(latitud, longitud)
+        self.zona = zonas.zona_de(latitud, longitud)
+        return value
+
 class FotoDespacho(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     despacho_id = db.Column(db.Integer, db.ForeignKey('despacho.id'), nullable=False)
     tipo = db.Column(db.String(20), nullable=False)  # carnet, patente, carga
     ruta_archivo = db.Column(db.String(200), nullable=False)
+    ruta_thumb = db.Column(db.String(200), nullable=True)  # variante WebP miniatura
+    ruta_medium = db.Column(db.String(200), nullable=True)  # variante WebP mediana
     fecha_subida = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_foto_despacho_despacho_id', 'despacho_id'),
+    )
+
 class Recepcion(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     numero_guia = db.Column(db.String(50), nullable=False)
     rut_empresa = db.Column(db.String(12), nullable=False)
+    rut_empresa_cuerpo = db.Column(db.Integer, nullable=True)  # RUT normalizado, ver normalizar_rut
+    rut_empresa_dv = db.Column(db.String(1), nullable=True)
     fecha = db.Column(db.DateTime, default=datetime.utcnow)
     usuario_id = db.Column(db.Integer, db.ForeignKey("usuario.id"), nullable=False)
     fotos = db.relationship('FotoRecepcion', backref='recepcion', lazy=True)
+    # Clave generada por el dispositivo para no duplicar movimientos al reintentar
+    clave_idempotencia = db.Column(db.String(64), nullable=True)
     latitud = db.Column(db.Float)  
     longitud = db.Column(db.Float) 
+    geohash = db.Column(db.String(12), nullable=True)  # celda de latitud/longitud, ver ubicar
+    zona = db.Column(db.String(100), nullable=True)  # comuna/sitio que contiene el punto, ver ubicar
     observacion = db.Column(db.Text, nullable=True)
 
+    __table_args__ = (
+        db.UniqueConstraint('usuario_id', 'clave_idempotencia', name='uq_recepcion_usuario_clave'),
+    )
+
+    @validates('rut_empresa')
+    def normalizar_rut(self, key, value):
+        self.rut_empresa_cuerpo, self.rut_empresa_dv = partes_rut(value)
+        return value
+
+    @validates('latitud', 'longitud')
+    def ubicar(self, key, value):
+        latitud = value if key == 'latitud' else self.latitud
+        longitud = value if key == 'longitud' else self.longitud
+        self.geohash = codificar_geohash(latitud, longitud)
+        self.zona = zonas.zona_de(latitud, longitud)
+        return value
+
 class FotoRecepcion(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     recepcion_id = db.Column(db.Integer, db.ForeignKey('recepcion.id'), nullable=False)
     tipo = db.Column(db.String(20), nullable=False)  # carnet, patente, carga
     ruta_archivo = db.Column(db.String(200), nullable=False)
-    fecha_subida = db.Column(db.DateTime, default=datetime.utcnow)
\ No newline at end of file
+    ruta_thumb = db.Column(db.String(200), nullable=True)  # variante WebP miniatura
+    ruta_medium = db.Column(db.String(200), nullable=True)  # variante WebP mediana
+    fecha_subida = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_foto_recepcion_recepcion_id', 'recepcion_id'),
+    )
+
+class TokenRevocado(db.Model):
+    jti = db.Column(db.String(36), primary_key=True)
+    expira = db.Column(db.DateTime, nullable=False, index=True)  # exp del token; luego se puede purgar
+
+class SesionSubida(db.Model):
+    # Subida reanudable de una foto: los trozos se escriben en un archivo parcial
+    id = db.Column(db.String(32), primary_key=True)
+    usuario_id = db.Column(db.Integer, db.ForeignKey("usuario.id"), nullable=False)
+    tipo_movimiento = db.Column(db.String(20), nullable=False)  # despacho, recepcion
+    movimiento_id = db.Column(db.Integer, nullable=False)
+    tipo = db.Column(db.String(20), nullable=False)  # carnet, patente, carga
+    extension = db.Column(db.String(10), nullable=False)
+    tamano_total = db.Column(db.Integer, nullable=False)
+    recibido = db.Column(db.Integer, nullable=False, default=0)
+    fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
+    fecha_actualizacion = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+
+class EventoAuditoria(db.Model):
+    # Sin FK a usuario: el evento debe sobrevivir a la eliminación del usuario
+    __tablename__ = "audit_event"
+    id = db.Column(db.Integer, primary_key=True)
+    fecha = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    usuario_id = db.Column(db.Integer, nullable=True)
+    accion = db.Column(db.String(20), nullable=False)  # crear, actualizar, eliminar, login, login_fallido, logout
+    entidad = db.Column(db.String(30), nullable=False)  # despacho, recepcion, foto_despacho, foto_recepcion, usuario
+    entidad_id = db.Column(db.Integer, nullable=True)
+    referencia = db.Column(db.String(50), nullable=True, index=True)  # número de guía o RUT
+    ip = db.Column(db.String(45), nullable=True)
+    detalle = db.Column(db.JSON, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_audit_event_usuario_fecha', 'usuario_id', 'fecha'),
+        db.Index('ix_audit_event_entidad_fecha', 'entidad', 'entidad_id', 'fecha'),
+    )
+
+class EstadisticaHora(db.Model):
+    # Movimientos y fotos agregados por hora, usuario, empresa y tipo (ver app/utils/estadisticas.py)
+    __tablename__ = "estadistica_hora"
+    id = db.Column(db.Integer, primary_key=True)
+    hora = db.Column(db.DateTime, nullable=False, index=True)
+    tipo_movimiento = db.Column(db.String(20), nullable=False)  # despacho, recepcion
+    usuario_id = db.Column(db.Integer, nullable=False)
+    rut_empresa_cuerpo = db.Column(db.Integer, nullable=True)
+    movimientos = db.Column(db.Integer, nullable=False, default=0)
+    fotos = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('ix_estadistica_hora_usuario_hora', 'usuario_id', 'hora'),
+        db.Index('ix_estadistica_hora_rut_hora', 'rut_empresa_cuerpo', 'hora'),
+    )
+
+# Índices de los filtros del historial y del mapa (ver migraciones a1f3c9d2e7b4, b9d4f1a6c273, e5c8a2d7f390 y f7b3d9e1a524)
+db.Index('ix_despacho_usuario_fecha', Despacho.usuario_id, Despacho.fecha.desc())
+db.Index('ix_despacho_rut_cuerpo_guia', Despacho.rut_empresa_cuerpo, Despacho.numero_guia)
+db.Index('ix_despacho_geohash_fecha', Despacho.geohash, Despacho.fecha)
+db.Index('ix_despacho_zona_fecha', Despacho.zona, Despacho.fecha)
+db.Index('ix_despacho_rut_empresa_trgm', Despacho.rut_empresa,
+         postgresql_using='gin', postgresql_ops={'rut_empresa': 'gin_trgm_ops'})
+db.Index('ix_despacho_numero_guia_trgm', Despacho.numero_guia,
+         postgresql_using='gin', postgresql_ops={'numero_guia': 'gin_trgm_ops'})
+
+db.Index('ix_recepcion_usuario_fecha', Recepcion.usuario_id, Recepcion.fecha.desc())
+db.Index('ix_recepcion_rut_cuerpo_guia', Recepcion.rut_empresa_cuerpo, Recepcion.numero_guia)
+db.Index('ix_recepcion_geohash_fecha', Recepcion.geohash, Recepcion.fecha)
+db.Index('ix_recepcion_zona_fecha', Recepcion.zona, Recepcion.fecha)
+db.Index('ix_recepcion_rut_empresa_trgm', Recepcion.rut_empresa,
+         postgresql_using='gin', postgresql_ops={'rut_empresa': 'gin_trgm_ops'})
+db.Index('ix_recepcion_numero_guia_trgm', Recepcion.numero_guia,
+         postgresql_using='gin', postgresql_ops={'numero_guia': 'gin_trgm_ops'})
+
+# Búsqueda de texto en observacion (ver migración d3a7f9c1e462 y app/utils/busqueda.py):
+# índice GIN sobre el tsvector en Postgres, tabla FTS5 con triggers en SQLite
+for _modelo in (Despacho, Recepcion):
+    # La expresión empieza con la configuración y no con una columna: la tabla se asigna explícitamente
+    _modelo.__table__.append_constraint(
+        db.Index(f'ix_{_modelo.__tablename__}_observacion_fts', vector_observacion(_modelo),
+                 postgresql_using='gin').ddl_if(dialect='postgresql')
+    )
+    for _sentencia in ddl_fts_sqlite(_modelo.__tablename__):
+        event.listen(_modelo.__table__, 'after_create', DDL(_sentencia).execute_if(dialect='sqlite'))
+    event.listen(_modelo.__table__, 'before_drop',
+                 DDL(f'DROP TABLE IF EXISTS {_modelo.__tablename__}_fts').execute_if(dialect='sqlite'))
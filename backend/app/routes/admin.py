@@ -1,14 +1,34 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from app import db
-from app.models import Usuario, Despacho, Recepcion, FotoDespacho, FotoRecepcion
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from app.models import Usuario, Despacho, Recepcion, FotoDespacho, FotoRecepcion, EventoAuditoria, EstadisticaHora
+from flask_jwt_extended import jwt_required
 import logging
+from datetime import datetime, timedelta
+from app.utils.streaming import respuesta_streaming
+from app.utils.auditoria import auditoria
+from app.utils.cache_historial import cache_historial
+from app.utils.file_handler import liberar_archivo
+from app.utils.paginacion import paginar_por_cursor, parametros_pagina
+from app.utils.principales import es_admin, principales
+from app.utils.estadisticas import truncar_fecha
+from app.utils.rut import filtro_rut, calcular_dv, partes_rut
+from sqlalchemy import select, func
 
 admin_bp = Blueprint("admin", __name__)
 
 def es_superusuario():
-    usuario_actual = Usuario.query.get(get_jwt_identity())
-    return usuario_actual and getattr(usuario_actual, "es_superusuario", False)
+    # Claim tipo_usuario del token + principal cacheado: sin consultas por solicitud
+    return es_admin()
+
+def _rango_fechas(dias_por_defecto=None):
+    """(desde, hasta) de los parámetros desde/hasta (YYYY-MM-DD, hasta inclusive). ValueError si no parsean."""
+    desde = request.args.get("desde")
+    hasta = request.args.get("hasta")
+    desde = datetime.strptime(desde, "%Y-%m-%d") if desde else None
+    hasta = datetime.strptime(hasta, "%Y-%m-%d") + timedelta(days=1) if hasta else None
+    if desde is None and dias_por_defecto:
+        desde = (hasta or datetime.utcnow()) - timedelta(days=dias_por_defecto)
+    return desde, hasta
 
 # --- Gestión de usuarios ---
 
@@ -17,22 +37,28 @@ def es_superusuario():
 def crear_usuario():
     ip = request.remote_addr
     if not es_superusuario():
-        logging.warning(f"[{ip}] Intento NO AUTORIZADO de crear usuario")
+        logging.warning("[%s] Intento NO AUTORIZADO de crear usuario", ip)
         return jsonify({"msg": "No autorizado"}), 403
-    data = request.get_json()
-    logging.info(f"[{ip}] Creando usuario con datos: {data}")
+    data = request.get_json(silent=True) or {}
+    logging.info("[%s] Creando usuario con datos: %s", ip, {k: v for k, v in data.items() if k != "password"})
+    if not isinstance(data.get("password"), str) or not data["password"]:
+        return jsonify({"msg": "La contraseña es obligatoria"}), 400
+    cuerpo, dv = partes_rut(data.get("rut"))
+    if cuerpo is not None and Usuario.query.filter_by(rut_cuerpo=cuerpo, rut_dv=dv).first():
+        # El RUT normalizado no tiene restricción única: '12.345.678-5' y '12345678-5' son el mismo
+        return jsonify({"msg": "Ya existe un usuario con ese RUT"}), 409
     usuario = Usuario(
+        rut=data.get("rut"),
+        correo=data.get("correo"),
         nombre=data.get("nombre"),
-        email=data.get("email"),
-        password=data.get("password"),  # Recuerda hashear la contraseña
-        latitud=data.get("latitud"),
-        longitud=data.get("longitud"),
-        dispositivo=data.get("dispositivo"),
-        es_superusuario=data.get("es_superusuario", False)
+        cargo=data.get("cargo"),
+        tipo_usuario=data.get("tipo_usuario", "usuario")
     )
+    usuario.set_password(data.get("password"))
     db.session.add(usuario)
     db.session.commit()
-    logging.info(f"[{ip}] Usuario creado con ID: {usuario.id}")
+    logging.info("[%s] Usuario creado con ID: %s", ip, usuario.id)
+    auditoria.registrar("crear", "usuario", usuario.id)
     return jsonify({"id": usuario.id}), 201
 
 @admin_bp.route("/usuarios", methods=["GET"])
@@ -40,7 +66,7 @@ def crear_usuario():
 def listar_usuarios():
     ip = request.remote_addr
     if not es_superusuario():
-        logging.warning(f"[{ip}] Intento NO AUTORIZADO de listar usuarios")
+        logging.warning("[%s] Intento NO AUTORIZADO de listar usuarios", ip)
         return jsonify({"msg": "No autorizado"}), 403
     usuarios = Usuario.query.all()
     result = []
@@ -48,13 +74,12 @@ def listar_usuarios():
         result.append({
             "id": u.id,
             "nombre": u.nombre,
-            "email": u.email,
-            "latitud": u.latitud,
-            "longitud": u.longitud,
-            "dispositivo": u.dispositivo,
-            "es_superusuario": u.es_superusuario
+            "rut": u.rut,
+            "correo": u.correo,
+            "cargo": u.cargo,
+            "tipo_usuario": u.tipo_usuario
         })
-    logging.info(f"[{ip}] Listado de usuarios solicitado. Total: {len(result)}")
+    logging.info("[%s] Listado de usuarios solicitado. Total: %s", ip, len(result))
     return jsonify(result)
 
 @admin_bp.route("/usuarios/<int:usuario_id>", methods=["PUT"])
@@ -62,18 +87,19 @@ def listar_usuarios():
 def editar_usuario(usuario_id):
     ip = request.remote_addr
     if not es_superusuario():
-        logging.warning(f"[{ip}] Intento NO AUTORIZADO de editar usuario {usuario_id}")
+        logging.warning("[%s] Intento NO AUTORIZADO de editar usuario %s", ip, usuario_id)
         return jsonify({"msg": "No autorizado"}), 403
     usuario = Usuario.query.get_or_404(usuario_id)
     data = request.get_json()
-    logging.info(f"[{ip}] Editando usuario {usuario_id} con datos: {data}")
+    logging.info("[%s] Editando usuario %s con datos: %s", ip, usuario_id, data)
     usuario.nombre = data.get("nombre", usuario.nombre)
-    usuario.email = data.get("email", usuario.email)
-    usuario.latitud = data.get("latitud", usuario.latitud)
-    usuario.longitud = data.get("longitud", usuario.longitud)
-    usuario.es_superusuario = data.get("es_superusuario", usuario.es_superusuario)
+    usuario.correo = data.get("correo", usuario.correo)
+    usuario.cargo = data.get("cargo", usuario.cargo)
+    usuario.tipo_usuario = data.get("tipo_usuario", usuario.tipo_usuario)
     db.session.commit()
-    logging.info(f"[{ip}] Usuario {usuario_id} actualizado")
+    principales.invalidar(usuario_id)
+    logging.info("[%s] Usuario %s actualizado", ip, usuario_id)
+    auditoria.registrar("actualizar", "usuario", usuario_id, detalle=data)
     return jsonify({"msg": "Usuario actualizado"})
 
 @admin_bp.route("/usuarios/<int:usuario_id>", methods=["DELETE"])
@@ -81,12 +107,14 @@ def editar_usuario(usuario_id):
 def eliminar_usuario(usuario_id):
     ip = request.remote_addr
     if not es_superusuario():
-        logging.warning(f"[{ip}] Intento NO AUTORIZADO de eliminar usuario {usuario_id}")
+        logging.warning("[%s] Intento NO AUTORIZADO de eliminar usuario %s", ip, usuario_id)
         return jsonify({"msg": "No autorizado"}), 403
     usuario = Usuario.query.get_or_404(usuario_id)
     db.session.delete(usuario)
     db.session.commit()
-    logging.info(f"[{ip}] Usuario {usuario_id} eliminado")
+    principales.invalidar(usuario_id)
+    logging.info("[%s] Usuario %s eliminado", ip, usuario_id)
+    auditoria.registrar("eliminar", "usuario", usuario_id)
     return jsonify({"msg": "Usuario eliminado"})
 
 @admin_bp.route("/usuarios/<int:usuario_id>/reset_password", methods=["POST"])
@@ -94,13 +122,16 @@ def eliminar_usuario(usuario_id):
 def resetear_password(usuario_id):
     ip = request.remote_addr
     if not es_superusuario():
-        logging.warning(f"[{ip}] Intento NO AUTORIZADO de resetear password usuario {usuario_id}")
+        logging.warning("[%s] Intento NO AUTORIZADO de resetear password usuario %s", ip, usuario_id)
         return jsonify({"msg": "No autorizado"}), 403
     usuario = Usuario.query.get_or_404(usuario_id)
-    data = request.get_json()
-    usuario.password = data.get("password")  # Recuerda hashear la contraseña
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data.get("password"), str) or not data["password"]:
+        return jsonify({"msg": "La contraseña es obligatoria"}), 400
+    usuario.set_password(data.get("password"))
     db.session.commit()
-    logging.info(f"[{ip}] Password reseteado para usuario {usuario_id}")
+    logging.info("[%s] Password reseteado para usuario %s", ip, usuario_id)
+    auditoria.registrar("actualizar", "usuario", usuario_id, detalle={"password": "reseteada"})
     return jsonify({"msg": "Contraseña reseteada"})
 
 @admin_bp.route("/usuarios/<int:usuario_id>/asignar_superusuario", methods=["POST"])
@@ -108,12 +139,14 @@ def resetear_password(usuario_id):
 def asignar_superusuario(usuario_id):
     ip = request.remote_addr
     if not es_superusuario():
-        logging.warning(f"[{ip}] Intento NO AUTORIZADO de asignar superusuario a {usuario_id}")
+        logging.warning("[%s] Intento NO AUTORIZADO de asignar superusuario a %s", ip, usuario_id)
         return jsonify({"msg": "No autorizado"}), 403
     usuario = Usuario.query.get_or_404(usuario_id)
-    usuario.es_superusuario = True
+    usuario.tipo_usuario = "admin"
     db.session.commit()
-    logging.info(f"[{ip}] Usuario {usuario_id} ahora es superusuario")
+    principales.invalidar(usuario_id)
+    logging.info("[%s] Usuario %s ahora es superusuario", ip, usuario_id)
+    auditoria.registrar("actualizar", "usuario", usuario_id, detalle={"superusuario": True})
     return jsonify({"msg": "Usuario ahora es superusuario"})
 
 @admin_bp.route("/usuarios/<int:usuario_id>/quitar_superusuario", methods=["POST"])
@@ -121,12 +154,14 @@ def asignar_superusuario(usuario_id):
 def quitar_superusuario(usuario_id):
     ip = request.remote_addr
     if not es_superusuario():
-        logging.warning(f"[{ip}] Intento NO AUTORIZADO de quitar superusuario a {usuario_id}")
+        logging.warning("[%s] Intento NO AUTORIZADO de quitar superusuario a %s", ip, usuario_id)
         return jsonify({"msg": "No autorizado"}), 403
     usuario = Usuario.query.get_or_404(usuario_id)
-    usuario.es_superusuario = False
+    usuario.tipo_usuario = "usuario"
     db.session.commit()
-    logging.info(f"[{ip}] Usuario {usuario_id} ya no es superusuario")
+    principales.invalidar(usuario_id)
+    logging.info("[%s] Usuario %s ya no es superusuario", ip, usuario_id)
+    auditoria.registrar("actualizar", "usuario", usuario_id, detalle={"superusuario": False})
     return jsonify({"msg": "Usuario ya no es superusuario"})
 
 @admin_bp.route("/usuarios/<int:usuario_id>/eliminar_dispositivo", methods=["POST"])
@@ -134,12 +169,13 @@ def quitar_superusuario(usuario_id):
 def eliminar_dispositivo(usuario_id):
     ip = request.remote_addr
     if not es_superusuario():
-        logging.warning(f"[{ip}] Intento NO AUTORIZADO de eliminar dispositivo usuario {usuario_id}")
+        logging.warning("[%s] Intento NO AUTORIZADO de eliminar dispositivo usuario %s", ip, usuario_id)
         return jsonify({"msg": "No autorizado"}), 403
     usuario = Usuario.query.get_or_404(usuario_id)
     usuario.dispositivo = None
     db.session.commit()
-    logging.info(f"[{ip}] Dispositivo eliminado para usuario {usuario_id}")
+    logging.info("[%s] Dispositivo eliminado para usuario %s", ip, usuario_id)
+    auditoria.registrar("actualizar", "usuario", usuario_id, detalle={"dispositivo": None})
     return jsonify({"msg": "Dispositivo eliminado"})
 
 @admin_bp.route("/usuarios/dispositivos", methods=["GET"])
@@ -147,7 +183,7 @@ def eliminar_dispositivo(usuario_id):
 def listar_usuarios_con_dispositivo():
     ip = request.remote_addr
     if not es_superusuario():
-        logging.warning(f"[{ip}] Intento NO AUTORIZADO de listar usuarios con dispositivo")
+        logging.warning("[%s] Intento NO AUTORIZADO de listar usuarios con dispositivo", ip)
         return jsonify({"msg": "No autorizado"}), 403
     usuarios = Usuario.query.filter(Usuario.dispositivo.isnot(None)).all()
     result = []
@@ -157,7 +193,7 @@ def listar_usuarios_con_dispositivo():
             "nombre": u.nombre,
             "dispositivo": u.dispositivo
         })
-    logging.info(f"[{ip}] Listado de usuarios con dispositivo solicitado. Total: {len(result)}")
+    logging.info("[%s] Listado de usuarios con dispositivo solicitado. Total: %s", ip, len(result))
     return jsonify(result)
 
 # --- Auditoría y control ---
@@ -167,69 +203,131 @@ def listar_usuarios_con_dispositivo():
 def listar_todos_despachos():
     ip = request.remote_addr
     if not es_superusuario():
-        logging.warning(f"[{ip}] Intento NO AUTORIZADO de listar despachos")
+        logging.warning("[%s] Intento NO AUTORIZADO de listar despachos", ip)
         return jsonify({"msg": "No autorizado"}), 403
-    despachos = Despacho.query.all()
-    result = []
-    for d in despachos:
-        result.append({
+
+    def serializar(d):
+        return {
             "id": d.id,
             "numero_guia": d.numero_guia,
             "rut_empresa": d.rut_empresa,
             "usuario_id": d.usuario_id,
             "latitud": d.latitud,
             "longitud": d.longitud
-        })
-    logging.info(f"[{ip}] Listado de despachos solicitado. Total: {len(result)}")
-    return jsonify(result)
+        }
+
+    def al_terminar(total):
+        logging.info("[%s] Listado de despachos solicitado. Total: %s", ip, total)
+
+    return respuesta_streaming(Despacho.query.order_by(Despacho.id), serializar, al_terminar)
 
 @admin_bp.route("/recepciones", methods=["GET"])
 @jwt_required()
 def listar_todas_recepciones():
     ip = request.remote_addr
     if not es_superusuario():
-        logging.warning(f"[{ip}] Intento NO AUTORIZADO de listar recepciones")
+        logging.warning("[%s] Intento NO AUTORIZADO de listar recepciones", ip)
         return jsonify({"msg": "No autorizado"}), 403
-    recepciones = Recepcion.query.all()
-    result = []
-    for r in recepciones:
-        result.append({
+
+    def serializar(r):
+        return {
             "id": r.id,
             "numero_guia": r.numero_guia,
             "rut_empresa": r.rut_empresa,
             "usuario_id": r.usuario_id,
             "latitud": r.latitud,
             "longitud": r.longitud
-        })
-    logging.info(f"[{ip}] Listado de recepciones solicitado. Total: {len(result)}")
-    return jsonify(result)
+        }
+
+    def al_terminar(total):
+        logging.info("[%s] Listado de recepciones solicitado. Total: %s", ip, total)
+
+    return respuesta_streaming(Recepcion.query.order_by(Recepcion.id), serializar, al_terminar)
 
 @admin_bp.route("/usuarios/<int:usuario_id>/historial", methods=["GET"])
 @jwt_required()
 def historial_usuario(usuario_id):
     ip = request.remote_addr
     if not es_superusuario():
-        logging.warning(f"[{ip}] Intento NO AUTORIZADO de ver historial usuario {usuario_id}")
+        logging.warning("[%s] Intento NO AUTORIZADO de ver historial usuario %s", ip, usuario_id)
         return jsonify({"msg": "No autorizado"}), 403
     despachos = Despacho.query.filter_by(usuario_id=usuario_id).all()
     recepciones = Recepcion.query.filter_by(usuario_id=usuario_id).all()
-    logging.info(f"[{ip}] Historial solicitado para usuario {usuario_id}")
+    logging.info("[%s] Historial solicitado para usuario %s", ip, usuario_id)
     return jsonify({
         "despachos": [{"id": d.id, "numero_guia": d.numero_guia} for d in despachos],
         "recepciones": [{"id": r.id, "numero_guia": r.numero_guia} for r in recepciones]
     })
 
+@admin_bp.route("/auditoria", methods=["GET"])
+@jwt_required()
+def consultar_auditoria():
+    """
+    Eventos de auditoría, del más reciente al más antiguo, paginados por
+    cursor (next_cursor). Filtros: usuario_id, entidad, entidad_id, accion,
+    referencia (número de guía o RUT), desde y hasta (YYYY-MM-DD).
+    """
+    ip = request.remote_addr
+    if not es_superusuario():
+        logging.warning("[%s] Intento NO AUTORIZADO de consultar auditoría", ip)
+        return jsonify({"msg": "No autorizado"}), 403
+    _, per_page = parametros_pagina(por_defecto=50)
+    per_page = min(per_page, 200)
+    query = EventoAuditoria.query
+    for campo in ("usuario_id", "entidad_id"):
+        valor = request.args.get(campo, type=int)
+        if valor is not None:
+            query = query.filter(getattr(EventoAuditoria, campo) == valor)
+    for campo in ("entidad", "accion", "referencia"):
+        valor = request.args.get(campo)
+        if valor:
+            query = query.filter(getattr(EventoAuditoria, campo) == valor)
+    try:
+        desde, hasta = _rango_fechas()
+    except ValueError:
+        return jsonify({"msg": "Fecha inválida, use YYYY-MM-DD"}), 400
+    if desde:
+        query = query.filter(EventoAuditoria.fecha >= desde)
+    if hasta:
+        query = query.filter(EventoAuditoria.fecha < hasta)
+
+    try:
+        eventos, next_cursor = paginar_por_cursor(query, EventoAuditoria, request.args.get("cursor"), per_page)
+    except ValueError as e:
+        return jsonify({"msg": str(e)}), 400
+    logging.info("[%s] Consulta de auditoría: %s eventos", ip, len(eventos))
+    return jsonify({
+        "eventos": [{
+            "id": e.id,
+            "fecha": e.fecha,
+            "usuario_id": e.usuario_id,
+            "accion": e.accion,
+            "entidad": e.entidad,
+            "entidad_id": e.entidad_id,
+            "referencia": e.referencia,
+            "ip": e.ip,
+            "detalle": e.detalle
+        } for e in eventos],
+        "next_cursor": next_cursor
+    })
+
 @admin_bp.route("/despachos/<int:despacho_id>", methods=["DELETE"])
 @jwt_required()
 def eliminar_despacho(despacho_id):
     ip = request.remote_addr
     if not es_superusuario():
-        logging.warning(f"[{ip}] Intento NO AUTORIZADO de eliminar despacho {despacho_id}")
+        logging.warning("[%s] Intento NO AUTORIZADO de eliminar despacho %s", ip, despacho_id)
         return jsonify({"msg": "No autorizado"}), 403
     despacho = Despacho.query.get_or_404(despacho_id)
+    # Las fotos primero: la FK no tiene ON DELETE y el contenido se libera por referencia
+    for foto in despacho.fotos:
+        liberar_archivo(current_app.config["UPLOAD_FOLDER"], foto.ruta_archivo)
+        db.session.delete(foto)
     db.session.delete(despacho)
     db.session.commit()
-    logging.info(f"[{ip}] Despacho {despacho_id} eliminado")
+    cache_historial.invalidar(despacho.usuario_id)
+    logging.info("[%s] Despacho %s eliminado", ip, despacho_id)
+    auditoria.registrar("eliminar", "despacho", despacho_id, despacho.numero_guia)
     return jsonify({"msg": "Despacho eliminado"})
 
 @admin_bp.route("/recepciones/<int:recepcion_id>", methods=["DELETE"])
@@ -237,12 +335,18 @@ def eliminar_despacho(despacho_id):
 def eliminar_recepcion(recepcion_id):
     ip = request.remote_addr
     if not es_superusuario():
-        logging.warning(f"[{ip}] Intento NO AUTORIZADO de eliminar recepcion {recepcion_id}")
+        logging.warning("[%s] Intento NO AUTORIZADO de eliminar recepcion %s", ip, recepcion_id)
         return jsonify({"msg": "No autorizado"}), 403
     recepcion = Recepcion.query.get_or_404(recepcion_id)
+    # Las fotos primero: la FK no tiene ON DELETE y el contenido se libera por referencia
+    for foto in recepcion.fotos:
+        liberar_archivo(current_app.config["UPLOAD_FOLDER"], foto.ruta_archivo)
+        db.session.delete(foto)
     db.session.delete(recepcion)
     db.session.commit()
-    logging.info(f"[{ip}] Recepción {recepcion_id} eliminada")
+    cache_historial.invalidar(recepcion.usuario_id)
+    logging.info("[%s] Recepción %s eliminada", ip, recepcion_id)
+    auditoria.registrar("eliminar", "recepcion", recepcion_id, recepcion.numero_guia)
     return jsonify({"msg": "Recepción eliminada"})
 
 @admin_bp.route("/fotos_despacho/<int:foto_id>", methods=["DELETE"])
@@ -250,12 +354,16 @@ def eliminar_recepcion(recepcion_id):
 def eliminar_foto_despacho(foto_id):
     ip = request.remote_addr
     if not es_superusuario():
-        logging.warning(f"[{ip}] Intento NO AUTORIZADO de eliminar foto despacho {foto_id}")
+        logging.warning("[%s] Intento NO AUTORIZADO de eliminar foto despacho %s", ip, foto_id)
         return jsonify({"msg": "No autorizado"}), 403
     foto = FotoDespacho.query.get_or_404(foto_id)
+    propietario = foto.despacho.usuario_id
+    liberar_archivo(current_app.config["UPLOAD_FOLDER"], foto.ruta_archivo)
     db.session.delete(foto)
     db.session.commit()
-    logging.info(f"[{ip}] Foto de despacho {foto_id} eliminada")
+    cache_historial.invalidar(propietario)
+    logging.info("[%s] Foto de despacho %s eliminada", ip, foto_id)
+    auditoria.registrar("eliminar", "foto_despacho", foto_id, detalle={"despacho_id": foto.despacho_id, "tipo": foto.tipo})
     return jsonify({"msg": "Foto de despacho eliminada"})
 
 @admin_bp.route("/fotos_recepcion/<int:foto_id>", methods=["DELETE"])
@@ -263,46 +371,159 @@ def eliminar_foto_despacho(foto_id):
 def eliminar_foto_recepcion(foto_id):
     ip = request.remote_addr
     if not es_superusuario():
-        logging.warning(f"[{ip}] Intento NO AUTORIZADO de eliminar foto recepcion {foto_id}")
+        logging.warning("[%s] Intento NO AUTORIZADO de eliminar foto recepcion %s", ip, foto_id)
         return jsonify({"msg": "No autorizado"}), 403
     foto = FotoRecepcion.query.get_or_404(foto_id)
+    propietario = foto.recepcion.usuario_id
+    liberar_archivo(current_app.config["UPLOAD_FOLDER"], foto.ruta_archivo)
     db.session.delete(foto)
     db.session.commit()
-    logging.info(f"[{ip}] Foto de recepción {foto_id} eliminada")
+    cache_historial.invalidar(propietario)
+    logging.info("[%s] Foto de recepción %s eliminada", ip, foto_id)
+    auditoria.registrar("eliminar", "foto_recepcion", foto_id, detalle={"recepcion_id": foto.recepcion_id, "tipo": foto.tipo})
     return jsonify({"msg": "Foto de recepción eliminada"})
 
 # --- Estadísticas ---
+# Se responden desde estadistica_hora, que recalcula `flask actualizar-estadisticas` (cron:
+# la ventana reciente cada pocos minutos y todo el historial una vez al día)
+
+def _filtrar_estadisticas(query, dias_por_defecto=30, tipo=None):
+    """
+    Aplica los filtros comunes: desde, hasta, tipo, usuario_id y rut_empresa.
+    Sin desde se toman los últimos dias_por_defecto días (None: sin límite);
+    tipo, si se indica, reemplaza al del query string.
+    """
+    desde, hasta = _rango_fechas(dias_por_defecto=dias_por_defecto)
+    if desde:
+        query = query.where(EstadisticaHora.hora >= desde)
+    if hasta:
+        query = query.where(EstadisticaHora.hora < hasta)
+    tipo = tipo or request.args.get("tipo")
+    if tipo in ("despacho", "recepcion"):
+        query = query.where(EstadisticaHora.tipo_movimiento == tipo)
+    usuario_id = request.args.get("usuario_id", type=int)
+    if usuario_id is not None:
+        query = query.where(EstadisticaHora.usuario_id == usuario_id)
+    rut_empresa = request.args.get("rut_empresa")
+    if rut_empresa:
+        query = query.where(filtro_rut(EstadisticaHora.rut_empresa_cuerpo, rut_empresa))
+    return query
+
+def _totales(tipo):
+    """Totales de un tipo con los filtros comunes; sin desde/hasta, de todo el historial."""
+    movimientos, fotos = db.session.execute(_filtrar_estadisticas(
+        select(func.coalesce(func.sum(EstadisticaHora.movimientos), 0),
+               func.coalesce(func.sum(EstadisticaHora.fotos), 0)),
+        dias_por_defecto=None, tipo=tipo
+    )).one()
+    return movimientos, fotos
 
 @admin_bp.route("/estadisticas/usuarios", methods=["GET"])
 @jwt_required()
 def estadisticas_usuarios():
     ip = request.remote_addr
     if not es_superusuario():
-        logging.warning(f"[{ip}] Intento NO AUTORIZADO de ver estadísticas de usuarios")
+        logging.warning("[%s] Intento NO AUTORIZADO de ver estadísticas de usuarios", ip)
         return jsonify({"msg": "No autorizado"}), 403
-    total = Usuario.query.count()
-    activos = Usuario.query.filter(Usuario.dispositivo.isnot(None)).count()
-    logging.info(f"[{ip}] Estadísticas de usuarios solicitadas")
-    return jsonify({"total_usuarios": total, "usuarios_con_dispositivo": activos})
+    por_tipo = dict(db.session.execute(
+        select(Usuario.tipo_usuario, func.count()).group_by(Usuario.tipo_usuario)
+    ).all())
+    activos = db.session.scalar(
+        select(func.count(func.distinct(EstadisticaHora.usuario_id)))
+        .where(EstadisticaHora.hora >= datetime.utcnow() - timedelta(days=30))
+    )
+    logging.info("[%s] Estadísticas de usuarios solicitadas", ip)
+    return jsonify({
+        "total_usuarios": sum(por_tipo.values()),
+        "por_tipo": por_tipo,
+        "usuarios_activos_30_dias": activos
+    })
 
 @admin_bp.route("/estadisticas/despachos", methods=["GET"])
 @jwt_required()
 def estadisticas_despachos():
     ip = request.remote_addr
     if not es_superusuario():
-        logging.warning(f"[{ip}] Intento NO AUTORIZADO de ver estadísticas de despachos")
+        logging.warning("[%s] Intento NO AUTORIZADO de ver estadísticas de despachos", ip)
         return jsonify({"msg": "No autorizado"}), 403
-    total = Despacho.query.count()
-    logging.info(f"[{ip}] Estadísticas de despachos solicitadas")
-    return jsonify({"total_despachos": total})
+    try:
+        total, fotos = _totales("despacho")
+    except ValueError:
+        return jsonify({"msg": "Fecha inválida, use YYYY-MM-DD"}), 400
+    logging.info("[%s] Estadísticas de despachos solicitadas", ip)
+    return jsonify({"total_despachos": total, "total_fotos": fotos})
 
 @admin_bp.route("/estadisticas/recepciones", methods=["GET"])
 @jwt_required()
 def estadisticas_recepciones():
     ip = request.remote_addr
     if not es_superusuario():
-        logging.warning(f"[{ip}] Intento NO AUTORIZADO de ver estadísticas de recepciones")
+        logging.warning("[%s] Intento NO AUTORIZADO de ver estadísticas de recepciones", ip)
         return jsonify({"msg": "No autorizado"}), 403
-    total = Recepcion.query.count()
-    logging.info(f"[{ip}] Estadísticas de recepciones solicitadas")
-    return jsonify({"total_recepciones": total})
\ No newline at end of file
+    try:
+        total, fotos = _totales("recepcion")
+    except ValueError:
+        return jsonify({"msg": "Fecha inválida, use YYYY-MM-DD"}), 400
+    logging.info("[%s] Estadísticas de recepciones solicitadas", ip)
+    return jsonify({"total_recepciones": total, "total_fotos": fotos})
+
+@admin_bp.route("/estadisticas/serie", methods=["GET"])
+@jwt_required()
+def estadisticas_serie():
+    """
+    Serie de tiempo de movimientos y fotos por hora o día (intervalo=hora|dia).
+    Filtros: desde, hasta (por defecto últimos 30 días), tipo, usuario_id, rut_empresa.
+    """
+    ip = request.remote_addr
+    if not es_superusuario():
+        logging.warning("[%s] Intento NO AUTORIZADO de ver serie de estadísticas", ip)
+        return jsonify({"msg": "No autorizado"}), 403
+    unidad = "hour" if request.args.get("intervalo") == "hora" else "day"
+    periodo = truncar_fecha(EstadisticaHora.hora, unidad).label("periodo")
+    try:
+        query = _filtrar_estadisticas(
+            select(periodo, func.sum(EstadisticaHora.movimientos), func.sum(EstadisticaHora.fotos))
+        )
+    except ValueError:
+        return jsonify({"msg": "Fecha inválida, use YYYY-MM-DD"}), 400
+    filas = db.session.execute(query.group_by(periodo).order_by(periodo)).all()
+    logging.info("[%s] Serie de estadísticas solicitada: %s puntos", ip, len(filas))
+    return jsonify({
+        "intervalo": "hora" if unidad == "hour" else "dia",
+        "serie": [{"periodo": p.isoformat(), "movimientos": m, "fotos": f} for p, m, f in filas]
+    })
+
+@admin_bp.route("/estadisticas/top", methods=["GET"])
+@jwt_required()
+def estadisticas_top():
+    """
+    Los `limite` usuarios o empresas (por=usuario|rut_empresa) con más
+    movimientos en el rango. Acepta los mismos filtros que /estadisticas/serie.
+    """
+    ip = request.remote_addr
+    if not es_superusuario():
+        logging.warning("[%s] Intento NO AUTORIZADO de ver top de estadísticas", ip)
+        return jsonify({"msg": "No autorizado"}), 403
+    por = request.args.get("por", "usuario")
+    if por not in ("usuario", "rut_empresa"):
+        return jsonify({"msg": "'por' debe ser 'usuario' o 'rut_empresa'"}), 400
+    limite = max(min(request.args.get("limite", 10, type=int), 100), 1)
+    clave = EstadisticaHora.usuario_id if por == "usuario" else EstadisticaHora.rut_empresa_cuerpo
+    movimientos = func.sum(EstadisticaHora.movimientos).label("movimientos")
+    try:
+        query = _filtrar_estadisticas(select(clave, movimientos, func.sum(EstadisticaHora.fotos)))
+    except ValueError:
+        return jsonify({"msg": "Fecha inválida, use YYYY-MM-DD"}), 400
+    filas = db.session.execute(
+        query.where(clave.isnot(None)).group_by(clave).order_by(movimientos.desc()).limit(limite)
+    ).all()
+
+    if por == "usuario":
+        nombres = dict(db.session.execute(
+            select(Usuario.id, Usuario.nombre).where(Usuario.id.in_([f[0] for f in filas]))
+        ).all())
+        top = [{"usuario_id": u, "nombre": nombres.get(u), "movimientos": m, "fotos": f} for u, m, f in filas]
+    else:
+        top = [{"rut_empresa": f"{c}-{calcular_dv(c)}", "movimientos": m, "fotos": f} for c, m, f in filas]
+    logging.info("[%s] Top de estadísticas por %s solicitado", ip, por)
+    return jsonify({"por": por, "top": top})
@@ -1,61 +1,92 @@
-from flask import Blueprint, request, jsonify
-from app import db
+from flask import Blueprint, request, jsonify, current_app
+from app import db, limiter
 from app.models import Usuario
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt
 from app.schemas import LoginSchema
-from app import jwt_blacklist
-from flask_limiter import Limiter
+from app.utils.revocacion import revocacion
+from app.utils.auditoria import auditoria
+from app.utils.principales import claims_usuario
+from app.utils.contrasenas import pool_hash, necesita_rehash, HashSaturado
+from app.utils.rut import partes_rut
 from flask_limiter.util import get_remote_address
 import logging
 
 auth_bp = Blueprint("auth", __name__)
-limiter = Limiter(key_func=get_remote_address)
+
+def clave_login():
+    # Por cuenta: todos los dispositivos de bodega salen por la misma IP
+    data = request.get_json(silent=True)
+    data = data if isinstance(data, dict) else {}
+    cuerpo, dv = partes_rut(data.get("rut"))
+    return f"login:{cuerpo}-{dv}" if cuerpo is not None else f"ip:{get_remote_address()}"
 
 @auth_bp.route("/login", methods=["POST"])
-@limiter.limit("5 per minute")
+@limiter.limit("5 per minute", key_func=clave_login)
+@limiter.limit(lambda: current_app.config["LOGIN_LIMITE_IP"], key_func=get_remote_address)
 def login():
     schema = LoginSchema()
     data = request.get_json()
     ip = request.remote_addr
-    logging.info(f"Intento de login desde IP {ip} con datos: {data}")
+    # Nunca registrar la contraseña en texto plano
+    datos_log = {k: v for k, v in data.items() if k != "password"} if isinstance(data, dict) else data
+    logging.info("Intento de login desde IP %s con datos: %s", ip, datos_log)
 
     if not data:
-        logging.error(f"Login fallido: No se recibió JSON. IP: {ip}")
+        logging.error("Login fallido: No se recibió JSON. IP: %s", ip)
         return jsonify(msg="No se recibió información"), 400
 
     errors = schema.validate(data)
     if errors:
-        logging.warning(f"Validación fallida desde IP {ip}: {errors}")
+        logging.warning("Validación fallida desde IP %s: %s", ip, errors)
         return jsonify(errors), 400
 
     rut = data.get("rut")
     password = data.get("password")
 
     if not rut or not password:
-        logging.error(f"Login fallido: Faltan campos obligatorios. IP: {ip}, Data: {data}")
+        logging.error("Login fallido: Faltan campos obligatorios. IP: %s, Data: %s", ip, datos_log)
         return jsonify(msg="Faltan campos obligatorios"), 400
 
     try:
-        user = Usuario.query.filter_by(rut=rut).first()
+        user = Usuario.por_rut(rut)
     except Exception as e:
-        logging.critical(f"Error de base de datos al buscar usuario {rut} desde IP {ip}: {e}")
+        logging.critical("Error de base de datos al buscar usuario %s desde IP %s: %s", rut, ip, e)
         return jsonify(msg="Error interno"), 500
 
+    try:
+        # El hash corre en el pool acotado; también sin usuario, para igualar tiempos
+        password_valida = pool_hash.verificar(user.password_hash if user else None, password)
+    except HashSaturado:
+        logging.warning("Login rechazado por saturación del hashing para RUT %s desde IP %s", rut, ip)
+        return jsonify(msg="Servicio ocupado, reintente"), 503, {"Retry-After": "1"}
+
     if not user:
-        logging.warning(f"Login fallido: Usuario no encontrado para RUT {rut} desde IP {ip}")
+        logging.warning("Login fallido: Usuario no encontrado para RUT %s desde IP %s", rut, ip)
+        auditoria.registrar("login_fallido", "usuario", referencia=rut, detalle={"motivo": "usuario_no_encontrado"})
         return jsonify(msg="Credenciales inválidas"), 401
 
-    if not user.check_password(password):
-        logging.warning(f"Login fallido: Contraseña incorrecta para RUT {rut} desde IP {ip}")
+    if not password_valida:
+        logging.warning("Login fallido: Contraseña incorrecta para RUT %s desde IP %s", rut, ip)
+        auditoria.registrar("login_fallido", "usuario", user.id, rut, {"motivo": "password_incorrecta"}, usuario_id=user.id)
         return jsonify(msg="Credenciales inválidas"), 401
 
+    if necesita_rehash(user.password_hash):
+        # Cambió PASSWORD_HASH_METHOD: se aprovecha que tenemos la contraseña en claro
+        try:
+            user.password_hash = pool_hash.hashear(password)
+            db.session.commit()
+            logging.info("Hash de contraseña actualizado para usuario %s", user.id)
+        except HashSaturado:
+            pass  # se reintenta en el próximo login
+
     try:
-        token = create_access_token(identity=str(user.id))
+        token = create_access_token(identity=str(user.id), additional_claims=claims_usuario(user))
     except Exception as e:
-        logging.critical(f"Error al crear token para usuario {rut} desde IP {ip}: {e}")
+        logging.critical("Error al crear token para usuario %s desde IP %s: %s", rut, ip, e)
         return jsonify(msg="Error interno"), 500
 
-    logging.info(f"Login exitoso para usuario {rut} (ID: {user.id}) desde IP {ip}")
+    logging.info("Login exitoso para usuario %s (ID: %s) desde IP %s", rut, user.id, ip)
+    auditoria.registrar("login", "usuario", user.id, rut, usuario_id=user.id)
     return jsonify(access_token=token), 200
 
 @auth_bp.route("/logout", methods=["POST"])
@@ -63,23 +94,21 @@ def login():
 def logout():
     try:
         jti = get_jwt()["jti"]
+        exp = get_jwt()["exp"]
         ip = request.remote_addr
         user_id = get_jwt().get("sub")
     except Exception as e:
-        logging.error(f"Error obteniendo datos del JWT en logout: {e}")
+        logging.error("Error obteniendo datos del JWT en logout: %s", e)
         return jsonify(msg="Token inválido"), 400
 
-    logging.info(f"Intento de logout. Usuario ID: {user_id}, IP: {ip}, JTI: {jti}")
-
-    if jti in jwt_blacklist:
-        logging.warning(f"Intento de logout con token ya revocado. Usuario ID: {user_id}, IP: {ip}")
-        return jsonify(msg="Token ya revocado"), 400
+    logging.info("Intento de logout. Usuario ID: %s, IP: %s, JTI: %s", user_id, ip, jti)
 
     try:
-        jwt_blacklist.add(jti)
+        revocacion.revocar(jti, exp)
     except Exception as e:
-        logging.critical(f"Error al agregar JTI al blacklist en logout. Usuario ID: {user_id}, IP: {ip}, Error: {e}")
+        logging.critical("Error al agregar JTI al blacklist en logout. Usuario ID: %s, IP: %s, Error: %s", user_id, ip, e)
         return jsonify(msg="Error interno"), 500
 
-    logging.info(f"Logout exitoso. Usuario ID: {user_id}, IP: {ip}")
+    logging.info("Logout exitoso. Usuario ID: %s, IP: %s", user_id, ip)
+    auditoria.registrar("logout", "usuario", int(user_id))
     return jsonify(msg="Token revocado, sesión cerrada"), 200
\ No newline at end of file
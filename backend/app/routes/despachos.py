@@ -1,21 +1,26 @@
 from flask import Blueprint, request, jsonify, send_file
-from app import db
+from app import db, limiter
 from app.models import Despacho, FotoDespacho
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from datetime import datetime
 import os
 from app.schemas import DespachoSchema
-from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
 import logging
-from werkzeug.utils import secure_filename
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
+from app.utils.imagenes import programar_variantes
+from app.utils.file_handler import guardar_archivo, liberar_archivo
+from app.utils.paginacion import paginar_por_cursor, contar, parametros_pagina, MODOS_TOTAL
+from app.utils.streaming import respuesta_streaming
+from app.utils.rut import filtro_rut
+from app.utils.auditoria import auditoria, valores, diferencias
+from app.utils.cache_historial import cache_historial, historial_cacheado
 
 despachos_bp = Blueprint("despachos", __name__)
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
 MAX_FILE_SIZE = 2 * 1024 * 1024  # 2 MB
-
-limiter = Limiter(key_func=get_remote_address)
+CAMPOS_AUDITADOS = ("numero_guia", "rut_empresa", "observacion", "latitud", "longitud")
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -31,9 +36,16 @@ def crear_despacho():
     ip = request.remote_addr
 
     if errors:
-        logging.warning(f"Creación de despacho fallida por usuario {usuario_id} desde IP {ip}: errores {errors}")
+        logging.warning("Creación de despacho fallida por usuario %s desde IP %s: errores %s", usuario_id, ip, errors)
         return jsonify(errors), 400
 
+    clave = data.get("clave_idempotencia") or None
+    if clave:
+        existente = Despacho.query.filter_by(usuario_id=usuario_id, clave_idempotencia=clave).first()
+        if existente:
+            logging.info("Despacho %s ya creado con clave %s por usuario %s desde IP %s", existente.id, clave, usuario_id, ip)
+            return jsonify({"id": existente.id}), 200
+
     latitud = request.form.get("latitud", type=float)
     longitud = request.form.get("longitud", type=float)
     observacion = data.get("observacion")
@@ -44,11 +56,23 @@ def crear_despacho():
         usuario_id=usuario_id,
         latitud=latitud,
         longitud=longitud,
-        observacion=observacion
+        observacion=observacion,
+        clave_idempotencia=clave
     )
     db.session.add(despacho)
-    db.session.commit()
-    logging.info(f"Creación de despacho {despacho.id} por usuario {usuario_id} desde IP {ip} con datos: {data}, latitud: {latitud}, longitud: {longitud}, observacion: {observacion}")
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Dos envíos con la misma clave al mismo tiempo: el otro ya la creó
+        db.session.rollback()
+        existente = Despacho.query.filter_by(usuario_id=usuario_id, clave_idempotencia=clave).first() if clave else None
+        if existente is None:
+            raise
+        logging.info("Despacho %s ya creado con clave %s por usuario %s desde IP %s (envío simultáneo)", existente.id, clave, usuario_id, ip)
+        return jsonify({"id": existente.id}), 200
+    cache_historial.invalidar(despacho.usuario_id)
+    logging.info("Creación de despacho %s por usuario %s desde IP %s con datos: %s, latitud: %s, longitud: %s, observacion: %s", despacho.id, usuario_id, ip, data, latitud, longitud, observacion)
+    auditoria.registrar("crear", "despacho", despacho.id, despacho.numero_guia, valores(despacho, CAMPOS_AUDITADOS))
     return jsonify({"id": despacho.id}), 201
 
 @despachos_bp.route("/", methods=["GET"])
@@ -56,10 +80,8 @@ def crear_despacho():
 def listar_despachos():
     usuario_id = get_jwt_identity()
     ip = request.remote_addr
-    despachos = Despacho.query.all()
-    result = []
-    for d in despachos:
-        result.append({
+    def serializar(d):
+        return {
             "id": d.id,
             "numero_guia": d.numero_guia,
             "rut_empresa": d.rut_empresa,
@@ -68,25 +90,32 @@ def listar_despachos():
             "latitud": d.latitud,
             "longitud": d.longitud,
             "observacion": d.observacion
-        })
-    logging.info(f"Listado de despachos solicitado por usuario {usuario_id} desde IP {ip}. Total: {len(result)}")
-    return jsonify(result)
+        }
+
+    def al_terminar(total):
+        logging.info("Listado de despachos solicitado por usuario %s desde IP %s. Total: %s", usuario_id, ip, total)
+
+    return respuesta_streaming(Despacho.query.order_by(Despacho.id), serializar, al_terminar)
 
 @despachos_bp.route("/historial", methods=["GET"])
 @jwt_required()
+@historial_cacheado
 def historial_despachos():
     usuario_id = get_jwt_identity()
     ip = request.remote_addr
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 10, type=int)
+    page, per_page = parametros_pagina()
     rut_empresa = request.args.get('rut_empresa')
     numero_guia = request.args.get('numero_guia')
     fecha_inicio = request.args.get('fecha_inicio')
     fecha_fin = request.args.get('fecha_fin')
+    cursor = request.args.get('cursor')
+    modo_total = request.args.get('total', 'exact')
+    if modo_total not in MODOS_TOTAL:
+        modo_total = 'exact'
 
     query = Despacho.query.filter_by(usuario_id=usuario_id)
     if rut_empresa:
-        query = query.filter(Despacho.rut_empresa == rut_empresa)
+        query = query.filter(filtro_rut(Despacho.rut_empresa_cuerpo, rut_empresa))
     if numero_guia:
         query = query.filter(Despacho.numero_guia == numero_guia)
     if fecha_inicio:
@@ -94,15 +123,27 @@ def historial_despachos():
             fecha_inicio_dt = datetime.strptime(fecha_inicio, "%Y-%m-%d")
             query = query.filter(Despacho.fecha >= fecha_inicio_dt)
         except Exception as e:
-            logging.warning(f"Error parseando fecha_inicio: {fecha_inicio} - {e}")
+            logging.warning("Error parseando fecha_inicio: %s - %s", fecha_inicio, e)
     if fecha_fin:
         try:
             fecha_fin_dt = datetime.strptime(fecha_fin, "%Y-%m-%d")
             query = query.filter(Despacho.fecha <= fecha_fin_dt)
         except Exception as e:
-            logging.warning(f"Error parseando fecha_fin: {fecha_fin} - {e}")
+            logging.warning("Error parseando fecha_fin: %s - %s", fecha_fin, e)
 
-    despachos = query.order_by(Despacho.fecha.desc()).paginate(page=page, per_page=per_page)
+    next_cursor = None
+    current_page = None
+    if cursor is not None:
+        try:
+            items, next_cursor = paginar_por_cursor(query, Despacho, cursor, per_page)
+        except ValueError as e:
+            return jsonify({"msg": str(e)}), 400
+    else:
+        paginacion = query.order_by(Despacho.fecha.desc()).paginate(page=page, per_page=per_page, count=False)
+        items = paginacion.items
+        current_page = paginacion.page
+    total = contar(query, modo_total)
+    pages = (total + per_page - 1) // per_page if total is not None else None
     result = [{
         "id": d.id,
         "numero_guia": d.numero_guia,
@@ -112,13 +153,14 @@ def historial_despachos():
         "latitud": d.latitud,
         "longitud": d.longitud,
         "observacion": d.observacion
-    } for d in despachos.items]
-    logging.info(f"Historial de despachos solicitado por usuario {usuario_id} desde IP {ip}. Página: {page}, Total: {despachos.total}")
+    } for d in items]
+    logging.info("Historial de despachos solicitado por usuario %s desde IP %s. Página: %s, Total: %s", usuario_id, ip, page, total)
     return jsonify({
         "despachos": result,
-        "total": despachos.total,
-        "pages": despachos.pages,
-        "current_page": despachos.page
+        "total": total,
+        "pages": pages,
+        "current_page": current_page,
+        "next_cursor": next_cursor
     })
 
 @despachos_bp.route("/<int:despacho_id>", methods=["GET"])
@@ -126,12 +168,13 @@ def historial_despachos():
 def detalle_despacho(despacho_id):
     usuario_id = get_jwt_identity()
     ip = request.remote_addr
-    despacho = Despacho.query.get_or_404(despacho_id)
+    despacho = db.get_or_404(Despacho, despacho_id, options=[selectinload(Despacho.fotos)])
     fotos = [
-        {"id": f.id, "tipo": f.tipo, "ruta_archivo": f.ruta_archivo}
+        {"id": f.id, "tipo": f.tipo, "ruta_archivo": f.ruta_archivo,
+         "ruta_thumb": f.ruta_thumb, "ruta_medium": f.ruta_medium}
         for f in despacho.fotos
     ]
-    logging.info(f"Detalle de despacho {despacho_id} solicitado por usuario {usuario_id} desde IP {ip}")
+    logging.info("Detalle de despacho %s solicitado por usuario %s desde IP %s", despacho_id, usuario_id, ip)
     return jsonify({
         "id": despacho.id,
         "numero_guia": despacho.numero_guia,
@@ -156,48 +199,61 @@ def subir_fotos_despacho(despacho_id):
     archivos = request.files.getlist("archivo")
 
     if not tipo or not archivos:
-        logging.warning(f"Falta tipo o archivos para despacho {despacho_id} por usuario {usuario_id} desde IP {ip}")
+        logging.warning("Falta tipo o archivos para despacho %s por usuario %s desde IP %s", despacho_id, usuario_id, ip)
         return jsonify({"msg": "Falta el tipo o los archivos"}), 400
 
     if tipo not in ['carnet', 'patente', 'carga']:
-        logging.warning(f"Tipo inválido '{tipo}' para despacho {despacho_id} por usuario {usuario_id} desde IP {ip}")
+        logging.warning("Tipo inválido '%s' para despacho %s por usuario %s desde IP %s", tipo, despacho_id, usuario_id, ip)
         return jsonify({"msg": "Tipo de foto inválido"}), 400
 
     uploads_folder = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'uploads'))
     os.makedirs(uploads_folder, exist_ok=True)
 
-    fotos_guardadas = []
+    fotos_nuevas = []
+    fotos_repetidas = []
 
     for archivo in archivos:
         if not allowed_file(archivo.filename):
-            logging.warning(f"Archivo no permitido para despacho {despacho_id} por usuario {usuario_id} desde IP {ip}")
+            logging.warning("Archivo no permitido para despacho %s por usuario %s desde IP %s", despacho_id, usuario_id, ip)
             continue
 
         archivo.seek(0, os.SEEK_END)
         size = archivo.tell()
         archivo.seek(0)
         if size > MAX_FILE_SIZE:
-            logging.warning(f"Archivo excede tamaño en despacho {despacho_id} por usuario {usuario_id} desde IP {ip}")
+            logging.warning("Archivo excede tamaño en despacho %s por usuario %s desde IP %s", despacho_id, usuario_id, ip)
             continue
 
-        filename = secure_filename(f"{tipo}_{datetime.utcnow().strftime('%Y%m%d%H%M%S%f')}_{archivo.filename}")
-        ruta = os.path.join(uploads_folder, filename)
-        archivo.save(ruta)
+        extension = archivo.filename.rsplit('.', 1)[1]
+        ruta_archivo = guardar_archivo(archivo.stream, uploads_folder, extension)
+
+        existente = next((f for f in despacho.fotos + fotos_nuevas if f.tipo == tipo and f.ruta_archivo == ruta_archivo), None)
+        if existente:
+            # Misma foto reenviada por un cliente que reintenta: no se duplica
+            liberar_archivo(uploads_folder, ruta_archivo)
+            fotos_repetidas.append(existente)
+            continue
 
         foto = FotoDespacho(
             despacho_id=despacho.id,
             tipo=tipo,
-            ruta_archivo=filename
+            ruta_archivo=ruta_archivo
         )
         db.session.add(foto)
-        fotos_guardadas.append({
-            "id": foto.id,
-            "tipo": tipo,
-            "ruta_archivo": filename
-        })
+        fotos_nuevas.append(foto)
 
     db.session.commit()
-    logging.info(f"{len(fotos_guardadas)} fotos subidas para despacho {despacho_id} por usuario {usuario_id} desde IP {ip}")
+    cache_historial.invalidar(despacho.usuario_id)
+    programar_variantes(FotoDespacho, fotos_nuevas)
+    fotos_guardadas = [{
+        "id": foto.id,
+        "tipo": foto.tipo,
+        "ruta_archivo": foto.ruta_archivo
+    } for foto in fotos_repetidas + fotos_nuevas]
+    logging.info("%s fotos subidas para despacho %s por usuario %s desde IP %s", len(fotos_guardadas), despacho_id, usuario_id, ip)
+    if fotos_nuevas:
+        auditoria.registrar("crear", "foto_despacho", despacho_id, despacho.numero_guia,
+                            {"fotos": [{"id": f.id, "tipo": f.tipo} for f in fotos_nuevas]})
     
     return jsonify({"fotos": fotos_guardadas}), 201
 
@@ -210,15 +266,18 @@ def actualizar_despacho(despacho_id):
     usuario_id = get_jwt_identity()
     ip = request.remote_addr
     if errors:
-        logging.warning(f"Actualización fallida de despacho {despacho_id} por usuario {usuario_id} desde IP {ip}: errores {errors}")
+        logging.warning("Actualización fallida de despacho %s por usuario %s desde IP %s: errores %s", despacho_id, usuario_id, ip, errors)
         return jsonify(errors), 400
 
     despacho = Despacho.query.get_or_404(despacho_id)
+    anteriores = valores(despacho, CAMPOS_AUDITADOS)
     despacho.numero_guia = data["numero_guia"]
     despacho.rut_empresa = data["rut_empresa"]
     despacho.latitud = request.form.get("latitud", type=float)
     despacho.longitud = request.form.get("longitud", type=float)
     despacho.observacion = data.get("observacion")
     db.session.commit()
-    logging.info(f"Actualización de despacho {despacho_id} por usuario {usuario_id} desde IP {ip} con nuevos datos: {data}")
+    cache_historial.invalidar(despacho.usuario_id)
+    logging.info("Actualización de despacho %s por usuario %s desde IP %s con nuevos datos: %s", despacho_id, usuario_id, ip, data)
+    auditoria.registrar("actualizar", "despacho", despacho_id, despacho.numero_guia, diferencias(anteriores, despacho))
     return jsonify({"msg": "Despacho actualizado"}), 200
@@ -1,14 +1,23 @@
-from flask import Blueprint, request, jsonify, send_from_directory
+from flask import Blueprint, request, jsonify
 from app.models import Despacho, Recepcion, FotoDespacho, db
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from datetime import datetime
+from sqlalchemy import select, union_all, literal, func
+from sqlalchemy.orm import selectinload
 import os
-from werkzeug.utils import secure_filename
+from app.utils.imagenes import programar_variantes
+from app.utils.file_handler import guardar_archivo, servir_archivo
+from app.utils.paginacion import paginar_por_cursor, contar, parametros_pagina, MODOS_TOTAL
+from app.utils.rut import filtro_rut
+from app.utils.cache_historial import cache_historial, historial_cacheado
+from app.utils.busqueda import select_busqueda, LARGO_MINIMO
+from app.utils.principales import es_admin
 
 historial_bp = Blueprint("historial", __name__)
 
 UPLOAD_FOLDER = os.path.join(os.getcwd(), "app", "uploads")
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+MAX_IDS_DETALLE = 100
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -19,6 +28,29 @@ def parse_date(date_str):
     except Exception:
         return None
 
+def _select_movimientos(modelo, tipo, usuario_id, rut_empresa, numero_guia, fecha_inicio, fecha_fin):
+    """SELECT de un tipo de movimiento con las columnas comunes del historial unificado."""
+    query = select(
+        modelo.id,
+        literal(tipo).label("tipo"),
+        modelo.numero_guia,
+        modelo.rut_empresa,
+        modelo.fecha,
+    ).where(modelo.usuario_id == usuario_id)
+    if rut_empresa:
+        query = query.where(filtro_rut(modelo.rut_empresa_cuerpo, rut_empresa))
+    if numero_guia:
+        query = query.where(modelo.numero_guia.ilike(f"%{numero_guia}%"))
+    if fecha_inicio:
+        query = query.where(modelo.fecha >= fecha_inicio)
+    if fecha_fin:
+        query = query.where(modelo.fecha <= fecha_fin)
+    return query
+
+def _top_movimientos(query, modelo, limite):
+    top = query.order_by(modelo.fecha.desc(), modelo.id.desc()).limit(limite).subquery()
+    return select(top)
+
 def construir_url_archivo(nombre_archivo):
     if not nombre_archivo:
         return None
@@ -26,7 +58,7 @@ def construir_url_archivo(nombre_archivo):
 
 @historial_bp.route("/uploads/<path:filename>", methods=["GET"])
 def uploaded_file(filename):
-    return send_from_directory(UPLOAD_FOLDER, filename)
+    return servir_archivo(UPLOAD_FOLDER, filename)
 
 @historial_bp.route("/historial/test", methods=["GET"])
 def test_historial():
@@ -47,9 +79,7 @@ def subir_foto_despacho(despacho_id):
     if not file or not allowed_file(file.filename) or not tipo:
         return jsonify({"error": "Archivo inválido o tipo no especificado"}), 400
 
-    filename = secure_filename(f"{datetime.utcnow().timestamp()}_{file.filename}")
-    save_path = os.path.join(UPLOAD_FOLDER, filename)
-    file.save(save_path)
+    filename = guardar_archivo(file.stream, UPLOAD_FOLDER, file.filename.rsplit('.', 1)[1])
 
     nueva_foto = FotoDespacho(
         despacho_id=despacho_id,
@@ -58,6 +88,8 @@ def subir_foto_despacho(despacho_id):
     )
     db.session.add(nueva_foto)
     db.session.commit()
+    cache_historial.invalidar(despacho.usuario_id)
+    programar_variantes(FotoDespacho, [nueva_foto])
 
     return jsonify({
         "mensaje": f"Foto '{tipo}' subida correctamente",
@@ -67,10 +99,10 @@ def subir_foto_despacho(despacho_id):
 
 @historial_bp.route("/historial", methods=["GET"])
 @jwt_required()
+@historial_cacheado
 def historial_movimientos():
     usuario_id = get_jwt_identity()
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 10, type=int)
+    page, per_page = parametros_pagina()
 
     rut_empresa = request.args.get('rut_empresa', '').strip()
     numero_guia = request.args.get('numero_guia', '').strip()
@@ -79,51 +111,38 @@ def historial_movimientos():
 
     fecha_inicio = parse_date(fecha_inicio_str)
     fecha_fin = parse_date(fecha_fin_str)
-
-    # Despachos
-    despachos_query = Despacho.query.filter_by(usuario_id=usuario_id)
-    if rut_empresa:
-        despachos_query = despachos_query.filter(Despacho.rut_empresa.ilike(f"%{rut_empresa}%"))
-    if numero_guia:
-        despachos_query = despachos_query.filter(Despacho.numero_guia.ilike(f"%{numero_guia}%"))
-    if fecha_inicio:
-        despachos_query = despachos_query.filter(Despacho.fecha >= fecha_inicio)
-    if fecha_fin:
-        despachos_query = despachos_query.filter(Despacho.fecha <= fecha_fin)
-    despachos = despachos_query.all()
-
-    # Recepciones
-    recepciones_query = Recepcion.query.filter_by(usuario_id=usuario_id)
-    if rut_empresa:
-        recepciones_query = recepciones_query.filter(Recepcion.rut_empresa.ilike(f"%{rut_empresa}%"))
-    if numero_guia:
-        recepciones_query = recepciones_query.filter(Recepcion.numero_guia.ilike(f"%{numero_guia}%"))
-    if fecha_inicio:
-        recepciones_query = recepciones_query.filter(Recepcion.fecha >= fecha_inicio)
-    if fecha_fin:
-        recepciones_query = recepciones_query.filter(Recepcion.fecha <= fecha_fin)
-    recepciones = recepciones_query.all()
-
-    movimientos = [{
-        "id": d.id,
-        "tipo": "despacho",
-        "numero_guia": d.numero_guia,
-        "rut_empresa": d.rut_empresa,
-        "fecha": d.fecha.isoformat(),
-    } for d in despachos] + [{
-        "id": r.id,
-        "tipo": "recepcion",
-        "numero_guia": r.numero_guia,
-        "rut_empresa": r.rut_empresa,
-        "fecha": r.fecha.isoformat(),
-    } for r in recepciones]
-
-    movimientos.sort(key=lambda x: x["fecha"], reverse=True)
-    total = len(movimientos)
-    pages = (total + per_page - 1) // per_page
-    start = (page - 1) * per_page
-    end = start + per_page
-    movimientos_paginados = movimientos[start:end]
+    modo_total = request.args.get('total', 'exact')
+    if modo_total not in MODOS_TOTAL:
+        modo_total = 'exact'
+
+    despachos_sel = _select_movimientos(Despacho, "despacho", usuario_id, rut_empresa, numero_guia, fecha_inicio, fecha_fin)
+    recepciones_sel = _select_movimientos(Recepcion, "recepcion", usuario_id, rut_empresa, numero_guia, fecha_inicio, fecha_fin)
+
+    # Con total=none (o approx en Postgres) la primera página no lee todo el historial
+    total = contar(union_all(despachos_sel, recepciones_sel), modo_total)
+
+    # Cada rama se corta a page * per_page filas usando el índice (usuario_id, fecha DESC),
+    # así la página se arma en la base sin leer todo el historial del usuario.
+    limite = page * per_page
+    movimientos_union = union_all(
+        _top_movimientos(despachos_sel, Despacho, limite),
+        _top_movimientos(recepciones_sel, Recepcion, limite),
+    ).subquery()
+    filas = db.session.execute(
+        select(movimientos_union)
+        .order_by(movimientos_union.c.fecha.desc(), movimientos_union.c.id.desc())
+        .limit(per_page)
+        .offset((page - 1) * per_page)
+    ).all()
+
+    movimientos_paginados = [{
+        "id": m.id,
+        "tipo": m.tipo,
+        "numero_guia": m.numero_guia,
+        "rut_empresa": m.rut_empresa,
+        "fecha": m.fecha.isoformat(),
+    } for m in filas]
+    pages = (total + per_page - 1) // per_page if total is not None else None
 
     return jsonify({
         "movimientos": movimientos_paginados,
@@ -132,21 +151,76 @@ def historial_movimientos():
         "current_page": page
     })
 
+@historial_bp.route("/historial/buscar", methods=["GET"])
+@jwt_required()
+@historial_cacheado
+def buscar_movimientos():
+    """
+    Busca en los movimientos del usuario por palabras de la observación
+    (texto completo, configuración 'spanish') y por fragmentos de número de
+    guía o RUT (trigram). Resultados ordenados por relevancia y luego fecha.
+    Parámetros: q, tipo (despacho|recepcion, opcional), page, per_page.
+    """
+    usuario_id = get_jwt_identity()
+    texto = request.args.get('q', '').strip()
+    tipo = request.args.get('tipo', '').strip()
+    page, per_page = parametros_pagina()
+
+    if len(texto) < LARGO_MINIMO:
+        return jsonify({"error": f"La búsqueda debe tener al menos {LARGO_MINIMO} caracteres"}), 400
+    if tipo and tipo not in ("despacho", "recepcion"):
+        return jsonify({"error": "tipo debe ser 'despacho' o 'recepcion'"}), 400
+
+    selects = []
+    if tipo in ("", "despacho"):
+        selects.append(select_busqueda(Despacho, "despacho", usuario_id, texto))
+    if tipo in ("", "recepcion"):
+        selects.append(select_busqueda(Recepcion, "recepcion", usuario_id, texto))
+    resultados = union_all(*selects).subquery()
+
+    total = db.session.execute(select(func.count()).select_from(resultados)).scalar()
+    filas = db.session.execute(
+        select(resultados)
+        .order_by(resultados.c.rango.desc(), resultados.c.fecha.desc(), resultados.c.id.desc())
+        .limit(per_page)
+        .offset((page - 1) * per_page)
+    ).all()
+
+    return jsonify({
+        "resultados": [{
+            "id": m.id,
+            "tipo": m.tipo,
+            "numero_guia": m.numero_guia,
+            "rut_empresa": m.rut_empresa,
+            "fecha": m.fecha.isoformat(),
+            "observacion": m.observacion,
+            "rango": round(float(m.rango), 4),
+        } for m in filas],
+        "total": total,
+        "pages": (total + per_page - 1) // per_page,
+        "current_page": page
+    })
+
 @historial_bp.route("/historial/despachos", methods=["GET"])
 @jwt_required()
+@historial_cacheado
 def historial_despachos():
     usuario_id = get_jwt_identity()
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 10, type=int)
+    page, per_page = parametros_pagina()
 
     rut_empresa = request.args.get('rut_empresa', '').strip()
     numero_guia = request.args.get('numero_guia', '').strip()
     fecha_inicio = parse_date(request.args.get('fecha_inicio', '').strip())
     fecha_fin = parse_date(request.args.get('fecha_fin', '').strip())
 
+    cursor = request.args.get('cursor')
+    modo_total = request.args.get('total', 'exact')
+    if modo_total not in MODOS_TOTAL:
+        modo_total = 'exact'
+
     query = Despacho.query.filter_by(usuario_id=usuario_id)
     if rut_empresa:
-        query = query.filter(Despacho.rut_empresa.ilike(f"%{rut_empresa}%"))
+        query = query.filter(filtro_rut(Despacho.rut_empresa_cuerpo, rut_empresa))
     if numero_guia:
         query = query.filter(Despacho.numero_guia.ilike(f"%{numero_guia}%"))
     if fecha_inicio:
@@ -154,9 +228,16 @@ def historial_despachos():
     if fecha_fin:
         query = query.filter(Despacho.fecha <= fecha_fin)
 
-    total = query.count()
-    despachos = query.order_by(Despacho.fecha.desc()).paginate(page=page, per_page=per_page, error_out=False).items
-    pages = (total + per_page - 1) // per_page
+    next_cursor = None
+    if cursor is not None:
+        try:
+            despachos, next_cursor = paginar_por_cursor(query, Despacho, cursor, per_page)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+    else:
+        despachos = query.order_by(Despacho.fecha.desc()).paginate(page=page, per_page=per_page, error_out=False, count=False).items
+    total = contar(query, modo_total)
+    pages = (total + per_page - 1) // per_page if total is not None else None
 
     return jsonify({
         "despachos": [
@@ -170,24 +251,31 @@ def historial_despachos():
         ],
         "total": total,
         "pages": pages,
-        "current_page": page
+        # Con cursor no hay número de página
+        "current_page": page if cursor is None else None,
+        "next_cursor": next_cursor
     })
 
 @historial_bp.route("/historial/recepciones", methods=["GET"])
 @jwt_required()
+@historial_cacheado
 def historial_recepciones():
     usuario_id = get_jwt_identity()
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 10, type=int)
+    page, per_page = parametros_pagina()
 
     rut_empresa = request.args.get('rut_empresa', '').strip()
     numero_guia = request.args.get('numero_guia', '').strip()
     fecha_inicio = parse_date(request.args.get('fecha_inicio', '').strip())
     fecha_fin = parse_date(request.args.get('fecha_fin', '').strip())
 
+    cursor = request.args.get('cursor')
+    modo_total = request.args.get('total', 'exact')
+    if modo_total not in MODOS_TOTAL:
+        modo_total = 'exact'
+
     query = Recepcion.query.filter_by(usuario_id=usuario_id)
     if rut_empresa:
-        query = query.filter(Recepcion.rut_empresa.ilike(f"%{rut_empresa}%"))
+        query = query.filter(filtro_rut(Recepcion.rut_empresa_cuerpo, rut_empresa))
     if numero_guia:
         query = query.filter(Recepcion.numero_guia.ilike(f"%{numero_guia}%"))
     if fecha_inicio:
@@ -195,9 +283,16 @@ def historial_recepciones():
     if fecha_fin:
         query = query.filter(Recepcion.fecha <= fecha_fin)
 
-    total = query.count()
-    recepciones = query.order_by(Recepcion.fecha.desc()).paginate(page=page, per_page=per_page, error_out=False).items
-    pages = (total + per_page - 1) // per_page
+    next_cursor = None
+    if cursor is not None:
+        try:
+            recepciones, next_cursor = paginar_por_cursor(query, Recepcion, cursor, per_page)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+    else:
+        recepciones = query.order_by(Recepcion.fecha.desc()).paginate(page=page, per_page=per_page, error_out=False, count=False).items
+    total = contar(query, modo_total)
+    pages = (total + per_page - 1) // per_page if total is not None else None
 
     return jsonify({
         "recepciones": [
@@ -211,20 +306,26 @@ def historial_recepciones():
         ],
         "total": total,
         "pages": pages,
-        "current_page": page
+        # Con cursor no hay número de página
+        "current_page": page if cursor is None else None,
+        "next_cursor": next_cursor
     })
 
-@historial_bp.route("/detalle/despacho/<int:id>", methods=["GET"])
-@jwt_required()
-def detalle_despacho(id):
-    despacho = Despacho.query.get_or_404(id)
-
+def _detalle_movimiento(movimiento):
     fotos_carnet = []
     fotos_patente = []
     fotos_carga = []
+    fotos = []
 
-    for foto in despacho.fotos:
+    for foto in movimiento.fotos:
         url = construir_url_archivo(foto.ruta_archivo)
+        fotos.append({
+            "id": foto.id,
+            "tipo": foto.tipo,
+            "url": url,
+            "thumb_url": construir_url_archivo(foto.ruta_thumb),
+            "medium_url": construir_url_archivo(foto.ruta_medium)
+        })
         if foto.tipo == "carnet":
             fotos_carnet.append(url)
         elif foto.tipo == "patente":
@@ -232,40 +333,70 @@ def detalle_despacho(id):
         elif foto.tipo == "carga":
             fotos_carga.append(url)
 
-    return jsonify({
-        "rut_empresa": despacho.rut_empresa,
-        "numero_guia": despacho.numero_guia,
-        "fecha": despacho.fecha.isoformat(),
+    return {
+        "rut_empresa": movimiento.rut_empresa,
+        "numero_guia": movimiento.numero_guia,
+        "fecha": movimiento.fecha.isoformat(),
         "fotos_carnet_urls": fotos_carnet,
         "fotos_patente_urls": fotos_patente,
         "fotos_carga_urls": fotos_carga,
-        "observacion": despacho.observacion or ""
+        "fotos": fotos,
+        "observacion": movimiento.observacion or ""
+    }
+
+def _parse_ids(ids_str):
+    ids = []
+    vistos = set()
+    for valor in ids_str.split(","):
+        valor = valor.strip()
+        if valor.isdigit() and int(valor) not in vistos:
+            vistos.add(int(valor))
+            ids.append(int(valor))
+    return ids
+
+def _detalle_lote(modelo, clave):
+    """
+    Detalle de varios movimientos en una sola respuesta con un plan fijo de
+    dos consultas: una para los movimientos y un SELECT ... IN para sus fotos.
+    Salvo para admin, los ids de otros usuarios se informan como no encontrados.
+    """
+    ids = _parse_ids(request.args.get("ids", ""))
+    if not ids:
+        return jsonify({"msg": "Debe indicar ids"}), 400
+    if len(ids) > MAX_IDS_DETALLE:
+        return jsonify({"msg": f"Máximo {MAX_IDS_DETALLE} ids por solicitud"}), 400
+
+    query = modelo.query.filter(modelo.id.in_(ids))
+    if not es_admin():
+        query = query.filter(modelo.usuario_id == int(get_jwt_identity()))
+    movimientos = query.options(selectinload(modelo.fotos)).all()
+    por_id = {m.id: m for m in movimientos}
+    return jsonify({
+        clave: [
+            {"id": id, **_detalle_movimiento(por_id[id])}
+            for id in ids if id in por_id
+        ],
+        "no_encontrados": [id for id in ids if id not in por_id]
     })
 
+@historial_bp.route("/detalle/despacho/<int:id>", methods=["GET"])
+@jwt_required()
+def detalle_despacho(id):
+    despacho = db.get_or_404(Despacho, id, options=[selectinload(Despacho.fotos)])
+    return jsonify(_detalle_movimiento(despacho))
+
 @historial_bp.route("/detalle/recepcion/<int:id>", methods=["GET"])
 @jwt_required()
 def detalle_recepcion(id):
-    recepcion = Recepcion.query.get_or_404(id)
-
-    fotos_carnet = []
-    fotos_patente = []
-    fotos_carga = []
+    recepcion = db.get_or_404(Recepcion, id, options=[selectinload(Recepcion.fotos)])
+    return jsonify(_detalle_movimiento(recepcion))
 
-    for foto in recepcion.fotos:
-        url = construir_url_archivo(foto.ruta_archivo)
-        if foto.tipo == "carnet":
-            fotos_carnet.append(url)
-        elif foto.tipo == "patente":
-            fotos_patente.append(url)
-        elif foto.tipo == "carga":
-            fotos_carga.append(url)
+@historial_bp.route("/detalle/despachos", methods=["GET"])
+@jwt_required()
+def detalle_despachos_lote():
+    return _detalle_lote(Despacho, "despachos")
 
-    return jsonify({
-        "rut_empresa": recepcion.rut_empresa,
-        "numero_guia": recepcion.numero_guia,
-        "fecha": recepcion.fecha.isoformat(),
-        "fotos_carnet_urls": fotos_carnet,
-        "fotos_patente_urls": fotos_patente,
-        "fotos_carga_urls": fotos_carga,
-        "observacion": recepcion.observacion or ""
-    })
+@historial_bp.route("/detalle/recepciones", methods=["GET"])
+@jwt_required()
+def detalle_recepciones_lote():
+    return _detalle_lote(Recepcion, "recepciones")
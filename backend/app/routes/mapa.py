@@ -0,0 +1,149 @@
+from flask import Blueprint, request, jsonify
+from app import db
+from app.models import Despacho, Recepcion
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from datetime import datetime, timedelta
+from sqlalchemy import select, union_all, literal, func
+from app.utils.geohash import cubrir, caja, caja_radio, precision_para, filtro_geohash, filtro_radio
+from app.utils.principales import es_admin
+
+mapa_bp = Blueprint("mapa", __name__)
+
+MODELOS = {"despacho": Despacho, "recepcion": Recepcion}
+LIMITE_PUNTOS = 5000
+MAX_CELDAS = 1024
+RADIO_MAXIMO = 200_000  # metros
+
+def _area():
+    """
+    (sur, oeste, norte, este, radio) desde bbox=oeste,sur,este,norte (orden
+    GeoJSON) o desde lat, lon y radio en metros. ValueError si falta o es inválida.
+    """
+    if request.args.get("bbox"):
+        oeste, sur, este, norte = (float(v) for v in request.args["bbox"].split(","))
+        if not (-90 <= sur <= norte <= 90 and -180 <= oeste <= este <= 180):
+            raise ValueError("bbox inválido (oeste,sur,este,norte; no puede cruzar el antimeridiano)")
+        return sur, oeste, norte, este, None
+    if request.args.get("lat") and request.args.get("lon") and request.args.get("radio"):
+        latitud, longitud, metros = float(request.args["lat"]), float(request.args["lon"]), float(request.args["radio"])
+        if not (-90 <= latitud <= 90 and -180 <= longitud <= 180 and 0 < metros <= RADIO_MAXIMO):
+            raise ValueError(f"lat/lon fuera de rango o radio fuera de (0, {RADIO_MAXIMO}] metros")
+        return (*caja_radio(latitud, longitud, metros), (latitud, longitud, metros))
+    raise ValueError("Indique bbox=oeste,sur,este,norte o lat, lon y radio")
+
+def _filtros(modelo, sur, oeste, norte, este, radio):
+    """Condiciones comunes: celdas que cubren el área, coordenadas exactas, ventana de fechas y usuario."""
+    condiciones = [
+        filtro_geohash(modelo.geohash, cubrir(sur, oeste, norte, este)),
+        modelo.latitud.between(sur, norte),
+        modelo.longitud.between(oeste, este),
+    ]
+    if radio:
+        condiciones.append(filtro_radio(modelo.latitud, modelo.longitud, *radio))
+    desde = request.args.get("desde")
+    hasta = request.args.get("hasta")
+    if desde:
+        condiciones.append(modelo.fecha >= datetime.strptime(desde, "%Y-%m-%d"))
+    if hasta:
+        condiciones.append(modelo.fecha < datetime.strptime(hasta, "%Y-%m-%d") + timedelta(days=1))
+    # Supervisores (admin) ven todo, o a un usuario con usuario_id; el resto sólo lo propio
+    if not es_admin():
+        condiciones.append(modelo.usuario_id == int(get_jwt_identity()))
+    elif request.args.get("usuario_id", type=int):
+        condiciones.append(modelo.usuario_id == request.args.get("usuario_id", type=int))
+    return condiciones
+
+def _tipos():
+    tipo = request.args.get("tipo")
+    if tipo and tipo not in MODELOS:
+        raise ValueError("tipo debe ser 'despacho' o 'recepcion'")
+    return [tipo] if tipo else list(MODELOS)
+
+@mapa_bp.route("/movimientos", methods=["GET"])
+@jwt_required()
+def movimientos_en_area():
+    """Movimientos con coordenadas dentro del área y la ventana de fechas, más recientes primero."""
+    try:
+        sur, oeste, norte, este, radio = _area()
+        tipos = _tipos()
+        selects = [
+            select(
+                modelo.id, literal(tipo).label("tipo"), modelo.numero_guia, modelo.rut_empresa,
+                modelo.fecha, modelo.latitud, modelo.longitud, modelo.zona, modelo.usuario_id
+            ).where(*_filtros(modelo, sur, oeste, norte, este, radio))
+            for tipo, modelo in ((t, MODELOS[t]) for t in tipos)
+        ]
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    limite = max(min(request.args.get("limite", 1000, type=int), LIMITE_PUNTOS), 1)
+
+    puntos = union_all(*selects).subquery()
+    filas = db.session.execute(
+        select(puntos).order_by(puntos.c.fecha.desc(), puntos.c.id.desc()).limit(limite + 1)
+    ).all()
+
+    return jsonify({
+        "movimientos": [{
+            "id": m.id,
+            "tipo": m.tipo,
+            "numero_guia": m.numero_guia,
+            "rut_empresa": m.rut_empresa,
+            "fecha": m.fecha.isoformat(),
+            "latitud": m.latitud,
+            "longitud": m.longitud,
+            "zona": m.zona,
+            "usuario_id": m.usuario_id,
+        } for m in filas[:limite]],
+        # Con truncado=true conviene pedir /mapa/clusters o acotar el área
+        "truncado": len(filas) > limite
+    })
+
+@mapa_bp.route("/clusters", methods=["GET"])
+@jwt_required()
+def clusters_en_area():
+    """
+    Agrupa los movimientos del área por celda geohash en la base y entrega
+    una fila por celda (cantidad y centroide). La precisión se elige para que
+    el área quede en a lo más `celdas` celdas (64 por defecto).
+    """
+    try:
+        sur, oeste, norte, este, radio = _area()
+        tipos = _tipos()
+        celdas = min(max(request.args.get("celdas", 64, type=int), 1), MAX_CELDAS)
+        precision = precision_para(sur, oeste, norte, este, celdas)
+        selects = []
+        for tipo in tipos:
+            modelo = MODELOS[tipo]
+            celda = func.substr(modelo.geohash, 1, precision)
+            selects.append(
+                select(
+                    celda.label("celda"),
+                    func.count().label("cantidad"),
+                    func.sum(modelo.latitud).label("suma_latitud"),
+                    func.sum(modelo.longitud).label("suma_longitud"),
+                ).where(*_filtros(modelo, sur, oeste, norte, este, radio)).group_by(celda)
+            )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    por_tipo = union_all(*selects).subquery()
+    filas = db.session.execute(
+        select(
+            por_tipo.c.celda,
+            func.sum(por_tipo.c.cantidad).label("cantidad"),
+            func.sum(por_tipo.c.suma_latitud).label("suma_latitud"),
+            func.sum(por_tipo.c.suma_longitud).label("suma_longitud"),
+        ).group_by(por_tipo.c.celda)
+    ).all()
+
+    return jsonify({
+        "precision": precision,
+        "clusters": [{
+            "geohash": f.celda,
+            "cantidad": int(f.cantidad),
+            "latitud": f.suma_latitud / f.cantidad,
+            "longitud": f.suma_longitud / f.cantidad,
+            "caja": caja(f.celda),
+        } for f in filas],
+        "total": sum(int(f.cantidad) for f in filas)
+    })
@@ -1,21 +1,26 @@
-from flask import Blueprint, request, jsonify, send_file
-from app import db
+from flask import Blueprint, request, jsonify
+from app import db, limiter
 from app.models import Recepcion, FotoRecepcion
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from datetime import datetime
 import os
 from app.schemas import RecepcionSchema
-from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
 import logging
-from werkzeug.utils import secure_filename
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
+from app.utils.imagenes import programar_variantes
+from app.utils.file_handler import guardar_archivo, liberar_archivo, servir_archivo
+from app.utils.paginacion import paginar_por_cursor, contar, parametros_pagina, MODOS_TOTAL
+from app.utils.streaming import respuesta_streaming
+from app.utils.rut import filtro_rut
+from app.utils.auditoria import auditoria, valores, diferencias
+from app.utils.cache_historial import cache_historial, historial_cacheado
 
 recepciones_bp = Blueprint("recepciones", __name__)
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
 MAX_FILE_SIZE = 2 * 1024 * 1024  # 2 MB
-
-limiter = Limiter(key_func=get_remote_address)
+CAMPOS_AUDITADOS = ("numero_guia", "rut_empresa", "observacion", "latitud", "longitud")
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -30,21 +35,40 @@ def crear_recepcion():
     usuario_id = get_jwt_identity()
     ip = request.remote_addr
     if errors:
-        logging.warning(f"Creación de recepción fallida por usuario {usuario_id} desde IP {ip}: errores {errors}")
+        logging.warning("Creación de recepción fallida por usuario %s desde IP %s: errores %s", usuario_id, ip, errors)
         return jsonify(errors), 400
 
+    clave = data.get("clave_idempotencia") or None
+    if clave:
+        existente = Recepcion.query.filter_by(usuario_id=usuario_id, clave_idempotencia=clave).first()
+        if existente:
+            logging.info("Recepción %s ya creada con clave %s por usuario %s desde IP %s", existente.id, clave, usuario_id, ip)
+            return jsonify({"id": existente.id}), 200
+
     recepcion = Recepcion(
         numero_guia=data["numero_guia"],
         rut_empresa=data["rut_empresa"],
         observacion=data.get("observacion"),
         latitud=request.form.get("latitud", type=float),
         longitud=request.form.get("longitud", type=float),
-        usuario_id=usuario_id
+        usuario_id=usuario_id,
+        clave_idempotencia=clave
     )
 
     db.session.add(recepcion)
-    db.session.commit()
-    logging.info(f"Creación de recepción {recepcion.id} por usuario {usuario_id} desde IP {ip} con datos: {data}")
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Dos envíos con la misma clave al mismo tiempo: el otro ya la creó
+        db.session.rollback()
+        existente = Recepcion.query.filter_by(usuario_id=usuario_id, clave_idempotencia=clave).first() if clave else None
+        if existente is None:
+            raise
+        logging.info("Recepción %s ya creada con clave %s por usuario %s desde IP %s (envío simultáneo)", existente.id, clave, usuario_id, ip)
+        return jsonify({"id": existente.id}), 200
+    cache_historial.invalidar(recepcion.usuario_id)
+    logging.info("Creación de recepción %s por usuario %s desde IP %s con datos: %s", recepcion.id, usuario_id, ip, data)
+    auditoria.registrar("crear", "recepcion", recepcion.id, recepcion.numero_guia, valores(recepcion, CAMPOS_AUDITADOS))
     return jsonify({"id": recepcion.id}), 201
 
 @recepciones_bp.route("/", methods=["GET"])
@@ -52,10 +76,8 @@ def crear_recepcion():
 def listar_recepciones():
     usuario_id = get_jwt_identity()
     ip = request.remote_addr
-    recepciones = Recepcion.query.all()
-    result = []
-    for r in recepciones:
-        result.append({
+    def serializar(r):
+        return {
             "id": r.id,
             "numero_guia": r.numero_guia,
             "rut_empresa": r.rut_empresa,
@@ -64,25 +86,32 @@ def listar_recepciones():
             "observacion": r.observacion,
             "latitud": r.latitud,
             "longitud": r.longitud
-        })
-    logging.info(f"Listado de recepciones solicitado por usuario {usuario_id} desde IP {ip}. Total: {len(result)}")
-    return jsonify(result)
+        }
+
+    def al_terminar(total):
+        logging.info("Listado de recepciones solicitado por usuario %s desde IP %s. Total: %s", usuario_id, ip, total)
+
+    return respuesta_streaming(Recepcion.query.order_by(Recepcion.id), serializar, al_terminar)
 
 @recepciones_bp.route("/historial", methods=["GET"])
 @jwt_required()
+@historial_cacheado
 def historial_recepciones():
     usuario_id = get_jwt_identity()
     ip = request.remote_addr
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 10, type=int)
+    page, per_page = parametros_pagina()
     rut_empresa = request.args.get('rut_empresa')
     numero_guia = request.args.get('numero_guia')
     fecha_inicio = request.args.get('fecha_inicio')
     fecha_fin = request.args.get('fecha_fin')
+    cursor = request.args.get('cursor')
+    modo_total = request.args.get('total', 'exact')
+    if modo_total not in MODOS_TOTAL:
+        modo_total = 'exact'
 
     query = Recepcion.query.filter_by(usuario_id=usuario_id)
     if rut_empresa:
-        query = query.filter(Recepcion.rut_empresa == rut_empresa)
+        query = query.filter(filtro_rut(Recepcion.rut_empresa_cuerpo, rut_empresa))
     if numero_guia:
         query = query.filter(Recepcion.numero_guia == numero_guia)
     if fecha_inicio:
@@ -90,15 +119,27 @@ def historial_recepciones():
             fecha_inicio_dt = datetime.strptime(fecha_inicio, "%Y-%m-%d")
             query = query.filter(Recepcion.fecha >= fecha_inicio_dt)
         except Exception as e:
-            logging.warning(f"Error parseando fecha_inicio: {fecha_inicio} - {e}")
+            logging.warning("Error parseando fecha_inicio: %s - %s", fecha_inicio, e)
     if fecha_fin:
         try:
             fecha_fin_dt = datetime.strptime(fecha_fin, "%Y-%m-%d")
             query = query.filter(Recepcion.fecha <= fecha_fin_dt)
         except Exception as e:
-            logging.warning(f"Error parseando fecha_fin: {fecha_fin} - {e}")
+            logging.warning("Error parseando fecha_fin: %s - %s", fecha_fin, e)
 
-    recepciones = query.order_by(Recepcion.fecha.desc()).paginate(page=page, per_page=per_page)
+    next_cursor = None
+    current_page = None
+    if cursor is not None:
+        try:
+            items, next_cursor = paginar_por_cursor(query, Recepcion, cursor, per_page)
+        except ValueError as e:
+            return jsonify({"msg": str(e)}), 400
+    else:
+        paginacion = query.order_by(Recepcion.fecha.desc()).paginate(page=page, per_page=per_page, count=False)
+        items = paginacion.items
+        current_page = paginacion.page
+    total = contar(query, modo_total)
+    pages = (total + per_page - 1) // per_page if total is not None else None
     result = [{
         "id": r.id,
         "numero_guia": r.numero_guia,
@@ -108,13 +149,14 @@ def historial_recepciones():
         "observacion": r.observacion,
         "latitud": r.latitud,
         "longitud": r.longitud
-    } for r in recepciones.items]
-    logging.info(f"Historial de recepciones solicitado por usuario {usuario_id} desde IP {ip}. Página: {page}, Total: {recepciones.total}")
+    } for r in items]
+    logging.info("Historial de recepciones solicitado por usuario %s desde IP %s. Página: %s, Total: %s", usuario_id, ip, page, total)
     return jsonify({
         "recepciones": result,
-        "total": recepciones.total,
-        "pages": recepciones.pages,
-        "current_page": recepciones.page
+        "total": total,
+        "pages": pages,
+        "current_page": current_page,
+        "next_cursor": next_cursor
     })
 
 @recepciones_bp.route("/<int:recepcion_id>", methods=["GET"])
@@ -122,12 +164,13 @@ def historial_recepciones():
 def detalle_recepcion(recepcion_id):
     usuario_id = get_jwt_identity()
     ip = request.remote_addr
-    recepcion = Recepcion.query.get_or_404(recepcion_id)
+    recepcion = db.get_or_404(Recepcion, recepcion_id, options=[selectinload(Recepcion.fotos)])
     fotos = [
-        {"id": f.id, "tipo": f.tipo, "ruta_archivo": f.ruta_archivo}
+        {"id": f.id, "tipo": f.tipo, "ruta_archivo": f.ruta_archivo,
+         "ruta_thumb": f.ruta_thumb, "ruta_medium": f.ruta_medium}
         for f in recepcion.fotos
     ]
-    logging.info(f"Detalle de recepción {recepcion_id} solicitado por usuario {usuario_id} desde IP {ip}")
+    logging.info("Detalle de recepción %s solicitado por usuario %s desde IP %s", recepcion_id, usuario_id, ip)
     return jsonify({
         "id": recepcion.id,
         "numero_guia": recepcion.numero_guia,
@@ -152,48 +195,61 @@ def subir_fotos_recepcion(recepcion_id):
     archivos = request.files.getlist("archivo")
 
     if not tipo or not archivos:
-        logging.warning(f"Falta tipo o archivos para recepción {recepcion_id} por usuario {usuario_id} desde IP {ip}")
+        logging.warning("Falta tipo o archivos para recepción %s por usuario %s desde IP %s", recepcion_id, usuario_id, ip)
         return jsonify({"msg": "Falta el tipo o los archivos"}), 400
 
     if tipo not in ['carnet', 'patente', 'carga']:
-        logging.warning(f"Tipo inválido '{tipo}' para recepción {recepcion_id} por usuario {usuario_id} desde IP {ip}")
+        logging.warning("Tipo inválido '%s' para recepción %s por usuario %s desde IP %s", tipo, recepcion_id, usuario_id, ip)
         return jsonify({"msg": "Tipo de foto inválido"}), 400
 
     uploads_folder = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'uploads'))
     os.makedirs(uploads_folder, exist_ok=True)
 
-    fotos_guardadas = []
+    fotos_nuevas = []
+    fotos_repetidas = []
 
     for archivo in archivos:
         if not allowed_file(archivo.filename):
-            logging.warning(f"Archivo no permitido para recepción {recepcion_id} por usuario {usuario_id} desde IP {ip}")
+            logging.warning("Archivo no permitido para recepción %s por usuario %s desde IP %s", recepcion_id, usuario_id, ip)
             continue
 
         archivo.seek(0, os.SEEK_END)
         size = archivo.tell()
         archivo.seek(0)
         if size > MAX_FILE_SIZE:
-            logging.warning(f"Archivo excede tamaño en recepción {recepcion_id} por usuario {usuario_id} desde IP {ip}")
+            logging.warning("Archivo excede tamaño en recepción %s por usuario %s desde IP %s", recepcion_id, usuario_id, ip)
             continue
 
-        filename = secure_filename(f"{tipo}_{datetime.utcnow().strftime('%Y%m%d%H%M%S%f')}_{archivo.filename}")
-        ruta = os.path.join(uploads_folder, filename)
-        archivo.save(ruta)
+        extension = archivo.filename.rsplit('.', 1)[1]
+        ruta_archivo = guardar_archivo(archivo.stream, uploads_folder, extension)
+
+        existente = next((f for f in recepcion.fotos + fotos_nuevas if f.tipo == tipo and f.ruta_archivo == ruta_archivo), None)
+        if existente:
+            # Misma foto reenviada por un cliente que reintenta: no se duplica
+            liberar_archivo(uploads_folder, ruta_archivo)
+            fotos_repetidas.append(existente)
+            continue
 
         foto = FotoRecepcion(
             recepcion_id=recepcion.id,
             tipo=tipo,
-            ruta_archivo=filename
+            ruta_archivo=ruta_archivo
         )
         db.session.add(foto)
-        fotos_guardadas.append({
-            "id": foto.id,
-            "tipo": tipo,
-            "ruta_archivo": filename
-        })
+        fotos_nuevas.append(foto)
 
     db.session.commit()
-    logging.info(f"{len(fotos_guardadas)} fotos subidas para recepción {recepcion_id} por usuario {usuario_id} desde IP {ip}")
+    cache_historial.invalidar(recepcion.usuario_id)
+    programar_variantes(FotoRecepcion, fotos_nuevas)
+    fotos_guardadas = [{
+        "id": foto.id,
+        "tipo": foto.tipo,
+        "ruta_archivo": foto.ruta_archivo
+    } for foto in fotos_repetidas + fotos_nuevas]
+    logging.info("%s fotos subidas para recepción %s por usuario %s desde IP %s", len(fotos_guardadas), recepcion_id, usuario_id, ip)
+    if fotos_nuevas:
+        auditoria.registrar("crear", "foto_recepcion", recepcion_id, recepcion.numero_guia,
+                            {"fotos": [{"id": f.id, "tipo": f.tipo} for f in fotos_nuevas]})
     
     return jsonify({"fotos": fotos_guardadas}), 201
 
@@ -206,17 +262,20 @@ def actualizar_recepcion(recepcion_id):
     usuario_id = get_jwt_identity()
     ip = request.remote_addr
     if errors:
-        logging.warning(f"Actualización fallida de recepción {recepcion_id} por usuario {usuario_id} desde IP {ip}: errores {errors}")
+        logging.warning("Actualización fallida de recepción %s por usuario %s desde IP %s: errores %s", recepcion_id, usuario_id, ip, errors)
         return jsonify(errors), 400
 
     recepcion = Recepcion.query.get_or_404(recepcion_id)
+    anteriores = valores(recepcion, CAMPOS_AUDITADOS)
     recepcion.numero_guia = data["numero_guia"]
     recepcion.rut_empresa = data["rut_empresa"]
     recepcion.observacion = data.get("observacion")
     recepcion.latitud = request.form.get("latitud", type=float)
     recepcion.longitud = request.form.get("longitud", type=float)
     db.session.commit()
-    logging.info(f"Actualización de recepción {recepcion_id} por usuario {usuario_id} desde IP {ip} con nuevos datos: {data}")
+    cache_historial.invalidar(recepcion.usuario_id)
+    logging.info("Actualización de recepción %s por usuario %s desde IP %s con nuevos datos: %s", recepcion_id, usuario_id, ip, data)
+    auditoria.registrar("actualizar", "recepcion", recepcion_id, recepcion.numero_guia, diferencias(anteriores, recepcion))
     return jsonify({"msg": "Recepción actualizada"}), 200
 
 @recepciones_bp.route("/<int:recepcion_id>", methods=["DELETE"])
@@ -226,13 +285,13 @@ def eliminar_recepcion(recepcion_id):
     usuario_id = get_jwt_identity()
     ip = request.remote_addr
     for foto in recepcion.fotos:
-        ruta = os.path.join(os.path.dirname(__file__), '..', 'uploads', foto.ruta_archivo)
-        if os.path.exists(ruta):
-            os.remove(ruta)
+        liberar_archivo(os.path.join(os.path.dirname(__file__), '..', 'uploads'), foto.ruta_archivo)
         db.session.delete(foto)
     db.session.delete(recepcion)
     db.session.commit()
-    logging.info(f"Eliminación de recepción {recepcion_id} por usuario {usuario_id} desde IP {ip}")
+    cache_historial.invalidar(recepcion.usuario_id)
+    logging.info("Eliminación de recepción %s por usuario %s desde IP %s", recepcion_id, usuario_id, ip)
+    auditoria.registrar("eliminar", "recepcion", recepcion_id, recepcion.numero_guia, valores(recepcion, CAMPOS_AUDITADOS))
     return jsonify({"msg": "Recepción y fotos eliminadas"}), 200
 
 @recepciones_bp.route("/fotos/<int:foto_id>", methods=["DELETE"])
@@ -241,12 +300,13 @@ def eliminar_foto_recepcion(foto_id):
     foto = FotoRecepcion.query.get_or_404(foto_id)
     usuario_id = get_jwt_identity()
     ip = request.remote_addr
-    ruta = os.path.join(os.path.dirname(__file__), '..', 'uploads', foto.ruta_archivo)
-    if os.path.exists(ruta):
-        os.remove(ruta)
+    propietario = foto.recepcion.usuario_id
+    liberar_archivo(os.path.join(os.path.dirname(__file__), '..', 'uploads'), foto.ruta_archivo)
     db.session.delete(foto)
     db.session.commit()
-    logging.info(f"Eliminación de foto {foto_id} por usuario {usuario_id} desde IP {ip}")
+    cache_historial.invalidar(propietario)
+    logging.info("Eliminación de foto %s por usuario %s desde IP %s", foto_id, usuario_id, ip)
+    auditoria.registrar("eliminar", "foto_recepcion", foto_id, detalle={"recepcion_id": foto.recepcion_id, "tipo": foto.tipo})
     return jsonify({"msg": "Foto eliminada"}), 200
 
 @recepciones_bp.route("/fotos/<int:foto_id>/descargar", methods=["GET"])
@@ -257,10 +317,10 @@ def descargar_foto_recepcion(foto_id):
     ip = request.remote_addr
     ruta = os.path.join(os.path.dirname(__file__), '..', 'uploads', foto.ruta_archivo)
     if not os.path.exists(ruta):
-        logging.warning(f"Descarga fallida de foto {foto_id} por usuario {usuario_id} desde IP {ip}: archivo no encontrado")
+        logging.warning("Descarga fallida de foto %s por usuario %s desde IP %s: archivo no encontrado", foto_id, usuario_id, ip)
         return jsonify({"msg": "Archivo no encontrado"}), 404
-    logging.info(f"Descarga de foto {foto_id} por usuario {usuario_id} desde IP {ip}")
-    return send_file(ruta, as_attachment=True)
+    logging.info("Descarga de foto %s por usuario %s desde IP %s", foto_id, usuario_id, ip)
+    return servir_archivo(os.path.join(os.path.dirname(__file__), '..', 'uploads'), foto.ruta_archivo, as_attachment=True, publico=False)
 
 @recepciones_bp.route("/fotos/<int:foto_id>/ver", methods=["GET"])
 @jwt_required()
@@ -270,7 +330,7 @@ def ver_foto_recepcion(foto_id):
     ip = request.remote_addr
     ruta = os.path.join(os.path.dirname(__file__), '..', 'uploads', foto.ruta_archivo)
     if not os.path.exists(ruta):
-        logging.warning(f"Visualización fallida de foto {foto_id} por usuario {usuario_id} desde IP {ip}: archivo no encontrado")
+        logging.warning("Visualización fallida de foto %s por usuario %s desde IP %s: archivo no encontrado", foto_id, usuario_id, ip)
         return jsonify({"msg": "Archivo no encontrado"}), 404
-    logging.info(f"Visualización de foto {foto_id} por usuario {usuario_id} desde IP {ip}")
-    return send_file(ruta)
+    logging.info("Visualización de foto %s por usuario %s desde IP %s", foto_id, usuario_id, ip)
+    return servir_archivo(os.path.join(os.path.dirname(__file__), '..', 'uploads'), foto.ruta_archivo, publico=False)
@@ -0,0 +1,224 @@
+from flask import Blueprint, request, jsonify, send_file, url_for, current_app
+from app import db, limiter
+from app.models import Despacho, Recepcion, FotoDespacho, FotoRecepcion
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from datetime import datetime, timedelta
+from sqlalchemy import select, func, union_all, literal
+from sqlalchemy.orm import selectinload
+from werkzeug.utils import secure_filename
+import logging
+import os
+from app.utils.reportes import reportes, datos_movimiento, campos_movimiento
+from app.utils.principales import es_admin
+from app.utils.auditoria import auditoria
+from app.utils.rut import filtro_rut
+from app.utils.streaming import respuesta_zip, TAMANO_LOTE
+
+reportes_bp = Blueprint("reportes", __name__)
+
+MOVIMIENTOS = {
+    "despacho": (Despacho, FotoDespacho.despacho_id),
+    "recepcion": (Recepcion, FotoRecepcion.recepcion_id),
+}
+FOTOS = {"despacho": FotoDespacho, "recepcion": FotoRecepcion}
+TIPOS_FOTO = ['carnet', 'patente', 'carga']
+MAX_MOVIMIENTOS_REPORTE = 1000
+PLANTILLA = "reportes/movimientos.html"
+
+def _respuesta_trabajo(trabajo_id, estado):
+    return jsonify({
+        "trabajo_id": trabajo_id,
+        "estado": estado,
+        "url_estado": url_for("reportes.estado_reporte", trabajo_id=trabajo_id),
+        "url_pdf": url_for("reportes.descargar_reporte", trabajo_id=trabajo_id),
+    }), 200 if estado == "listo" else 202
+
+@reportes_bp.route("/<tipo>/<int:movimiento_id>", methods=["POST"])
+@jwt_required()
+@limiter.limit("30 per minute")
+def reporte_movimiento(tipo, movimiento_id):
+    """Encola el PDF de un despacho o recepción con sus fotos (dueño o admin)."""
+    usuario_id = int(get_jwt_identity())
+    ip = request.remote_addr
+    if tipo not in MOVIMIENTOS:
+        return jsonify({"msg": "Tipo debe ser 'despacho' o 'recepcion'"}), 404
+    modelo, _ = MOVIMIENTOS[tipo]
+    movimiento = db.get_or_404(modelo, movimiento_id, options=[selectinload(modelo.fotos)])
+    if movimiento.usuario_id != usuario_id and not es_admin():
+        logging.warning("Reporte de %s %s NO AUTORIZADO para usuario %s desde IP %s", tipo, movimiento_id, usuario_id, ip)
+        return jsonify({"msg": "No autorizado"}), 403
+
+    datos = {
+        "titulo": f"{tipo.capitalize()} guía {movimiento.numero_guia}",
+        "subtitulo": None,
+        "detalle": True,
+        "movimientos": [datos_movimiento(movimiento, tipo)],
+    }
+    trabajo_id, estado = reportes.solicitar(PLANTILLA, datos, usuario_id)
+    logging.info("Reporte %s de %s %s solicitado por usuario %s desde IP %s: %s", trabajo_id, tipo, movimiento_id, usuario_id, ip, estado)
+    auditoria.registrar("reporte", tipo, movimiento_id, movimiento.numero_guia, {"trabajo_id": trabajo_id})
+    return _respuesta_trabajo(trabajo_id, estado)
+
+@reportes_bp.route("/movimientos", methods=["POST"])
+@jwt_required()
+@limiter.limit("10 per minute")
+def reporte_rango():
+    """
+    Encola el PDF con la tabla de movimientos entre desde y hasta
+    (YYYY-MM-DD, inclusive). Opcional: tipo; usuario_id sólo para admin,
+    el resto obtiene únicamente sus movimientos.
+    """
+    usuario_id = int(get_jwt_identity())
+    ip = request.remote_addr
+    parametros = request.get_json(silent=True) or request.values
+    tipo = parametros.get("tipo")
+    try:
+        desde = datetime.strptime(parametros["desde"], "%Y-%m-%d")
+        hasta = datetime.strptime(parametros["hasta"], "%Y-%m-%d") + timedelta(days=1)
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"msg": "desde y hasta son obligatorios (YYYY-MM-DD)"}), 400
+    if tipo and tipo not in MOVIMIENTOS:
+        return jsonify({"msg": "Tipo debe ser 'despacho' o 'recepcion'"}), 400
+    if es_admin():
+        filtro_usuario = parametros.get("usuario_id")
+        try:
+            filtro_usuario = int(filtro_usuario) if filtro_usuario not in (None, "") else None
+        except (TypeError, ValueError):
+            return jsonify({"msg": "usuario_id debe ser numérico"}), 400
+    else:
+        filtro_usuario = usuario_id
+
+    movimientos = []
+    for nombre in ([tipo] if tipo else list(MOVIMIENTOS)):
+        modelo, columna_foto = MOVIMIENTOS[nombre]
+        cantidad_fotos = select(func.count()).where(columna_foto == modelo.id).scalar_subquery()
+        query = select(modelo, cantidad_fotos).where(modelo.fecha >= desde, modelo.fecha < hasta)
+        if filtro_usuario is not None:
+            query = query.where(modelo.usuario_id == filtro_usuario)
+        filas = db.session.execute(query.order_by(modelo.fecha, modelo.id).limit(MAX_MOVIMIENTOS_REPORTE + 1)).all()
+        movimientos.extend(
+            {**campos_movimiento(m, nombre), "cantidad_fotos": n}
+            for m, n in filas
+        )
+        if len(movimientos) > MAX_MOVIMIENTOS_REPORTE:
+            return jsonify({"msg": f"El rango tiene más de {MAX_MOVIMIENTOS_REPORTE} movimientos, acótelo"}), 400
+    movimientos.sort(key=lambda m: (m["fecha"] or "", m["tipo"], m["id"]))
+
+    datos = {
+        "titulo": "Movimientos" if not tipo else f"{tipo.capitalize()}s",
+        "subtitulo": f"Del {desde:%d-%m-%Y} al {hasta - timedelta(days=1):%d-%m-%Y}"
+                     + (f", usuario {filtro_usuario}" if filtro_usuario is not None else ""),
+        "detalle": False,
+        "movimientos": movimientos,
+    }
+    trabajo_id, estado = reportes.solicitar(PLANTILLA, datos, usuario_id)
+    logging.info("Reporte %s de rango %s..%s solicitado por usuario %s desde IP %s: %s", trabajo_id, desde.date(), hasta.date(), usuario_id, ip, estado)
+    auditoria.registrar("reporte", tipo or "movimientos", referencia=f"{desde:%Y-%m-%d}", detalle={"trabajo_id": trabajo_id, "movimientos": len(movimientos)})
+    return _respuesta_trabajo(trabajo_id, estado)
+
+def _puede_ver(trabajo_id):
+    # 404 y no 403 para no confirmar que el id existe
+    if reportes.autorizado(trabajo_id, int(get_jwt_identity())) or es_admin():
+        return True
+    logging.warning("Acceso NO AUTORIZADO al reporte %s por usuario %s desde IP %s", trabajo_id, get_jwt_identity(), request.remote_addr)
+    return False
+
+@reportes_bp.route("/trabajos/<trabajo_id>", methods=["GET"])
+@jwt_required()
+def estado_reporte(trabajo_id):
+    estado, error = reportes.estado(trabajo_id)
+    if estado is None or not _puede_ver(trabajo_id):
+        return jsonify({"msg": "Trabajo no encontrado"}), 404
+    respuesta = {"trabajo_id": trabajo_id, "estado": estado}
+    if error:
+        respuesta["error"] = error
+    if estado == "listo":
+        respuesta["url_pdf"] = url_for("reportes.descargar_reporte", trabajo_id=trabajo_id)
+    return jsonify(respuesta)
+
+@reportes_bp.route("/trabajos/<trabajo_id>/pdf", methods=["GET"])
+@jwt_required()
+def descargar_reporte(trabajo_id):
+    estado, _ = reportes.estado(trabajo_id)
+    if estado is None or not _puede_ver(trabajo_id):
+        return jsonify({"msg": "Trabajo no encontrado"}), 404
+    if estado != "listo":
+        return jsonify({"msg": "El reporte no está listo", "estado": estado}), 409
+    # El contenido de un id nunca cambia: se puede cachear en el cliente
+    return send_file(reportes.ruta_pdf(trabajo_id), mimetype="application/pdf", as_attachment=True,
+                     download_name=f"reporte_{trabajo_id[:12]}.pdf", max_age=86400, etag=True)
+
+def _nombre_en_zip(fila):
+    """Carpeta por movimiento (fecha_tipo_id_guía) y archivo tipo-de-foto_id.extensión."""
+    fecha = f"{fila.fecha:%Y-%m-%d}" if fila.fecha else "sin-fecha"
+    carpeta = secure_filename(f"{fecha}_{fila.tipo}_{fila.movimiento_id}_{fila.numero_guia}")
+    extension = os.path.splitext(fila.ruta_archivo)[1].lower()
+    return f"{carpeta}/{secure_filename(fila.tipo_foto) or 'foto'}_{fila.id}{extension}"
+
+@reportes_bp.route("/fotos", methods=["GET"])
+@jwt_required()
+@limiter.limit("5 per minute")
+def exportar_fotos():
+    """
+    Descarga en un ZIP las fotos de los movimientos entre desde y hasta
+    (YYYY-MM-DD, inclusive), ordenadas por fecha. Opcionales: rut_empresa,
+    tipo (despacho o recepcion) y tipo_foto (carnet, patente, carga);
+    usuario_id sólo para admin, el resto obtiene únicamente sus fotos.
+    """
+    usuario_id = int(get_jwt_identity())
+    ip = request.remote_addr
+    tipo = request.args.get("tipo")
+    tipo_foto = request.args.get("tipo_foto")
+    rut_empresa = request.args.get("rut_empresa", "").strip()
+    try:
+        desde = datetime.strptime(request.args["desde"], "%Y-%m-%d")
+        hasta = datetime.strptime(request.args["hasta"], "%Y-%m-%d") + timedelta(days=1)
+    except (KeyError, ValueError):
+        return jsonify({"msg": "desde y hasta son obligatorios (YYYY-MM-DD)"}), 400
+    if tipo and tipo not in MOVIMIENTOS:
+        return jsonify({"msg": "Tipo debe ser 'despacho' o 'recepcion'"}), 400
+    if tipo_foto and tipo_foto not in TIPOS_FOTO:
+        return jsonify({"msg": f"tipo_foto debe ser uno de {', '.join(TIPOS_FOTO)}"}), 400
+    if es_admin():
+        filtro_usuario = request.args.get("usuario_id", type=int)
+    else:
+        filtro_usuario = usuario_id
+
+    selects = []
+    for nombre in ([tipo] if tipo else list(MOVIMIENTOS)):
+        modelo, columna_foto = MOVIMIENTOS[nombre]
+        foto = FOTOS[nombre]
+        query = select(
+            foto.id,
+            foto.tipo.label("tipo_foto"),
+            foto.ruta_archivo,
+            literal(nombre).label("tipo"),
+            modelo.id.label("movimiento_id"),
+            modelo.numero_guia,
+            modelo.fecha,
+        ).join(modelo, columna_foto == modelo.id).where(modelo.fecha >= desde, modelo.fecha < hasta)
+        if filtro_usuario is not None:
+            query = query.where(modelo.usuario_id == filtro_usuario)
+        if rut_empresa:
+            query = query.where(filtro_rut(modelo.rut_empresa_cuerpo, rut_empresa))
+        if tipo_foto:
+            query = query.where(foto.tipo == tipo_foto)
+        selects.append(query)
+    fotos = union_all(*selects).subquery()
+    query = select(fotos).order_by(fotos.c.fecha, fotos.c.tipo, fotos.c.movimiento_id, fotos.c.id)
+    carpeta = current_app.config["UPLOAD_FOLDER"]
+
+    def entradas():
+        # Cursor del lado del servidor: las filas se leen a medida que se escribe el ZIP
+        filas = db.session.execute(query.execution_options(stream_results=True, yield_per=TAMANO_LOTE))
+        for fila in filas:
+            yield os.path.join(carpeta, fila.ruta_archivo), _nombre_en_zip(fila)
+
+    filtros = {"desde": f"{desde:%Y-%m-%d}", "hasta": f"{hasta - timedelta(days=1):%Y-%m-%d}", "tipo": tipo,
+               "tipo_foto": tipo_foto, "rut_empresa": rut_empresa or None, "usuario_id": filtro_usuario}
+
+    def al_terminar(total):
+        logging.info("Exportación de %s fotos (%s) por usuario %s desde IP %s", total, filtros, usuario_id, ip)
+        auditoria.registrar("exportar", "fotos", referencia=filtros["desde"], detalle={**filtros, "fotos": total}, usuario_id=usuario_id)
+
+    return respuesta_zip(entradas(), f"fotos_{desde:%Y%m%d}_{hasta - timedelta(days=1):%Y%m%d}.zip", al_terminar)
@@ -0,0 +1,196 @@
+from flask import Blueprint, request, jsonify, current_app
+from app import db
+from app.models import Despacho, Recepcion, FotoDespacho, FotoRecepcion
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from datetime import datetime
+import os
+import json
+import logging
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from app.schemas import DespachoSchema, RecepcionSchema
+from app.utils.file_handler import guardar_archivo
+from app.utils.imagenes import programar_variantes
+from app.utils.auditoria import auditoria
+from app.utils.cache_historial import cache_historial
+from app.utils.rut import partes_rut
+from app.utils.geohash import codificar as codificar_geohash
+from app.utils.zonas import zonas
+
+sincronizacion_bp = Blueprint("sincronizacion", __name__)
+
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+MAX_FILE_SIZE = 2 * 1024 * 1024  # 2 MB
+MAX_MOVIMIENTOS_LOTE = 100
+CAMPOS_MOVIMIENTO = ("numero_guia", "rut_empresa", "observacion", "latitud", "longitud")
+
+MOVIMIENTOS = {
+    "despacho": (Despacho, FotoDespacho, "despacho_id", DespachoSchema),
+    "recepcion": (Recepcion, FotoRecepcion, "recepcion_id", RecepcionSchema),
+}
+
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+def tamano_archivo(archivo):
+    archivo.seek(0, os.SEEK_END)
+    size = archivo.tell()
+    archivo.seek(0)
+    return size
+
+def validar_movimiento(mov, claves_vistas):
+    if not isinstance(mov, dict):
+        return {"movimiento": "Formato inválido"}
+    errores = {}
+    tipo_movimiento = mov.get("tipo_movimiento")
+    clave = mov.get("clave_idempotencia")
+    if tipo_movimiento not in MOVIMIENTOS:
+        return {"tipo_movimiento": "Debe ser 'despacho' o 'recepcion'"}
+    if not clave or not isinstance(clave, str) or len(clave) > 64:
+        errores["clave_idempotencia"] = "Obligatoria, máximo 64 caracteres"
+    elif (tipo_movimiento, clave) in claves_vistas:
+        errores["clave_idempotencia"] = "Repetida en el lote"
+    else:
+        claves_vistas.add((tipo_movimiento, clave))
+
+    schema = MOVIMIENTOS[tipo_movimiento][3]()
+    errores.update(schema.validate({k: mov[k] for k in CAMPOS_MOVIMIENTO if k in mov}))
+
+    if mov.get("fecha"):
+        try:
+            datetime.fromisoformat(mov["fecha"])
+        except (TypeError, ValueError):
+            errores["fecha"] = "Formato ISO 8601 inválido"
+
+    if not isinstance(mov.get("fotos") or [], list):
+        errores["fotos"] = "Debe ser una lista"
+        return errores
+    for foto in mov.get("fotos") or []:
+        campo = foto.get("archivo") if isinstance(foto, dict) else None
+        archivo = request.files.get(campo) if campo else None
+        if not isinstance(foto, dict) or foto.get("tipo") not in ['carnet', 'patente', 'carga']:
+            errores["fotos"] = "Tipo de foto inválido"
+        elif archivo is None or not allowed_file(archivo.filename):
+            errores["fotos"] = f"Archivo '{campo}' no encontrado o no permitido"
+        elif tamano_archivo(archivo) > MAX_FILE_SIZE:
+            errores["fotos"] = f"Archivo '{campo}' excede el tamaño permitido"
+    return errores
+
+@sincronizacion_bp.route("/", methods=["POST"])
+@jwt_required()
+def sincronizar():
+    """
+    Recibe en una sola solicitud los movimientos que el dispositivo acumuló sin
+    conexión, con sus fotos, y los inserta en una única transacción. Cada
+    movimiento trae una clave_idempotencia generada por el cliente: los que ya
+    existen se informan como 'existente' sin duplicarse, así el lote completo
+    puede reenviarse sin riesgo si la respuesta se pierde.
+    Formato: multipart con el campo 'movimientos' (JSON) y las fotos
+    referenciadas por nombre de campo, o application/json sin fotos.
+    """
+    usuario_id = int(get_jwt_identity())
+    ip = request.remote_addr
+
+    if request.is_json:
+        movimientos = request.get_json(silent=True)
+    else:
+        try:
+            movimientos = json.loads(request.form.get("movimientos", ""))
+        except ValueError:
+            movimientos = None
+    if not isinstance(movimientos, list) or not movimientos:
+        return jsonify({"msg": "Debe enviar una lista de movimientos"}), 400
+    if len(movimientos) > MAX_MOVIMIENTOS_LOTE:
+        return jsonify({"msg": f"Máximo {MAX_MOVIMIENTOS_LOTE} movimientos por lote"}), 400
+
+    claves_vistas = set()
+    errores = {}
+    for i, mov in enumerate(movimientos):
+        errores_mov = validar_movimiento(mov, claves_vistas)
+        if errores_mov:
+            errores[i] = errores_mov
+    if errores:
+        logging.warning("Sincronización rechazada para usuario %s desde IP %s: errores %s", usuario_id, ip, errores)
+        return jsonify({"errores": errores}), 400
+
+    carpeta = current_app.config["UPLOAD_FOLDER"]
+    resultados = {}
+    fotos_creadas = []
+    try:
+        for tipo_movimiento, (modelo, modelo_foto, columna, _) in MOVIMIENTOS.items():
+            del_tipo = [m for m in movimientos if m["tipo_movimiento"] == tipo_movimiento]
+            if not del_tipo:
+                continue
+
+            existentes = dict(db.session.execute(
+                select(modelo.clave_idempotencia, modelo.id).where(
+                    modelo.usuario_id == usuario_id,
+                    modelo.clave_idempotencia.in_([m["clave_idempotencia"] for m in del_tipo])
+                )
+            ).all())
+            for clave, id in existentes.items():
+                resultados[(tipo_movimiento, clave)] = {"id": id, "estado": "existente"}
+
+            nuevos = [m for m in del_tipo if m["clave_idempotencia"] not in existentes]
+            if not nuevos:
+                continue
+
+            filas = [{
+                "numero_guia": m["numero_guia"],
+                "rut_empresa": m["rut_empresa"],
+                # insert() masivo no pasa por @validates: se normaliza aquí
+                "rut_empresa_cuerpo": partes_rut(m["rut_empresa"])[0],
+                "rut_empresa_dv": partes_rut(m["rut_empresa"])[1],
+                "observacion": m.get("observacion"),
+                "latitud": m.get("latitud"),
+                "longitud": m.get("longitud"),
+                "geohash": codificar_geohash(m.get("latitud"), m.get("longitud")),
+                "zona": zonas.zona_de(m.get("latitud"), m.get("longitud")),
+                "fecha": datetime.fromisoformat(m["fecha"]) if m.get("fecha") else datetime.utcnow(),
+                "usuario_id": usuario_id,
+                "clave_idempotencia": m["clave_idempotencia"],
+            } for m in nuevos]
+            ids = dict(db.session.execute(
+                insert(modelo).returning(modelo.clave_idempotencia, modelo.id), filas
+            ).all())
+
+            filas_fotos = []
+            for m in nuevos:
+                resultados[(tipo_movimiento, m["clave_idempotencia"])] = {"id": ids[m["clave_idempotencia"]], "estado": "creado"}
+                for foto in m.get("fotos") or []:
+                    archivo = request.files[foto["archivo"]]
+                    archivo.stream.seek(0)
+                    filas_fotos.append({
+                        columna: ids[m["clave_idempotencia"]],
+                        "tipo": foto["tipo"],
+                        "ruta_archivo": guardar_archivo(archivo.stream, carpeta, archivo.filename.rsplit('.', 1)[1]),
+                    })
+            if filas_fotos:
+                fotos = db.session.scalars(insert(modelo_foto).returning(modelo_foto), filas_fotos).all()
+                fotos_creadas.append((modelo_foto, fotos))
+        db.session.commit()
+    except IntegrityError:
+        # Otro envío del mismo lote se confirmó al mismo tiempo; al reintentar se informarán como existentes
+        db.session.rollback()
+        logging.warning("Conflicto de claves en sincronización de usuario %s desde IP %s", usuario_id, ip)
+        return jsonify({"msg": "Conflicto de sincronización, reintente"}), 409
+
+    for modelo_foto, fotos in fotos_creadas:
+        programar_variantes(modelo_foto, fotos)
+    for m in movimientos:
+        resultado = resultados[(m["tipo_movimiento"], m["clave_idempotencia"])]
+        if resultado["estado"] == "creado":
+            auditoria.registrar("crear", m["tipo_movimiento"], resultado["id"], m["numero_guia"],
+                                {"sincronizacion": True, "clave_idempotencia": m["clave_idempotencia"]})
+
+    creados = sum(1 for r in resultados.values() if r["estado"] == "creado")
+    if creados:
+        cache_historial.invalidar(usuario_id)
+    logging.info("Sincronización de usuario %s desde IP %s: %s movimientos, %s creados", usuario_id, ip, len(movimientos), creados)
+    return jsonify({
+        "resultados": [{
+            "clave_idempotencia": m["clave_idempotencia"],
+            "tipo_movimiento": m["tipo_movimiento"],
+            **resultados[(m["tipo_movimiento"], m["clave_idempotencia"])]
+        } for m in movimientos]
+    }), 200
@@ -0,0 +1,196 @@
+from flask import Blueprint, request, jsonify, current_app
+from app import db
+from app.models import SesionSubida, Despacho, Recepcion, FotoDespacho, FotoRecepcion
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from datetime import datetime, timedelta
+import os
+import uuid
+import logging
+from app.utils.file_handler import guardar_archivo, liberar_archivo
+from app.utils.imagenes import programar_variantes
+from app.utils.cache_historial import cache_historial
+
+subidas_bp = Blueprint("subidas", __name__)
+
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+MAX_FILE_SIZE = 2 * 1024 * 1024  # 2 MB
+TAMANO_BLOQUE = 64 * 1024
+
+MOVIMIENTOS = {
+    "despacho": (Despacho, FotoDespacho, "despacho_id"),
+    "recepcion": (Recepcion, FotoRecepcion, "recepcion_id"),
+}
+
+def carpeta_parciales():
+    carpeta = os.path.join(current_app.config["UPLOAD_FOLDER"], "parciales")
+    os.makedirs(carpeta, exist_ok=True)
+    return carpeta
+
+def ruta_parcial(sesion_id):
+    return os.path.join(carpeta_parciales(), f"{sesion_id}.part")
+
+def obtener_sesion(sesion_id, bloquear=False):
+    query = SesionSubida.query.filter_by(id=sesion_id, usuario_id=int(get_jwt_identity()))
+    if bloquear:
+        query = query.with_for_update()
+    return query.first_or_404()
+
+def estado_sesion(sesion):
+    return {
+        "id": sesion.id,
+        "offset": sesion.recibido,
+        "tamano": sesion.tamano_total,
+        "completa": sesion.recibido == sesion.tamano_total
+    }
+
+@subidas_bp.route("/", methods=["POST"])
+@jwt_required()
+def crear_subida():
+    usuario_id = get_jwt_identity()
+    ip = request.remote_addr
+    data = request.get_json(silent=True) or {}
+
+    tipo_movimiento = data.get("tipo_movimiento")
+    movimiento_id = data.get("movimiento_id")
+    tipo = data.get("tipo")
+    nombre_archivo = data.get("nombre_archivo", "")
+    tamano = data.get("tamano")
+
+    if tipo_movimiento not in MOVIMIENTOS or not isinstance(movimiento_id, int):
+        return jsonify({"msg": "Movimiento inválido"}), 400
+    if tipo not in ['carnet', 'patente', 'carga']:
+        return jsonify({"msg": "Tipo de foto inválido"}), 400
+    extension = nombre_archivo.rsplit('.', 1)[1].lower() if '.' in nombre_archivo else ''
+    if extension not in ALLOWED_EXTENSIONS:
+        return jsonify({"msg": "Archivo no permitido"}), 400
+    if not isinstance(tamano, int) or not 0 < tamano <= MAX_FILE_SIZE:
+        return jsonify({"msg": "Tamaño inválido"}), 400
+
+    modelo = MOVIMIENTOS[tipo_movimiento][0]
+    db.get_or_404(modelo, movimiento_id)
+
+    sesion = SesionSubida(
+        id=uuid.uuid4().hex,
+        usuario_id=usuario_id,
+        tipo_movimiento=tipo_movimiento,
+        movimiento_id=movimiento_id,
+        tipo=tipo,
+        extension=extension,
+        tamano_total=tamano,
+        recibido=0
+    )
+    open(ruta_parcial(sesion.id), "wb").close()
+    db.session.add(sesion)
+    db.session.commit()
+    logging.info("Sesión de subida %s creada para %s %s por usuario %s desde IP %s", sesion.id, tipo_movimiento, movimiento_id, usuario_id, ip)
+    return jsonify(estado_sesion(sesion)), 201
+
+@subidas_bp.route("/<sesion_id>", methods=["GET", "HEAD"])
+@jwt_required()
+def estado_subida(sesion_id):
+    sesion = obtener_sesion(sesion_id)
+    respuesta = jsonify(estado_sesion(sesion))
+    respuesta.headers["Upload-Offset"] = str(sesion.recibido)
+    return respuesta
+
+@subidas_bp.route("/<sesion_id>", methods=["PUT", "PATCH"])
+@jwt_required()
+def subir_trozo(sesion_id):
+    """
+    Recibe un trozo en el cuerpo de la solicitud. El cliente indica en la
+    cabecera Upload-Offset dónde empieza; si no coincide con lo ya recibido
+    se responde 409 con el offset correcto para que reanude desde ahí.
+    """
+    usuario_id = get_jwt_identity()
+    ip = request.remote_addr
+    sesion = obtener_sesion(sesion_id, bloquear=True)
+
+    offset = request.headers.get("Upload-Offset", type=int)
+    if offset != sesion.recibido:
+        db.session.rollback()
+        logging.warning("Offset %s no coincide en subida %s (recibido %s) por usuario %s desde IP %s", offset, sesion_id, sesion.recibido, usuario_id, ip)
+        respuesta = jsonify({"msg": "Offset incorrecto", **estado_sesion(sesion)})
+        respuesta.headers["Upload-Offset"] = str(sesion.recibido)
+        return respuesta, 409
+
+    restante = sesion.tamano_total - sesion.recibido
+    escritos = 0
+    with open(ruta_parcial(sesion.id), "r+b") as parcial:
+        parcial.seek(offset)
+        for bloque in iter(lambda: request.stream.read(TAMANO_BLOQUE), b""):
+            if escritos + len(bloque) > restante:
+                db.session.rollback()
+                return jsonify({"msg": "El trozo excede el tamaño declarado"}), 413
+            parcial.write(bloque)
+            escritos += len(bloque)
+        parcial.truncate(offset + escritos)
+
+    sesion.recibido = offset + escritos
+    db.session.commit()
+    respuesta = jsonify(estado_sesion(sesion))
+    respuesta.headers["Upload-Offset"] = str(sesion.recibido)
+    return respuesta
+
+@subidas_bp.route("/<sesion_id>/finalizar", methods=["POST"])
+@jwt_required()
+def finalizar_subida(sesion_id):
+    usuario_id = get_jwt_identity()
+    ip = request.remote_addr
+    sesion = obtener_sesion(sesion_id, bloquear=True)
+
+    if sesion.recibido != sesion.tamano_total:
+        db.session.rollback()
+        return jsonify({"msg": "Subida incompleta", **estado_sesion(sesion)}), 409
+
+    tipo_movimiento = sesion.tipo_movimiento
+    modelo, modelo_foto, columna = MOVIMIENTOS[tipo_movimiento]
+    movimiento = db.get_or_404(modelo, sesion.movimiento_id)
+    carpeta = current_app.config["UPLOAD_FOLDER"]
+    parcial = ruta_parcial(sesion.id)
+
+    with open(parcial, "rb") as stream:
+        ruta_archivo = guardar_archivo(stream, carpeta, sesion.extension)
+
+    foto = next((f for f in movimiento.fotos if f.tipo == sesion.tipo and f.ruta_archivo == ruta_archivo), None)
+    nueva = foto is None
+    if nueva:
+        foto = modelo_foto(tipo=sesion.tipo, ruta_archivo=ruta_archivo, **{columna: movimiento.id})
+        db.session.add(foto)
+    else:
+        liberar_archivo(carpeta, ruta_archivo)
+
+    db.session.delete(sesion)
+    db.session.commit()
+    os.remove(parcial)
+    if nueva:
+        cache_historial.invalidar(movimiento.usuario_id)
+        programar_variantes(modelo_foto, [foto])
+
+    logging.info("Subida %s finalizada como foto %s de %s %s por usuario %s desde IP %s", sesion_id, foto.id, tipo_movimiento, movimiento.id, usuario_id, ip)
+    return jsonify({"id": foto.id, "tipo": foto.tipo, "ruta_archivo": foto.ruta_archivo}), 201
+
+@subidas_bp.route("/<sesion_id>", methods=["DELETE"])
+@jwt_required()
+def cancelar_subida(sesion_id):
+    usuario_id = get_jwt_identity()
+    ip = request.remote_addr
+    sesion = obtener_sesion(sesion_id)
+    db.session.delete(sesion)
+    db.session.commit()
+    parcial = ruta_parcial(sesion_id)
+    if os.path.exists(parcial):
+        os.remove(parcial)
+    logging.info("Subida %s cancelada por usuario %s desde IP %s", sesion_id, usuario_id, ip)
+    return jsonify({"msg": "Subida cancelada"}), 200
+
+def limpiar_subidas_abandonadas(horas):
+    """Elimina las sesiones sin actividad en las últimas `horas` y sus archivos parciales."""
+    limite = datetime.utcnow() - timedelta(hours=horas)
+    abandonadas = SesionSubida.query.filter(SesionSubida.fecha_actualizacion < limite).all()
+    for sesion in abandonadas:
+        parcial = ruta_parcial(sesion.id)
+        if os.path.exists(parcial):
+            os.remove(parcial)
+        db.session.delete(sesion)
+    db.session.commit()
+    return len(abandonadas)
@@ -1,5 +1,6 @@
 from flask_marshmallow import Marshmallow
 from marshmallow import fields, validate, ValidationError
+from app.utils.rut import calcular_dv
 
 ma = Marshmallow()
 
@@ -11,37 +12,52 @@ def validar_rut_chileno(rut):
     rut = rut.replace(".", "").replace("-", "").upper()
     if not rut[:-1].isdigit() or len(rut) < 8:
         raise ValidationError("El RUT debe tener al menos 8 dígitos y un dígito verificador.")
-    cuerpo = rut[:-1]
-    dv = rut[-1]
-    suma = 0
-    multiplo = 2
-    for c in reversed(cuerpo):
-        suma += int(c) * multiplo
-        multiplo = 2 if multiplo == 7 else multiplo + 1
-    resto = suma % 11
-    dv_esperado = "K" if 11 - resto == 10 else "0" if 11 - resto == 11 else str(11 - resto)
-    if dv != dv_esperado:
+    if rut[-1] != calcular_dv(rut[:-1]):
         raise ValidationError("El RUT chileno no es válido.")
 
+def validar_ruts_lote(ruts, cache=None):
+    """
+    validar_rut_chileno sobre una lista de RUTs (importaciones), uno por uno:
+    retorna una lista paralela con el mensaje de error de cada uno, o None si
+    es válido. Los RUTs repetidos se validan una sola vez; pasando el mismo `cache`
+    entre lotes se reutiliza el resultado de los anteriores.
+    """
+    cache = {} if cache is None else cache
+    errores = []
+    for rut in ruts:
+        if rut not in cache:
+            try:
+                validar_rut_chileno(rut or "")
+                cache[rut] = None
+            except ValidationError as e:
+                cache[rut] = e.messages[0]
+        errores.append(cache[rut])
+    return errores
+
+RANGO_LATITUD = validate.Range(min=-90, max=90)
+RANGO_LONGITUD = validate.Range(min=-180, max=180)
+
 class DespachoSchema(ma.Schema):
     numero_guia = fields.Str(required=True, validate=validate.Length(min=1, max=50))
     rut_empresa = fields.Str(required=True, validate=validar_rut_chileno)
     observacion = fields.Str(allow_none=True)
-    latitud = fields.Float(allow_none=True)
-    longitud = fields.Float(allow_none=True)
+    latitud = fields.Float(allow_none=True, validate=RANGO_LATITUD)
+    longitud = fields.Float(allow_none=True, validate=RANGO_LONGITUD)
+    clave_idempotencia = fields.Str(allow_none=True, validate=validate.Length(max=64))
 
     class Meta:
-        fields = ("numero_guia", "rut_empresa", "observacion", "latitud", "longitud")
+        fields = ("numero_guia", "rut_empresa", "observacion", "latitud", "longitud", "clave_idempotencia")
 
 class RecepcionSchema(ma.Schema):
     numero_guia = fields.Str(required=True, validate=validate.Length(min=1, max=50))
     rut_empresa = fields.Str(required=True, validate=validar_rut_chileno)  # Validación agregada
     observacion = fields.Str(allow_none=True)  # NUEVO
-    latitud = fields.Float(allow_none=True)     # NUEVO
-    longitud = fields.Float(allow_none=True)    # NUEVO
+    latitud = fields.Float(allow_none=True, validate=RANGO_LATITUD)     # NUEVO
+    longitud = fields.Float(allow_none=True, validate=RANGO_LONGITUD)    # NUEVO
+    clave_idempotencia = fields.Str(allow_none=True, validate=validate.Length(max=64))
 
     class Meta:
-        fields = ("numero_guia", "rut_empresa", "observacion", "latitud", "longitud")
+        fields = ("numero_guia", "rut_empresa", "observacion", "latitud", "longitud", "clave_idempotencia")
 
 class LoginSchema(ma.Schema):
     rut = fields.Str(required=True, validate=validate.Length(min=8, max=12))
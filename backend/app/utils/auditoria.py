@@ -0,0 +1,134 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from flask import has_request_context, request
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy import insert
+from app import db
+from app.models import EventoAuditoria
+
+
+class EscritorAuditoria:
+    """
+    Guarda los eventos de auditoría en la tabla audit_event sin hacer esperar
+    a la solicitud: registrar() sólo encola el evento y un hilo del proceso
+    los inserta en lotes de AUDIT_BATCH_SIZE eventos o cada AUDIT_FLUSH_MS
+    milisegundos, lo que ocurra primero. Si la cola se llena el evento se
+    descarta y se cuenta en `descartados`.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.cola = None
+        self.descartados = 0
+        self._hilo = None
+        self._pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.tamano_lote = app.config.get("AUDIT_BATCH_SIZE", 50)
+        self.intervalo = app.config.get("AUDIT_FLUSH_MS", 500) / 1000
+        self.cola = queue.Queue(maxsize=app.config.get("AUDIT_QUEUE_SIZE", 10000))
+        self._hilo = None
+        app.extensions["auditoria"] = self
+
+    def _iniciar(self):
+        # El hilo se crea en el primer evento de cada proceso: los workers de
+        # gunicorn se bifurcan después de create_app y no heredan hilos.
+        with self._lock:
+            if self._hilo is not None and self._pid == os.getpid():
+                return
+            if self._pid != os.getpid():
+                self.cola = queue.Queue(maxsize=self.cola.maxsize)
+            self._pid = os.getpid()
+            self._hilo = threading.Thread(target=self._escribir, name="auditoria", daemon=True)
+            self._hilo.start()
+            atexit.register(self.vaciar)
+
+    def registrar(self, accion, entidad, entidad_id=None, referencia=None, detalle=None, usuario_id=None):
+        """Encola un evento. El usuario y la IP se toman de la solicitud en curso."""
+        ip = None
+        if has_request_context():
+            ip = request.remote_addr
+            if usuario_id is None:
+                try:
+                    usuario_id = get_jwt_identity()
+                except RuntimeError:
+                    pass  # ruta sin JWT (login fallido)
+        evento = {
+            "fecha": datetime.utcnow(),
+            "usuario_id": int(usuario_id) if usuario_id is not None else None,
+            "accion": accion,
+            "entidad": entidad,
+            "entidad_id": entidad_id,
+            "referencia": str(referencia)[:50] if referencia is not None else None,
+            "ip": ip,
+            "detalle": detalle,
+        }
+        self._iniciar()
+        try:
+            self.cola.put_nowait(evento)
+        except queue.Full:
+            with self._lock:
+                self.descartados += 1
+            logging.warning("Evento de auditoría descartado por cola llena: %s %s %s", accion, entidad, entidad_id)
+
+    def _tomar_lote(self):
+        lote = [self.cola.get()]
+        limite = time.monotonic() + self.intervalo
+        while len(lote) < self.tamano_lote:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                lote.append(self.cola.get(timeout=restante))
+            except queue.Empty:
+                break
+        return lote
+
+    def _insertar(self, lote):
+        with self.app.app_context():
+            try:
+                db.session.execute(insert(EventoAuditoria), lote)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                logging.exception("No se pudo guardar un lote de %d eventos de auditoría", len(lote))
+
+    def _escribir(self):
+        while True:
+            lote = self._tomar_lote()
+            self._insertar(lote)
+            for _ in lote:
+                self.cola.task_done()
+
+    def vaciar(self, timeout=5):
+        """Espera a que el hilo escriba los eventos pendientes (al terminar el proceso)."""
+        if self._hilo is None or self._pid != os.getpid():
+            return
+        limite = time.monotonic() + timeout
+        while self.cola.unfinished_tasks and time.monotonic() < limite:
+            time.sleep(0.05)
+
+
+auditoria = EscritorAuditoria()
+
+
+def valores(objeto, campos):
+    return {campo: getattr(objeto, campo) for campo in campos}
+
+
+def diferencias(anteriores, objeto):
+    """{campo: [antes, después]} de los campos que cambiaron, para el detalle del evento."""
+    return {
+        campo: [antes, getattr(objeto, campo)]
+        for campo, antes in anteriores.items()
+        if getattr(objeto, campo) != antes
+    }
@@ -0,0 +1,104 @@
+import re
+from sqlalchemy import case, column, func, literal, literal_column, or_, select, table
+from app import db
+from app.utils.rut import cuerpos_busqueda, filtro_rut
+
+LARGO_MINIMO = 3
+RE_PALABRAS = re.compile(r"\w+", re.UNICODE)
+
+
+def vector_observacion(modelo):
+    """
+    Expresión tsvector de la observación. Debe coincidir exactamente con la
+    del índice ix_<tabla>_observacion_fts para que Postgres lo use.
+    """
+    return func.to_tsvector(literal_column("'spanish'::regconfig"), func.coalesce(modelo.__table__.c.observacion, ""))
+
+
+def ddl_fts_sqlite(tabla):
+    """
+    Tabla FTS5 de contenido externo sobre <tabla>.observacion y los
+    triggers que la mantienen. Es el respaldo de SQLite para los tests y el
+    desarrollo local; en Postgres se usa el índice GIN sobre el tsvector.
+    """
+    fts = f"{tabla}_fts"
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(observacion, content='{tabla}', "
+        f"content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {tabla} BEGIN "
+        f"INSERT INTO {fts}(rowid, observacion) VALUES (new.id, new.observacion); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {tabla} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, observacion) VALUES ('delete', old.id, old.observacion); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF observacion ON {tabla} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, observacion) VALUES ('delete', old.id, old.observacion); "
+        f"INSERT INTO {fts}(rowid, observacion) VALUES (new.id, new.observacion); END",
+    ]
+
+
+def consulta_fts5(texto):
+    """Cada palabra entre comillas y como prefijo: el texto del usuario nunca se interpreta como sintaxis FTS5."""
+    return " ".join(f'"{p}"*' for p in RE_PALABRAS.findall(texto))
+
+
+def _puntaje_texto(columna, texto):
+    """Respaldo de similarity() para SQLite: igual > prefijo > contiene."""
+    return case(
+        (func.lower(columna) == texto.lower(), 1.0),
+        (columna.istartswith(texto, autoescape=True), 0.6),
+        (columna.icontains(texto, autoescape=True), 0.3),
+        else_=0.0,
+    )
+
+
+def _columnas(modelo, tipo, rango):
+    return (
+        modelo.id,
+        literal(tipo).label("tipo"),
+        modelo.numero_guia,
+        modelo.rut_empresa,
+        modelo.fecha,
+        modelo.observacion,
+        rango.label("rango"),
+    )
+
+
+def select_busqueda(modelo, tipo, usuario_id, texto):
+    """
+    SELECT de los movimientos de `modelo` del usuario que calzan con `texto`
+    en la observación (texto completo) o en numero_guia/rut_empresa
+    (substring, con los índices trigram), con una columna `rango`: mayor es
+    más relevante. Se combina con union_all como en el historial unificado.
+    """
+    coincide_codigo = [
+        modelo.numero_guia.icontains(texto, autoescape=True),
+        modelo.rut_empresa.icontains(texto, autoescape=True),
+    ]
+    if cuerpos_busqueda(texto):
+        # El RUT se guarda como se escribió ('76.086.428-5'): por cuerpo se encuentra igual
+        coincide_codigo.append(filtro_rut(modelo.rut_empresa_cuerpo, texto))
+
+    if db.engine.dialect.name == "postgresql":
+        consulta = func.websearch_to_tsquery(literal_column("'spanish'::regconfig"), texto)
+        vector = vector_observacion(modelo)
+        rango = func.ts_rank(vector, consulta) + func.greatest(
+            func.similarity(modelo.numero_guia, texto), func.similarity(modelo.rut_empresa, texto)
+        )
+        query = select(*_columnas(modelo, tipo, rango)).where(or_(vector.op("@@")(consulta), *coincide_codigo))
+    else:
+        fts = table(f"{modelo.__tablename__}_fts", column("rowid"), column("observacion"))
+        consulta = consulta_fts5(texto)
+        if consulta:
+            # bm25 es negativo: más negativo, más relevante
+            coincidencias = select(
+                fts.c.rowid.label("id"), (-func.bm25(literal_column(fts.name))).label("rango")
+            ).where(fts.c.observacion.op("MATCH")(consulta)).subquery()
+        else:
+            coincidencias = select(literal(None).label("id"), literal(0.0).label("rango")).where(literal(False)).subquery()
+        rango = func.coalesce(coincidencias.c.rango, 0.0) + func.max(
+            _puntaje_texto(modelo.numero_guia, texto), _puntaje_texto(modelo.rut_empresa, texto)
+        )
+        query = select(*_columnas(modelo, tipo, rango)).outerjoin(
+            coincidencias, coincidencias.c.id == modelo.id
+        ).where(or_(coincidencias.c.id.is_not(None), *coincide_codigo))
+
+    return query.where(modelo.usuario_id == usuario_id)
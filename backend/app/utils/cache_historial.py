@@ -0,0 +1,142 @@
+import hashlib
+import threading
+import time
+import uuid
+from functools import wraps
+from flask import current_app, make_response, request
+from flask_jwt_extended import get_jwt_identity
+from app.utils.revocacion import CacheLRU
+
+
+class BackendMemoria:
+    """
+    Versiones y respuestas en el proceso: sólo para un worker (desarrollo y
+    tests). Con varios workers una escritura sólo avanza la versión del que
+    la atendió; para acotar ese desfase la ventana de TTL entra en la clave,
+    así los ETags y respuestas de otros workers vencen a lo más en un TTL.
+    """
+
+    def __init__(self, max_entradas):
+        self.versiones = {}
+        self.respuestas = CacheLRU(max_entradas)
+        self._lock = threading.Lock()
+        # Distingue los ETags de antes de un reinicio, cuando las versiones vuelven a 0
+        self.epoca = uuid.uuid4().hex[:8]
+
+    def marca(self, ttl):
+        return f"{self.epoca}.{int(time.time() // ttl)}."
+
+    def version(self, usuario_id):
+        return self.versiones.get(usuario_id, 0)
+
+    def incrementar(self, usuario_id):
+        with self._lock:
+            self.versiones[usuario_id] = self.versiones.get(usuario_id, 0) + 1
+
+    def obtener(self, clave):
+        return self.respuestas.obtener(clave)
+
+    def guardar(self, clave, cuerpo, ttl):
+        self.respuestas.guardar(clave, cuerpo, time.time() + ttl)
+
+
+class BackendRedis:
+    """Versiones con INCR y respuestas con SET EX, compartidas por todos los workers."""
+
+    def __init__(self, url, prefijo="historial:"):
+        import redis
+
+        self.cliente = redis.Redis.from_url(url)
+        self.prefijo = prefijo
+
+    def marca(self, ttl):
+        # Versiones compartidas: no hace falta vencer los ETags por tiempo
+        return ""
+
+    def version(self, usuario_id):
+        return int(self.cliente.get(f"{self.prefijo}version:{usuario_id}") or 0)
+
+    def incrementar(self, usuario_id):
+        self.cliente.incr(f"{self.prefijo}version:{usuario_id}")
+
+    def obtener(self, clave):
+        return self.cliente.get(self.prefijo + clave)
+
+    def guardar(self, clave, cuerpo, ttl):
+        self.cliente.set(self.prefijo + clave, cuerpo, ex=ttl)
+
+
+class CacheHistorial:
+    """
+    Caché de las páginas del historial. Cada usuario tiene un contador de
+    versión que se incrementa cuando cambia alguno de sus movimientos o
+    fotos; la clave de una respuesta es (usuario, versión, endpoint, filtros),
+    así que al incrementar quedan obsoletas todas sus páginas sin borrar nada.
+    El ETag se deriva de la misma clave: un 304 sólo necesita leer la versión.
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.ttl = 300
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        tipo = app.config.get("HISTORIAL_CACHE_BACKEND", "none")
+        if tipo == "redis":
+            self.backend = BackendRedis(app.config["REDIS_URL"])
+        elif tipo == "memory":
+            self.backend = BackendMemoria(app.config.get("HISTORIAL_CACHE_SIZE", 5000))
+        elif tipo == "none":
+            self.backend = None
+        else:
+            raise ValueError(f"HISTORIAL_CACHE_BACKEND desconocido: {tipo}")
+        self.ttl = app.config.get("HISTORIAL_CACHE_TTL", 300)
+        app.extensions["cache_historial"] = self
+
+    def invalidar(self, *usuarios):
+        """Llamar después del commit que modifica movimientos o fotos de estos usuarios."""
+        if self.backend is None:
+            return
+        for usuario_id in set(usuarios):
+            if usuario_id is not None:
+                self.backend.incrementar(int(usuario_id))
+
+    def _clave(self, usuario_id):
+        version = self.backend.version(usuario_id)
+        filtros = "&".join(f"{k}={v}" for k, v in sorted(request.args.items(multi=True)) if v != "")
+        return f"{usuario_id}:{self.backend.marca(self.ttl)}{version}:{request.endpoint}:{filtros}"
+
+
+cache_historial = CacheHistorial()
+
+
+def historial_cacheado(vista):
+    """
+    Decorador para vistas de historial (debajo de @jwt_required): responde
+    304 si el If-None-Match coincide con la versión actual, o la respuesta
+    guardada si existe; si no, ejecuta la vista y guarda el cuerpo.
+    """
+    @wraps(vista)
+    def envoltura(*args, **kwargs):
+        if cache_historial.backend is None:
+            return vista(*args, **kwargs)
+        clave = cache_historial._clave(int(get_jwt_identity()))
+        etag = hashlib.sha1(clave.encode()).hexdigest()
+        if etag in request.if_none_match:
+            respuesta = current_app.response_class(status=304)
+        else:
+            cuerpo = cache_historial.backend.obtener(clave)
+            if cuerpo is not None:
+                respuesta = current_app.response_class(cuerpo, mimetype="application/json")
+            else:
+                respuesta = make_response(vista(*args, **kwargs))
+                if respuesta.status_code != 200:
+                    return respuesta
+                cache_historial.backend.guardar(clave, respuesta.get_data(), cache_historial.ttl)
+        respuesta.set_etag(etag)
+        # El cliente puede guardar la página pero debe revalidarla en cada consulta
+        respuesta.cache_control.private = True
+        respuesta.cache_control.no_cache = True
+        return respuesta
+    return envoltura
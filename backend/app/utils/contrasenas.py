@@ -0,0 +1,100 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash, DEFAULT_PBKDF2_ITERATIONS
+
+
+class HashSaturado(Exception):
+    """Hay PASSWORD_HASH_MAX_PENDING verificaciones en curso; el cliente debe reintentar."""
+
+
+def metodo_canonico(metodo):
+    """
+    Completa el método con los parámetros por defecto de werkzeug, tal como
+    queda guardado en el hash: 'scrypt' -> 'scrypt:32768:8:1',
+    'pbkdf2' -> 'pbkdf2:sha256:<iteraciones>'.
+    """
+    partes = metodo.split(":")
+    if partes[0] == "scrypt":
+        defecto = ["scrypt", "32768", "8", "1"]
+    elif partes[0] == "pbkdf2":
+        defecto = ["pbkdf2", "sha256", str(DEFAULT_PBKDF2_ITERATIONS)]
+    else:
+        raise ValueError(f"PASSWORD_HASH_METHOD desconocido: {metodo}")
+    return ":".join(partes + defecto[len(partes):])
+
+
+def metodo_configurado():
+    return metodo_canonico(current_app.config.get("PASSWORD_HASH_METHOD", "scrypt"))
+
+
+class PoolHash:
+    """
+    Ejecuta hashing y verificación de contraseñas en un pool de hilos propio.
+    El hilo de la solicitud espera el resultado: el pool no descarga trabajo,
+    sólo limita a `workers` los núcleos que el hashing ocupa a la vez (hashlib
+    libera el GIL, así que el resto de los hilos sigue atendiendo subidas).
+    Con más de max_pendientes solicitudes en curso se lanza HashSaturado en
+    vez de encolar sin límite. `flask benchmark-hash` mide a través del pool.
+    """
+
+    def __init__(self, app=None):
+        self.workers = 2
+        self.max_pendientes = 16
+        self._executor = None
+        self._cupos = None
+        self._pid = None
+        self._senuelos = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.workers = app.config.get("PASSWORD_HASH_WORKERS", 2)
+        self.max_pendientes = app.config.get("PASSWORD_HASH_MAX_PENDING", 16)
+        self._executor = None
+        app.extensions["pool_hash"] = self
+
+    def _get_executor(self):
+        # Uno por proceso: los workers se bifurcan después de create_app
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="hash")
+                self._cupos = threading.BoundedSemaphore(self.max_pendientes)
+                self._pid = os.getpid()
+            return self._executor
+
+    def _ejecutar(self, funcion, *args):
+        executor = self._get_executor()
+        if not self._cupos.acquire(blocking=False):
+            raise HashSaturado()
+        try:
+            return executor.submit(funcion, *args).result()
+        finally:
+            self._cupos.release()
+
+    def hashear(self, password, metodo=None):
+        return self._ejecutar(generate_password_hash, password, metodo or metodo_configurado())
+
+    def verificar(self, password_hash, password):
+        """
+        Verifica en el pool. Sin hash (usuario inexistente) se compara contra
+        un hash señuelo del mismo método para no revelar por el tiempo de
+        respuesta qué RUT existen.
+        """
+        if password_hash is None:
+            metodo = metodo_configurado()
+            if metodo not in self._senuelos:
+                self._senuelos[metodo] = self.hashear(os.urandom(16).hex(), metodo)
+            self._ejecutar(check_password_hash, self._senuelos[metodo], password)
+            return False
+        return self._ejecutar(check_password_hash, password_hash, password)
+
+
+def necesita_rehash(password_hash):
+    """True si el hash se generó con otro método o costo que el configurado."""
+    return password_hash.split("$", 1)[0] != metodo_configurado()
+
+
+pool_hash = PoolHash()
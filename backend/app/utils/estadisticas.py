@@ -0,0 +1,78 @@
+from datetime import datetime, timedelta
+from sqlalchemy import delete, func, insert, literal, literal_column, select, type_coerce
+from app import db
+from app.models import Despacho, Recepcion, FotoDespacho, FotoRecepcion, EstadisticaHora
+
+MOVIMIENTOS = (
+    ("despacho", Despacho, FotoDespacho.despacho_id),
+    ("recepcion", Recepcion, FotoRecepcion.recepcion_id),
+)
+
+
+def truncar_fecha(columna, unidad):
+    """
+    Trunca a 'hour' o 'day'. En Postgres es date_trunc; en SQLite strftime
+    con el mismo formato de texto en que SQLAlchemy guarda los DateTime,
+    para que las comparaciones con parámetros sigan funcionando.
+    """
+    if db.engine.dialect.name == "postgresql":
+        truncada = func.date_trunc(literal_column(f"'{unidad}'"), columna)
+    else:
+        formato = {"hour": "%Y-%m-%d %H:00:00.000000", "day": "%Y-%m-%d 00:00:00.000000"}[unidad]
+        truncada = func.strftime(formato, columna)
+    return type_coerce(truncada, db.DateTime)
+
+
+def actualizar_estadisticas(desde=None, hasta=None):
+    """
+    Recalcula las filas de estadistica_hora de las horas en [desde, hasta)
+    a partir de despacho/recepcion y sus fotos; sin desde, todo el historial.
+    Es idempotente: borra y vuelve a insertar el rango. Sólo corrige las
+    horas del rango: los cambios en horas anteriores (sincronizaciones
+    offline con fechas pasadas, fotos agregadas después, ediciones y
+    eliminaciones de filas antiguas) quedan para el recálculo completo
+    diario. Retorna las filas insertadas.
+    """
+    if desde is None:
+        desde = min(
+            (f for f in (db.session.scalar(select(func.min(m.fecha))) for _, m, _ in MOVIMIENTOS) if f),
+            default=datetime.utcnow(),
+        )
+    desde = desde.replace(minute=0, second=0, microsecond=0)
+    hasta = hasta or datetime.utcnow() + timedelta(hours=1)
+    rango = (EstadisticaHora.hora >= desde) & (EstadisticaHora.hora < hasta)
+    db.session.execute(delete(EstadisticaHora).where(rango))
+
+    insertadas = 0
+    for tipo, modelo, columna_foto in MOVIMIENTOS:
+        # Sólo las fotos de los movimientos del rango, no las tablas completas
+        fotos = (
+            select(columna_foto.label("movimiento_id"), func.count().label("cantidad"))
+            .join(modelo, columna_foto == modelo.id)
+            .where(modelo.fecha >= desde, modelo.fecha < hasta)
+            .group_by(columna_foto)
+            .subquery()
+        )
+        hora = truncar_fecha(modelo.fecha, "hour")
+        resumen = (
+            select(
+                hora,
+                literal(tipo),
+                modelo.usuario_id,
+                modelo.rut_empresa_cuerpo,
+                func.count(modelo.id),
+                func.coalesce(func.sum(fotos.c.cantidad), 0),
+            )
+            .select_from(modelo)
+            .outerjoin(fotos, fotos.c.movimiento_id == modelo.id)
+            .where(modelo.fecha >= desde, modelo.fecha < hasta)
+            .group_by(hora, modelo.usuario_id, modelo.rut_empresa_cuerpo)
+        )
+        insertadas += db.session.execute(
+            insert(EstadisticaHora).from_select(
+                ["hora", "tipo_movimiento", "usuario_id", "rut_empresa_cuerpo", "movimientos", "fotos"],
+                resumen
+            )
+        ).rowcount
+    db.session.commit()
+    return insertadas
@@ -0,0 +1,266 @@
+import os
+import re
+import shutil
+import hashlib
+import logging
+import mimetypes
+import tempfile
+from flask import Response, abort, current_app, request, send_file
+from sqlalchemy import update, delete, event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from app import db
+from app.models import ArchivoBlob
+from werkzeug.security import safe_join
+from app.utils.imagenes import nombre_variante, VARIANTES
+
+TAMANO_BLOQUE = 64 * 1024
+# Los archivos nunca cambian de contenido: se pueden cachear por un año
+MAX_AGE_FOTOS = 365 * 24 * 3600
+RE_RUTA_HASH = re.compile(r"^[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})(?:_[a-z]+)?\.[a-z0-9]+$")
+CLAVE_POR_BORRAR = "archivos_por_borrar"
+CLAVE_NUEVOS = "archivos_nuevos"
+
+
+def borrar_tras_commit(*rutas_absolutas):
+    """
+    Borra los archivos cuando la transacción en curso se confirma; si se
+    revierte se conservan, así ninguna fila queda apuntando a un archivo borrado.
+    """
+    db.session.info.setdefault(CLAVE_POR_BORRAR, []).extend(rutas_absolutas)
+
+
+def _borrar(rutas):
+    for ruta in rutas:
+        try:
+            os.remove(ruta)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.warning("No se pudo borrar %s: %s", ruta, e)
+
+
+@event.listens_for(Session, "after_commit")
+def _borrar_pendientes(session):
+    session.info.pop(CLAVE_NUEVOS, None)
+    _borrar(session.info.pop(CLAVE_POR_BORRAR, []))
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _descartar_pendientes(session, transaccion_anterior):
+    # Sólo la transacción externa: un SAVEPOINT revertido no anula lo demás
+    if transaccion_anterior.parent is None:
+        session.info.pop(CLAVE_POR_BORRAR, None)
+        # Archivos escritos por guardar_archivo cuyo registro en archivo_blob se revirtió
+        _borrar(session.info.pop(CLAVE_NUEVOS, []))
+
+
+def ruta_por_hash(sha256, extension):
+    """Ruta relativa en dos niveles de carpetas según el prefijo del hash: ab/cd/abcd....jpg"""
+    return os.path.join(sha256[:2], sha256[2:4], f"{sha256}.{extension}").replace(os.sep, "/")
+
+
+def _registrar_referencia(sha256, ruta, tamano):
+    actualizadas = db.session.execute(
+        update(ArchivoBlob)
+        .where(ArchivoBlob.sha256 == sha256)
+        .values(referencias=ArchivoBlob.referencias + 1)
+    ).rowcount
+    if actualizadas:
+        return db.session.get(ArchivoBlob, sha256).ruta
+    try:
+        with db.session.begin_nested():
+            db.session.add(ArchivoBlob(sha256=sha256, ruta=ruta, tamano=tamano, referencias=1))
+    except IntegrityError:
+        # Otra solicitud registró el mismo contenido al mismo tiempo
+        return _registrar_referencia(sha256, ruta, tamano)
+    return ruta
+
+
+def guardar_archivo(stream, carpeta, extension):
+    """
+    Guarda el contenido direccionado por su SHA-256. Se escribe a un archivo
+    temporal mientras se calcula el hash y luego se mueve a su ruta definitiva;
+    si el contenido ya existe se descarta la copia y sólo se suma una referencia.
+    Si la transacción se revierte, el archivo nuevo se borra.
+    Retorna la ruta relativa a la carpeta de uploads.
+    """
+    extension = extension.lower()
+    temporales = os.path.join(carpeta, "tmp")
+    os.makedirs(temporales, exist_ok=True)
+    sha = hashlib.sha256()
+    tamano = 0
+    fd, ruta_temporal = tempfile.mkstemp(dir=temporales)
+    try:
+        with os.fdopen(fd, "wb") as destino:
+            for bloque in iter(lambda: stream.read(TAMANO_BLOQUE), b""):
+                sha.update(bloque)
+                destino.write(bloque)
+                tamano += len(bloque)
+        sha256 = sha.hexdigest()
+        ruta = _registrar_referencia(sha256, ruta_por_hash(sha256, extension), tamano)
+        ruta_absoluta = os.path.join(carpeta, ruta)
+        if os.path.exists(ruta_absoluta):
+            os.remove(ruta_temporal)
+        else:
+            os.makedirs(os.path.dirname(ruta_absoluta), exist_ok=True)
+            os.replace(ruta_temporal, ruta_absoluta)
+            db.session.info.setdefault(CLAVE_NUEVOS, []).append(ruta_absoluta)
+    except Exception:
+        if os.path.exists(ruta_temporal):
+            os.remove(ruta_temporal)
+        raise
+    return ruta
+
+
+def _eliminar_con_variantes(carpeta, ruta):
+    borrar_tras_commit(*(os.path.join(carpeta, relativa) for relativa in [ruta] + [nombre_variante(ruta, v) for v in VARIANTES]))
+
+
+def liberar_archivo(carpeta, ruta):
+    """
+    Resta una referencia al contenido y, cuando ya no lo usa ninguna foto,
+    borra el archivo (y sus variantes) tras el commit. El descuento es un
+    UPDATE atómico: dos liberaciones simultáneas no pierden referencias.
+    Los archivos antiguos sin registro en archivo_blob se borran directamente.
+    """
+    blob = db.session.execute(
+        update(ArchivoBlob)
+        .where(ArchivoBlob.ruta == ruta)
+        .values(referencias=ArchivoBlob.referencias - 1)
+        .returning(ArchivoBlob.sha256, ArchivoBlob.referencias)
+    ).first()
+    if blob is None:
+        _eliminar_con_variantes(carpeta, ruta)
+        return
+    if blob.referencias <= 0:
+        db.session.execute(delete(ArchivoBlob).where(ArchivoBlob.sha256 == blob.sha256, ArchivoBlob.referencias <= 0))
+        _eliminar_con_variantes(carpeta, ruta)
+
+
+def hash_archivo(ruta_absoluta):
+    sha = hashlib.sha256()
+    with open(ruta_absoluta, "rb") as f:
+        for bloque in iter(lambda: f.read(TAMANO_BLOQUE), b""):
+            sha.update(bloque)
+    return sha.hexdigest()
+
+
+def _copiar(origen, destino):
+    """Enlace duro si se puede (misma carpeta de uploads), si no copia; atómico vía temporal."""
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    temporal = f"{destino}.tmp"
+    try:
+        os.link(origen, temporal)
+    except OSError:
+        shutil.copy2(origen, temporal)
+    os.replace(temporal, destino)
+
+
+def _migrar_foto(carpeta, foto, resumen):
+    origen = os.path.join(carpeta, foto.ruta_archivo)
+    if not os.path.exists(origen):
+        resumen["faltantes"] += 1
+        return
+    sha256 = hash_archivo(origen)
+    extension = foto.ruta_archivo.rsplit(".", 1)[-1].lower()
+    ruta = _registrar_referencia(sha256, ruta_por_hash(sha256, extension), os.path.getsize(origen))
+    destino = os.path.join(carpeta, ruta)
+    # Se copia y el original se borra tras el commit del lote: si se revierte,
+    # la foto sigue apuntando a un archivo que existe
+    if os.path.exists(destino):
+        resumen["duplicados"] += 1
+    else:
+        _copiar(origen, destino)
+    borrar_tras_commit(origen)
+    for variante in VARIANTES:
+        anterior = os.path.join(carpeta, nombre_variante(foto.ruta_archivo, variante))
+        nueva = os.path.join(carpeta, nombre_variante(ruta, variante))
+        if os.path.exists(anterior):
+            if not os.path.exists(nueva):
+                _copiar(anterior, nueva)
+            borrar_tras_commit(anterior)
+    foto.ruta_archivo = ruta
+    foto.ruta_thumb = nombre_variante(ruta, "thumb") if foto.ruta_thumb else None
+    foto.ruta_medium = nombre_variante(ruta, "medium") if foto.ruta_medium else None
+    resumen["migradas"] += 1
+
+
+def migrar_archivos_existentes(carpeta, modelos, tamano_lote=200):
+    """
+    Mueve los archivos del directorio plano de uploads a la estructura por
+    hash, deduplicando contenidos idénticos, y actualiza ruta_archivo.
+    Se confirma por lotes, así que puede interrumpirse y volver a ejecutarse.
+    """
+    resumen = {"migradas": 0, "duplicados": 0, "faltantes": 0}
+    for modelo in modelos:
+        ultimo_id = 0
+        while True:
+            lote = (
+                modelo.query.filter(modelo.id > ultimo_id, ~modelo.ruta_archivo.contains("/"))
+                .order_by(modelo.id).limit(tamano_lote).all()
+            )
+            if not lote:
+                break
+            for foto in lote:
+                _migrar_foto(carpeta, foto, resumen)
+            ultimo_id = lote[-1].id
+            db.session.commit()
+    return resumen
+
+
+def _etag_archivo(ruta, stat):
+    """
+    (etag, débil): el hash es un validador fuerte si la ruta es direccionada
+    por contenido; mtime+tamaño de los archivos antiguos sólo es débil.
+    """
+    if RE_RUTA_HASH.match(ruta):
+        return ruta.rsplit("/", 1)[-1].rsplit(".", 1)[0], False
+    return f"{int(stat.st_mtime)}-{stat.st_size}", True
+
+
+def servir_archivo(carpeta, ruta, as_attachment=False, publico=True):
+    """
+    Entrega una foto con ETag, Cache-Control immutable, GET condicional
+    (304) y rangos de bytes. Con PHOTO_OFFLOAD='x-accel' sólo responde las
+    cabeceras y deja que nginx envíe el archivo (X-Accel-Redirect); con
+    'x-sendfile' lo hace send_file mediante USE_X_SENDFILE. En ambos casos
+    los rangos los resuelve el proxy.
+    """
+    ruta_absoluta = safe_join(carpeta, ruta)
+    if ruta_absoluta is None or not os.path.isfile(ruta_absoluta):
+        abort(404)
+    stat = os.stat(ruta_absoluta)
+    etag, debil = _etag_archivo(ruta, stat)
+    nombre_descarga = os.path.basename(ruta)
+    offload = current_app.config.get("PHOTO_OFFLOAD") in ("x-accel", "x-sendfile")
+
+    if current_app.config.get("PHOTO_OFFLOAD") == "x-accel":
+        respuesta = Response(mimetype=mimetypes.guess_type(ruta)[0] or "application/octet-stream")
+        prefijo = current_app.config["X_ACCEL_PREFIX"].rstrip("/")
+        respuesta.headers["X-Accel-Redirect"] = f"{prefijo}/{ruta}"
+        if as_attachment:
+            respuesta.headers["Content-Disposition"] = f'attachment; filename="{nombre_descarga}"'
+        respuesta.last_modified = stat.st_mtime
+    else:
+        respuesta = send_file(
+            ruta_absoluta,
+            as_attachment=as_attachment,
+            download_name=nombre_descarga,
+            etag=etag,
+            last_modified=stat.st_mtime,
+            conditional=False,
+        )
+    respuesta.set_etag(etag, weak=debil)
+
+    respuesta.cache_control.no_cache = None
+    respuesta.cache_control.max_age = MAX_AGE_FOTOS
+    respuesta.cache_control.immutable = True
+    if publico:
+        respuesta.cache_control.public = True
+    else:
+        respuesta.cache_control.private = True
+    # Con X-Accel-Redirect o X-Sendfile el cuerpo va vacío: los rangos los resuelve el proxy
+    if not offload:
+        respuesta.accept_ranges = "bytes"
+    return respuesta.make_conditional(request, accept_ranges=not offload, complete_length=stat.st_size)
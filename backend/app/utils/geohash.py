@@ -0,0 +1,131 @@
+import math
+from sqlalchemy import and_, false, or_
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+PRECISION = 9  # celdas de ~4,8 m x 4,8 m: la columna geohash se guarda con esta precisión
+METROS_POR_GRADO = 111320.0
+
+
+def codificar(latitud, longitud, precision=PRECISION):
+    """Geohash de un punto; None si falta alguna coordenada o está fuera de rango."""
+    if latitud is None or longitud is None:
+        return None
+    if not (-90 <= latitud <= 90 and -180 <= longitud <= 180):
+        return None
+    lat = [-90.0, 90.0]
+    lon = [-180.0, 180.0]
+    caracteres = []
+    bits = 0
+    valor = 0
+    par = True
+    while len(caracteres) < precision:
+        intervalo, coordenada = (lon, longitud) if par else (lat, latitud)
+        medio = (intervalo[0] + intervalo[1]) / 2
+        if coordenada >= medio:
+            valor = valor * 2 + 1
+            intervalo[0] = medio
+        else:
+            valor = valor * 2
+            intervalo[1] = medio
+        par = not par
+        bits += 1
+        if bits == 5:
+            caracteres.append(BASE32[valor])
+            bits = 0
+            valor = 0
+    return "".join(caracteres)
+
+
+def caja(geohash):
+    """(sur, oeste, norte, este) de la celda."""
+    lat = [-90.0, 90.0]
+    lon = [-180.0, 180.0]
+    par = True
+    for c in geohash:
+        valor = BASE32.index(c)
+        for desplazamiento in range(4, -1, -1):
+            intervalo = lon if par else lat
+            medio = (intervalo[0] + intervalo[1]) / 2
+            if (valor >> desplazamiento) & 1:
+                intervalo[0] = medio
+            else:
+                intervalo[1] = medio
+            par = not par
+    return lat[0], lon[0], lat[1], lon[1]
+
+
+def tamano_celda(precision):
+    """(alto, ancho) en grados de una celda de esta precisión."""
+    bits = 5 * precision
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** ((bits + 1) // 2)
+
+
+def _indices(sur, oeste, norte, este, precision):
+    alto, ancho = tamano_celda(precision)
+    filas = range(int((sur + 90) // alto), int(min((norte + 90) // alto, 180 / alto - 1)) + 1)
+    columnas = range(int((oeste + 180) // ancho), int(min((este + 180) // ancho, 360 / ancho - 1)) + 1)
+    return filas, columnas, alto, ancho
+
+
+def precision_para(sur, oeste, norte, este, max_celdas):
+    """Mayor precisión con la que la caja queda cubierta por a lo más `max_celdas` celdas."""
+    mejor = 1
+    for precision in range(1, PRECISION + 1):
+        filas, columnas, _, _ = _indices(sur, oeste, norte, este, precision)
+        if len(filas) * len(columnas) > max_celdas:
+            break
+        mejor = precision
+    return mejor
+
+
+def cubrir(sur, oeste, norte, este, max_celdas=16):
+    """Prefijos geohash cuyas celdas cubren la caja (no cruza el antimeridiano)."""
+    precision = precision_para(sur, oeste, norte, este, max_celdas)
+    filas, columnas, alto, ancho = _indices(sur, oeste, norte, este, precision)
+    return sorted(
+        codificar((f + 0.5) * alto - 90, (c + 0.5) * ancho - 180, precision)
+        for f in filas for c in columnas
+    )
+
+
+def _siguiente(prefijo):
+    """Menor texto mayor que todos los que empiezan con `prefijo`; None si no hay."""
+    while prefijo and prefijo[-1] == BASE32[-1]:
+        prefijo = prefijo[:-1]
+    if not prefijo:
+        return None
+    return prefijo[:-1] + BASE32[BASE32.index(prefijo[-1]) + 1]
+
+
+def filtro_geohash(columna, prefijos):
+    """
+    Condición "empieza con alguno de los prefijos" como rangos [p, siguiente(p)):
+    cada uno es una búsqueda por rango en el índice, en Postgres y en SQLite,
+    sin depender de LIKE ni de la collation.
+    """
+    if not prefijos:
+        return false()
+    rangos = []
+    for prefijo in prefijos:
+        superior = _siguiente(prefijo)
+        rangos.append(and_(columna >= prefijo, columna < superior) if superior else columna >= prefijo)
+    return or_(*rangos)
+
+
+def caja_radio(latitud, longitud, metros):
+    """Caja (sur, oeste, norte, este) que contiene el círculo."""
+    dlat = metros / METROS_POR_GRADO
+    dlon = metros / (METROS_POR_GRADO * max(math.cos(math.radians(latitud)), 1e-6))
+    return max(latitud - dlat, -90), max(longitud - dlon, -180), min(latitud + dlat, 90), min(longitud + dlon, 180)
+
+
+def filtro_radio(col_latitud, col_longitud, latitud, longitud, metros):
+    """
+    Distancia equirectangular <= metros, con sólo aritmética para que corra
+    igual en Postgres y SQLite. El error frente a haversine es despreciable
+    para radios de decenas de kilómetros.
+    """
+    escala = math.cos(math.radians(latitud))
+    dy = col_latitud - latitud
+    dx = (col_longitud - longitud) * escala
+    return dx * dx + dy * dy <= (metros / METROS_POR_GRADO) ** 2
@@ -0,0 +1,69 @@
+import os
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from flask import current_app
+from PIL import Image, ImageOps
+from app import db
+
+# Lado máximo en píxeles de cada variante
+VARIANTES = {"thumb": 320, "medium": 1280}
+CALIDAD_WEBP = 80
+
+_executor = None
+
+
+def _get_executor(max_workers):
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=max_workers)
+    return _executor
+
+
+def nombre_variante(ruta_archivo, variante):
+    return f"{os.path.splitext(ruta_archivo)[0]}_{variante}.webp"
+
+
+def generar_variantes(carpeta, ruta_archivo):
+    """
+    Genera las variantes WebP de una foto. Se ejecuta en un proceso del pool,
+    fuera del hilo de la solicitud. Retorna {variante: ruta_relativa}.
+    """
+    generadas = {v: nombre_variante(ruta_archivo, v) for v in VARIANTES}
+    if all(os.path.exists(os.path.join(carpeta, r)) for r in generadas.values()):
+        # Contenido deduplicado: las variantes ya existen
+        return generadas
+    with Image.open(os.path.join(carpeta, ruta_archivo)) as img:
+        # En JPEG decodifica directamente a escala reducida
+        lado_mayor = max(VARIANTES.values())
+        img.draft("RGB", (lado_mayor, lado_mayor))
+        img = ImageOps.exif_transpose(img).convert("RGB")
+        for variante, lado in sorted(VARIANTES.items(), key=lambda v: -v[1]):
+            img.thumbnail((lado, lado), Image.Resampling.LANCZOS)
+            img.save(os.path.join(carpeta, generadas[variante]), "WEBP", quality=CALIDAD_WEBP, method=4)
+    return generadas
+
+
+def _registrar_variantes(app, modelo, foto_id, futuro):
+    try:
+        generadas = futuro.result()
+    except Exception as e:
+        logging.error("Error generando variantes de %s %s: %s", modelo.__name__, foto_id, e)
+        return
+    with app.app_context():
+        foto = db.session.get(modelo, foto_id)
+        if not foto:
+            return
+        foto.ruta_thumb = generadas.get("thumb")
+        foto.ruta_medium = generadas.get("medium")
+        db.session.commit()
+
+
+def programar_variantes(modelo, fotos):
+    """Encola la generación de variantes de las fotos ya guardadas (con id)."""
+    app = current_app._get_current_object()
+    carpeta = app.config["UPLOAD_FOLDER"]
+    executor = _get_executor(app.config.get("IMAGE_WORKERS", 2))
+    for foto in fotos:
+        futuro = executor.submit(generar_variantes, carpeta, foto.ruta_archivo)
+        futuro.add_done_callback(partial(_registrar_variantes, app, modelo, foto.id))
@@ -0,0 +1,180 @@
+import csv
+import io
+import math
+import os
+from datetime import datetime
+from itertools import islice
+from sqlalchemy import insert
+from app import db
+from app.schemas import validar_ruts_lote, RANGO_LATITUD, RANGO_LONGITUD
+from app.utils.rut import partes_rut
+from app.utils.geohash import codificar as codificar_geohash
+from app.utils.zonas import zonas
+
+COLUMNAS_COPY = ("numero_guia", "rut_empresa", "rut_empresa_cuerpo", "rut_empresa_dv", "fecha",
+                 "usuario_id", "latitud", "longitud", "geohash", "zona", "observacion")
+FORMATOS_FECHA = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d", "%d-%m-%Y %H:%M", "%d-%m-%Y", "%d/%m/%Y")
+
+
+def leer_filas(ruta):
+    """
+    Recorre el archivo sin cargarlo completo y entrega (número de línea,
+    dict por encabezado). CSV con ',' o ';' (exportación del ERP) o XLSX,
+    que se lee con openpyxl en modo read_only. ValueError si no se reconoce
+    el separador del CSV.
+    """
+    if ruta.lower().endswith(".xlsx"):
+        from openpyxl import load_workbook
+
+        libro = load_workbook(ruta, read_only=True, data_only=True)
+        try:
+            filas = libro.active.iter_rows(values_only=True)
+            encabezado = [str(c).strip().lower() if c is not None else "" for c in next(filas, [])]
+            for linea, valores in enumerate(filas, start=2):
+                yield linea, dict(zip(encabezado, valores))
+        finally:
+            libro.close()
+        return
+
+    with open(ruta, newline="", encoding="utf-8-sig") as archivo:
+        muestra = archivo.read(4096)
+        archivo.seek(0)
+        try:
+            dialecto = csv.Sniffer().sniff(muestra, delimiters=",;")
+        except csv.Error:
+            raise ValueError("No se pudo detectar el separador del CSV (se espera ',' o ';')")
+        lector = csv.DictReader(archivo, dialect=dialecto)
+        lector.fieldnames = [c.strip().lower() for c in lector.fieldnames or []]
+        for fila in lector:
+            yield lector.line_num, fila
+
+
+def _texto(valor):
+    if isinstance(valor, float) and valor.is_integer():
+        # Las celdas numéricas de XLSX llegan como float: 12345.0 -> "12345"
+        return str(int(valor))
+    return str(valor).strip() if valor is not None else ""
+
+
+def _fecha(valor):
+    if isinstance(valor, datetime):
+        return valor
+    texto = _texto(valor)
+    if not texto:
+        return datetime.utcnow()
+    for formato in FORMATOS_FECHA:
+        try:
+            return datetime.strptime(texto, formato)
+        except ValueError:
+            pass
+    raise ValueError(f"Fecha inválida: {texto}")
+
+
+def _decimal(valor):
+    texto = _texto(valor).replace(",", ".")
+    return float(texto) if texto else None
+
+
+def _coordenada(valor, rango, campo):
+    """Latitud o longitud con el mismo rango que exigen los schemas de la API."""
+    numero = _decimal(valor)
+    if numero is None:
+        return None
+    if not math.isfinite(numero) or not rango.min <= numero <= rango.max:
+        raise ValueError(f"{campo} fuera de rango [{rango.min}, {rango.max}]: {_texto(valor)}")
+    return numero
+
+
+def preparar_lote(filas, usuario_id, cache_ruts):
+    """
+    Valida un lote de (línea, fila), fila por fila; los RUTs pasan por
+    validar_ruts_lote, que memoriza el resultado de cada RUT distinto.
+    Retorna (válidas, errores) con las válidas listas para insertar y los
+    errores como (línea, motivo).
+    """
+    errores_rut = validar_ruts_lote([_texto(f.get("rut_empresa")) for _, f in filas], cache_ruts)
+    validas, errores = [], []
+    for (linea, fila), error_rut in zip(filas, errores_rut):
+        numero_guia = _texto(fila.get("numero_guia"))
+        if not 1 <= len(numero_guia) <= 50:
+            errores.append((linea, "numero_guia vacío o de más de 50 caracteres"))
+            continue
+        if error_rut:
+            errores.append((linea, f"rut_empresa: {error_rut}"))
+            continue
+        rut_empresa = _texto(fila.get("rut_empresa"))
+        if len(rut_empresa) > 12:
+            errores.append((linea, "rut_empresa de más de 12 caracteres"))
+            continue
+        try:
+            fecha = _fecha(fila.get("fecha"))
+            latitud = _coordenada(fila.get("latitud"), RANGO_LATITUD, "latitud")
+            longitud = _coordenada(fila.get("longitud"), RANGO_LONGITUD, "longitud")
+        except ValueError as e:
+            errores.append((linea, str(e)))
+            continue
+        cuerpo, dv = partes_rut(rut_empresa)
+        validas.append({
+            "numero_guia": numero_guia,
+            "rut_empresa": rut_empresa,
+            "rut_empresa_cuerpo": cuerpo,
+            "rut_empresa_dv": dv,
+            "fecha": fecha,
+            "usuario_id": usuario_id,
+            "latitud": latitud,
+            "longitud": longitud,
+            "geohash": codificar_geohash(latitud, longitud),
+            "zona": zonas.zona_de(latitud, longitud),
+            "observacion": _texto(fila.get("observacion")) or None,
+        })
+    return validas, errores
+
+
+def _copiar(modelo, filas):
+    """COPY ... FROM STDIN en Postgres: una sola operación por lote."""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    for fila in filas:
+        escritor.writerow([
+            fila[c].isoformat(sep=" ") if isinstance(fila[c], datetime) else fila[c]
+            for c in COLUMNAS_COPY
+        ])
+    buffer.seek(0)
+    cursor = db.session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {modelo.__tablename__} ({', '.join(COLUMNAS_COPY)}) FROM STDIN WITH (FORMAT csv)",
+            buffer
+        )
+    finally:
+        cursor.close()
+
+
+def importar_guias(ruta, modelo, usuario_id, tamano_lote=5000, solo_validar=False):
+    """
+    Importa un CSV/XLSX de guías a `modelo` (Despacho o Recepcion) por lotes
+    de `tamano_lote` filas, confirmando cada lote. En Postgres se usa COPY y
+    en otros motores un executemany. Retorna (válidas, errores); con
+    solo_validar no se inserta nada y las válidas sólo se cuentan.
+    """
+    if not os.path.isfile(ruta):
+        raise FileNotFoundError(ruta)
+    usar_copy = db.engine.dialect.name == "postgresql"
+    cache_ruts = {}
+    total_validas = 0
+    errores = []
+    filas = leer_filas(ruta)
+    while True:
+        lote = list(islice(filas, tamano_lote))
+        if not lote:
+            break
+        validas, errores_lote = preparar_lote(lote, usuario_id, cache_ruts)
+        errores.extend(errores_lote)
+        if validas and not solo_validar:
+            if usar_copy:
+                _copiar(modelo, validas)
+            else:
+                db.session.execute(insert(modelo), validas)
+            db.session.commit()
+        total_validas += len(validas)
+    return total_validas, errores
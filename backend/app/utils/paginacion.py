@@ -0,0 +1,87 @@
+import base64
+import json
+from datetime import datetime
+from flask import request
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.orm import Query
+from app import db
+
+MODOS_TOTAL = ("exact", "approx", "none")
+
+
+def parametros_pagina(por_defecto=10):
+    """
+    (page, per_page) del query string, como mínimo 1: con cero o negativos
+    el LIMIT/OFFSET sería negativo y Postgres rechaza la consulta.
+    """
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = max(request.args.get('per_page', por_defecto, type=int), 1)
+    return page, per_page
+
+
+def codificar_cursor(fecha, id):
+    """Cursor opaco con la posición (fecha, id) del último elemento entregado."""
+    payload = json.dumps([fecha.isoformat(), id]).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+
+def decodificar_cursor(cursor):
+    """Devuelve (fecha, id) o None si el cursor no es válido."""
+    try:
+        relleno = "=" * (-len(cursor) % 4)
+        fecha, id = json.loads(base64.urlsafe_b64decode(cursor + relleno))
+        return datetime.fromisoformat(fecha), int(id)
+    except Exception:
+        return None
+
+
+def paginar_por_cursor(query, modelo, cursor, per_page):
+    """
+    Pagina por keyset sobre (fecha DESC, id DESC): en vez de OFFSET busca
+    directamente en el índice desde la posición del cursor, así cada página
+    cuesta lo mismo sin importar la profundidad.
+    Retorna (items, next_cursor); next_cursor es None en la última página.
+    ValueError si el cursor no es válido (reiniciar en la primera página
+    entregaría filas repetidas). Un cursor vacío es la primera página.
+    """
+    per_page = max(per_page, 1)
+    posicion = decodificar_cursor(cursor) if cursor else None
+    if cursor and posicion is None:
+        raise ValueError("Cursor inválido")
+    if posicion:
+        fecha, id = posicion
+        query = query.filter(or_(
+            modelo.fecha < fecha,
+            and_(modelo.fecha == fecha, modelo.id < id)
+        ))
+    items = query.order_by(modelo.fecha.desc(), modelo.id.desc()).limit(per_page + 1).all()
+    next_cursor = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        ultimo = items[-1]
+        next_cursor = codificar_cursor(ultimo.fecha, ultimo.id)
+    return items, next_cursor
+
+
+def contar(query, modo="exact"):
+    """
+    Total de filas según el modo pedido por el cliente:
+    'exact' hace COUNT, 'none' lo omite y 'approx' usa la estimación
+    del planificador de Postgres (COUNT exacto en otros motores).
+    Acepta un Query del ORM o un select() (p. ej. un union_all).
+    """
+    if modo == "none":
+        return None
+    sentencia = query.order_by(None)
+    if isinstance(sentencia, Query):
+        sentencia = sentencia.statement
+    if modo == "approx" and db.engine.dialect.name == "postgresql":
+        compilado = sentencia.compile(dialect=db.engine.dialect)
+        cursor = db.session.connection().connection.cursor()
+        try:
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {compilado}", compilado.params)
+            plan = cursor.fetchone()[0]
+        finally:
+            cursor.close()
+        return int(plan[0]["Plan"]["Plan Rows"])
+    return db.session.scalar(select(func.count()).select_from(sentencia.subquery()))
@@ -0,0 +1,65 @@
+import time
+from flask_jwt_extended import get_jwt, get_jwt_identity
+from app import db
+from app.models import Usuario
+from app.utils.revocacion import CacheLRU
+
+
+class CachePrincipales:
+    """
+    Datos de autorización de cada usuario (id, rut, nombre, tipo_usuario)
+    cacheados en el proceso por PRINCIPAL_CACHE_TTL segundos. Las rutas de
+    administración de usuarios llaman a invalidar() al editar; en los demás
+    workers el cambio se ve al vencer el TTL.
+    """
+
+    def __init__(self, app=None):
+        self.cache = CacheLRU(10000)
+        self.ttl = 60
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.cache = CacheLRU(app.config.get("PRINCIPAL_CACHE_SIZE", 10000))
+        self.ttl = app.config.get("PRINCIPAL_CACHE_TTL", 60)
+        app.extensions["principales"] = self
+
+    def obtener(self, usuario_id):
+        """Retorna el principal como dict, o None si el usuario no existe."""
+        usuario_id = int(usuario_id)
+        principal = self.cache.obtener(usuario_id)
+        if principal is None:
+            usuario = db.session.get(Usuario, usuario_id)
+            principal = {
+                "id": usuario.id,
+                "rut": usuario.rut,
+                "nombre": usuario.nombre,
+                "tipo_usuario": usuario.tipo_usuario,
+            } if usuario else False  # también se cachea que no existe
+            self.cache.guardar(usuario_id, principal, time.time() + self.ttl)
+        return principal or None
+
+    def invalidar(self, usuario_id):
+        self.cache.eliminar(int(usuario_id))
+
+
+principales = CachePrincipales()
+
+
+def claims_usuario(usuario):
+    """Claims adicionales del access token: permiten autorizar sin ir a la base."""
+    return {"tipo_usuario": usuario.tipo_usuario, "nombre": usuario.nombre}
+
+
+def es_admin():
+    """
+    Si el token dice que no es admin se rechaza sin más. Si dice que sí, se
+    confirma con el principal cacheado para que quitar el rol o eliminar al
+    usuario tenga efecto antes de que venza el token. Los tokens emitidos
+    antes de incluir el claim se resuelven sólo con el principal.
+    """
+    tipo = get_jwt().get("tipo_usuario")
+    if tipo is not None and tipo != "admin":
+        return False
+    principal = principales.obtener(get_jwt_identity())
+    return principal is not None and principal["tipo_usuario"] == "admin"
@@ -0,0 +1,192 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from flask import g, has_request_context, request
+from flask_jwt_extended import get_jwt_identity
+
+# Atributos propios de LogRecord; el resto viene de extra= o del contexto
+CAMPOS_LOGRECORD = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+class ContextoSolicitud(logging.Filter):
+    """
+    Copia al registro el usuario, IP, endpoint e ids de la solicitud en curso.
+    Corre en el hilo de la solicitud, que es el único que tiene ese contexto;
+    no pisa los campos que ya vengan en extra=.
+    """
+
+    def filter(self, record):
+        if not has_request_context():
+            return True
+        try:
+            usuario = get_jwt_identity()
+        except RuntimeError:
+            usuario = None  # la ruta no verificó el JWT
+        contexto = {
+            "usuario": usuario,
+            "ip": request.remote_addr,
+            "metodo": request.method,
+            "endpoint": request.endpoint,
+            "ids": request.view_args or None,
+        }
+        for campo, valor in contexto.items():
+            if not hasattr(record, campo):
+                setattr(record, campo, valor)
+        return True
+
+
+class ColaAcotada(QueueHandler):
+    """
+    QueueHandler sobre una cola de capacidad fija que nunca bloquea: si la
+    cola está llena el registro se descarta y se cuenta. Al volver a haber
+    espacio se encola un aviso con la cantidad perdida. Un QueueListener
+    vacía la cola hacia `destinos` en un hilo aparte.
+    """
+
+    def __init__(self, capacidad, *destinos):
+        super().__init__(queue.Queue(maxsize=capacidad))
+        self.destinos = destinos
+        self.descartados = 0
+        self._sin_avisar = 0
+        self._listener = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _iniciar(self):
+        # El listener se crea en el primer registro de cada proceso: los workers
+        # de gunicorn (--preload) se bifurcan después de create_app y no heredan
+        # el hilo, sólo una cola que nadie vaciaría.
+        if self._listener is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._listener is not None and self._pid == os.getpid():
+                return
+            if self._pid != os.getpid():
+                self.queue = queue.Queue(maxsize=self.queue.maxsize)
+            self._pid = os.getpid()
+            self._listener = QueueListener(self.queue, *self.destinos, respect_handler_level=True)
+            self._listener.start()
+            atexit.register(self.detener)
+
+    def detener(self):
+        """Escribe lo pendiente y detiene el listener de este proceso."""
+        with self._lock:
+            listener, self._listener = self._listener, None
+        if listener is not None and self._pid == os.getpid():
+            listener.stop()
+
+    def prepare(self, record):
+        # El mensaje se arma aquí, en el hilo que registra: los args pueden ser
+        # objetos del ORM o de la solicitud que no deben tocarse desde el
+        # listener. La excepción se convierte a texto para no retener los frames.
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        self._iniciar()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.descartados += 1
+                self._sin_avisar += 1
+            return
+        if self._sin_avisar:
+            self._avisar_descartados()
+
+    def _avisar_descartados(self):
+        with self._lock:
+            perdidos, self._sin_avisar = self._sin_avisar, 0
+        if not perdidos:
+            return
+        aviso = logging.makeLogRecord({
+            "name": __name__,
+            "levelno": logging.WARNING,
+            "levelname": "WARNING",
+            "msg": "%d registros de log descartados por cola llena (total %d)",
+            "args": (perdidos, self.descartados),
+            "descartados": perdidos,
+        })
+        try:
+            self.queue.put_nowait(aviso)
+        except queue.Full:
+            with self._lock:
+                self._sin_avisar += perdidos
+
+
+class FormatoJSON(logging.Formatter):
+    """Una línea JSON por registro, con los campos estructurados como claves."""
+
+    def format(self, record):
+        datos = {
+            "fecha": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "nivel": record.levelname,
+            "logger": record.name,
+            "modulo": record.module,
+            "mensaje": record.getMessage(),
+        }
+        for campo, valor in record.__dict__.items():
+            if campo not in CAMPOS_LOGRECORD and valor is not None:
+                datos[campo] = valor
+        if record.exc_text:
+            datos["excepcion"] = record.exc_text
+        return json.dumps(datos, ensure_ascii=False, default=str)
+
+
+def configurar_logging(app):
+    """
+    Conecta el logger raíz a una ColaAcotada; su QueueListener, en un hilo
+    aparte de cada proceso, formatea los registros como JSON y los escribe en
+    el archivo rotativo, así la solicitud nunca espera por el disco. También
+    registra una línea de acceso por solicitud con su latencia.
+    """
+    logs_dir = app.config["LOG_DIR"]
+    os.makedirs(logs_dir, exist_ok=True)
+    archivo = RotatingFileHandler(
+        os.path.join(logs_dir, "app_auditoria.log"),
+        maxBytes=app.config["LOG_MAX_BYTES"],
+        backupCount=app.config["LOG_BACKUP_COUNT"],
+        encoding="utf-8",
+    )
+    archivo.setFormatter(FormatoJSON())
+
+    cola = ColaAcotada(app.config["LOG_QUEUE_SIZE"], archivo)
+    cola.setLevel(logging.INFO)
+    cola.addFilter(ContextoSolicitud())
+
+    raiz = logging.getLogger()
+    # create_app llamado de nuevo en el mismo proceso (tests, CLI)
+    for handler in [h for h in raiz.handlers if isinstance(h, ColaAcotada)]:
+        handler.detener()
+        raiz.removeHandler(handler)
+
+    raiz.setLevel(logging.INFO)
+    raiz.addHandler(cola)
+    app.extensions["registro"] = cola
+
+    acceso = logging.getLogger("app.acceso")
+
+    @app.before_request
+    def _marcar_inicio():
+        g.inicio_solicitud = time.perf_counter()
+
+    @app.after_request
+    def _registrar_acceso(respuesta):
+        inicio = g.pop("inicio_solicitud", None)
+        if inicio is not None:
+            acceso.info(
+                "%s %s %s", request.method, request.path, respuesta.status_code,
+                extra={"estado": respuesta.status_code,
+                       "latencia_ms": round((time.perf_counter() - inicio) * 1000, 1)},
+            )
+        return respuesta
@@ -0,0 +1,253 @@
+import base64
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import subprocess
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from flask import render_template
+from PIL import Image, ImageOps
+
+# Subir al cambiar las plantillas: invalida todos los PDF en caché
+VERSION_PLANTILLAS = 1
+LADO_MINIATURA = 320
+RE_TRABAJO = re.compile(r"^[0-9a-f]{64}$")
+
+
+class GeneradorReportes:
+    """
+    Renderiza reportes PDF (pdfkit/wkhtmltopdf) en un pool de hilos del
+    proceso; wkhtmltopdf corre como subproceso, así que los hilos sólo esperan.
+
+    El id del trabajo es el SHA-256 de los datos del reporte, así el mismo
+    contenido nunca se renderiza dos veces y cualquier cambio (campos,
+    fotos) produce otro id. El estado vive en REPORTES_DIR y no en memoria,
+    para que cualquier worker pueda responder la consulta:
+    <id>.pdf listo, <id>.pendiente en curso, <id>.error fallido, y
+    <id>.usuarios con los usuarios que lo pidieron (los únicos, además de
+    los admin, que pueden consultarlo o descargarlo).
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.carpeta = None
+        self.workers = 2
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.carpeta = app.config["REPORTES_DIR"]
+        self.workers = app.config.get("REPORTES_WORKERS", 2)
+        self.timeout = app.config.get("REPORTES_TIMEOUT", 300)
+        self.wkhtmltopdf = app.config.get("WKHTMLTOPDF_PATH")
+        self._executor = None
+        app.extensions["reportes"] = self
+
+    def _get_executor(self):
+        # Uno por proceso: los workers se bifurcan después de create_app
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="reportes")
+                self._pid = os.getpid()
+            return self._executor
+
+    def _ruta(self, trabajo_id, extension):
+        return os.path.join(self.carpeta, f"{trabajo_id}.{extension}")
+
+    def ruta_pdf(self, trabajo_id):
+        return self._ruta(trabajo_id, "pdf")
+
+    def autorizado(self, trabajo_id, usuario_id):
+        """True si usuario_id solicitó el trabajo (el id se puede deducir de datos conocidos)."""
+        if not RE_TRABAJO.match(trabajo_id or ""):
+            return False
+        try:
+            with open(self._ruta(trabajo_id, "usuarios"), encoding="utf-8") as archivo:
+                return str(usuario_id) in archivo.read().split()
+        except FileNotFoundError:
+            return False
+
+    def _agregar_usuario(self, trabajo_id, usuario_id):
+        if self.autorizado(trabajo_id, usuario_id):
+            # Marca la última solicitud, para purgar()
+            os.utime(self._ruta(trabajo_id, "usuarios"))
+            return
+        # Una línea por escritura en modo append: seguro entre workers
+        with open(self._ruta(trabajo_id, "usuarios"), "a", encoding="utf-8") as archivo:
+            archivo.write(f"{usuario_id}\n")
+
+    def estado(self, trabajo_id):
+        """(estado, error): listo, pendiente, error o (None, None) si el id no existe."""
+        if not RE_TRABAJO.match(trabajo_id or ""):
+            return None, None
+        if os.path.exists(self._ruta(trabajo_id, "pdf")):
+            return "listo", None
+        try:
+            with open(self._ruta(trabajo_id, "error"), encoding="utf-8") as archivo:
+                return "error", archivo.read()
+        except FileNotFoundError:
+            pass
+        try:
+            inicio = os.path.getmtime(self._ruta(trabajo_id, "pendiente"))
+        except FileNotFoundError:
+            return None, None
+        # wkhtmltopdf se corta a los REPORTES_TIMEOUT segundos; con el doble,
+        # el proceso que lo renderizaba murió
+        if time.time() - inicio > 2 * self.timeout:
+            return "error", "Tiempo agotado"
+        return "pendiente", None
+
+    def solicitar(self, plantilla, datos, usuario_id):
+        """
+        Encola el reporte si no está listo ni en curso; los fallidos o
+        vencidos se reintentan. usuario_id queda autorizado a consultarlo.
+        Retorna (trabajo_id, estado).
+        """
+        contenido = json.dumps([VERSION_PLANTILLAS, plantilla, datos], sort_keys=True, default=str)
+        trabajo_id = hashlib.sha256(contenido.encode()).hexdigest()
+        os.makedirs(self.carpeta, exist_ok=True)
+        self._agregar_usuario(trabajo_id, usuario_id)
+        estado, _ = self.estado(trabajo_id)
+        if estado in ("listo", "pendiente"):
+            return trabajo_id, estado
+
+        for extension in ("error", "pendiente"):
+            try:
+                os.remove(self._ruta(trabajo_id, extension))
+            except FileNotFoundError:
+                pass
+        # La marca identifica este intento: un render anterior vencido no borra su .pendiente
+        marca = uuid.uuid4().hex
+        try:
+            # O_EXCL: si otro worker lo encoló al mismo tiempo, no se duplica
+            fd = os.open(self._ruta(trabajo_id, "pendiente"), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return trabajo_id, "pendiente"
+        with os.fdopen(fd, "w") as archivo:
+            archivo.write(marca)
+        self._get_executor().submit(self._renderizar, trabajo_id, plantilla, datos, marca)
+        return trabajo_id, "pendiente"
+
+    def _wkhtmltopdf(self, html):
+        """PDF de html con wkhtmltopdf; a diferencia de pdfkit.from_string, con timeout."""
+        import pdfkit
+
+        configuracion = pdfkit.configuration(wkhtmltopdf=self.wkhtmltopdf) if self.wkhtmltopdf else None
+        kit = pdfkit.PDFKit(html, "string", options={"encoding": "UTF-8"}, configuration=configuracion)
+        # subprocess.run mata el proceso si vence el timeout
+        proceso = subprocess.run(kit.command(), input=html.encode("utf-8"), capture_output=True,
+                                 timeout=self.timeout, env=kit.environ)
+        kit.handle_error(proceso.returncode, proceso.stderr.decode("utf-8", errors="replace"))
+        return proceso.stdout
+
+    def _renderizar(self, trabajo_id, plantilla, datos, marca):
+        pendiente = self._ruta(trabajo_id, "pendiente")
+        try:
+
+            with self.app.app_context():
+                carpeta_fotos = self.app.config["UPLOAD_FOLDER"]
+                for movimiento in datos.get("movimientos", []):
+                    for foto in movimiento.get("fotos", []):
+                        foto["imagen"] = miniatura_data_uri(carpeta_fotos, foto.get("ruta_thumb") or foto["ruta_archivo"])
+                html = render_template(plantilla, **datos)
+            pdf = self._wkhtmltopdf(html)
+            temporal = self._ruta(trabajo_id, "pdf.tmp")
+            with open(temporal, "wb") as archivo:
+                archivo.write(pdf)
+            os.replace(temporal, self._ruta(trabajo_id, "pdf"))
+        except Exception as e:
+            logging.error("Error generando reporte %s (%s): %s", trabajo_id, plantilla, e)
+            with open(self._ruta(trabajo_id, "error"), "w", encoding="utf-8") as archivo:
+                archivo.write(str(e)[:500])
+        finally:
+            try:
+                with open(pendiente, encoding="utf-8") as archivo:
+                    propio = archivo.read() == marca
+                if propio:
+                    os.remove(pendiente)
+            except FileNotFoundError:
+                pass
+
+    def purgar(self, dias):
+        """
+        Borra los trabajos (todos sus archivos) sin actividad en los últimos
+        `dias` días; cada solicitud renueva la fecha del trabajo. Retorna
+        cuántos trabajos se borraron.
+        """
+        if not os.path.isdir(self.carpeta):
+            return 0
+        limite = time.time() - dias * 86400
+        trabajos = {}
+        for nombre in os.listdir(self.carpeta):
+            trabajos.setdefault(nombre.split(".", 1)[0], []).append(os.path.join(self.carpeta, nombre))
+        borrados = 0
+        for rutas in trabajos.values():
+            try:
+                if max(os.path.getmtime(ruta) for ruta in rutas) >= limite:
+                    continue
+            except FileNotFoundError:
+                continue
+            for ruta in rutas:
+                try:
+                    os.remove(ruta)
+                except FileNotFoundError:
+                    pass
+            borrados += 1
+        return borrados
+
+
+def miniatura_data_uri(carpeta, ruta):
+    """
+    Miniatura JPEG embebida como data URI: wkhtmltopdf no lee WebP (formato
+    de las variantes) y así el PDF no depende de rutas locales.
+    """
+    try:
+        with Image.open(os.path.join(carpeta, ruta)) as img:
+            img.draft("RGB", (LADO_MINIATURA, LADO_MINIATURA))
+            img = ImageOps.exif_transpose(img).convert("RGB")
+            img.thumbnail((LADO_MINIATURA, LADO_MINIATURA))
+            buffer = io.BytesIO()
+            img.save(buffer, "JPEG", quality=75)
+    except OSError as e:
+        logging.warning("Foto %s no disponible para el reporte: %s", ruta, e)
+        return None
+    return "data:image/jpeg;base64," + base64.b64encode(buffer.getvalue()).decode()
+
+
+def campos_movimiento(movimiento, tipo):
+    """Campos del movimiento, sin fotos (no toca la relación lazy), en el formato de las plantillas."""
+    return {
+        "id": movimiento.id,
+        "tipo": tipo,
+        "numero_guia": movimiento.numero_guia,
+        "rut_empresa": movimiento.rut_empresa,
+        "fecha": movimiento.fecha.isoformat() if movimiento.fecha else None,
+        "usuario_id": movimiento.usuario_id,
+        "latitud": movimiento.latitud,
+        "longitud": movimiento.longitud,
+        "zona": movimiento.zona,
+        "observacion": movimiento.observacion,
+    }
+
+
+def datos_movimiento(movimiento, tipo):
+    """Campos del movimiento y sus fotos; cargar las fotos con selectinload."""
+    return {
+        **campos_movimiento(movimiento, tipo),
+        "fotos": [
+            {"id": f.id, "tipo": f.tipo, "ruta_archivo": f.ruta_archivo, "ruta_thumb": f.ruta_thumb}
+            for f in sorted(movimiento.fotos, key=lambda f: f.id)
+        ],
+    }
+
+
+reportes = GeneradorReportes()
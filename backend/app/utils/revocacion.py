@@ -0,0 +1,134 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import TokenRevocado
+
+
+class CacheLRU:
+    """Caché en memoria del proceso con tamaño máximo y expiración por entrada."""
+
+    def __init__(self, max_entradas):
+        self.max_entradas = max_entradas
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, clave):
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None:
+                return None
+            valor, vence = entrada
+            if vence <= time.time():
+                del self._datos[clave]
+                return None
+            self._datos.move_to_end(clave)
+            return valor
+
+    def guardar(self, clave, valor, vence):
+        with self._lock:
+            self._datos[clave] = (valor, vence)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+
+    def eliminar(self, clave):
+        with self._lock:
+            self._datos.pop(clave, None)
+
+    def limpiar(self):
+        with self._lock:
+            self._datos.clear()
+
+
+class BackendDB:
+    """Tokens revocados en la tabla token_revocado (SQLite o Postgres)."""
+
+    def revocar(self, jti, exp):
+        try:
+            with db.session.begin_nested():
+                db.session.add(TokenRevocado(jti=jti, expira=datetime.utcfromtimestamp(exp)))
+        except IntegrityError:
+            pass  # ya estaba revocado
+        db.session.commit()
+
+    def esta_revocado(self, jti):
+        token = db.session.get(TokenRevocado, jti)
+        return token is not None and token.expira > datetime.utcnow()
+
+    def purgar_expirados(self):
+        eliminados = TokenRevocado.query.filter(TokenRevocado.expira <= datetime.utcnow()).delete()
+        db.session.commit()
+        return eliminados
+
+
+class BackendRedis:
+    """Tokens revocados como claves de Redis que expiran junto con el token."""
+
+    def __init__(self, url, prefijo="jwt_revocado:"):
+        import redis
+
+        self.cliente = redis.Redis.from_url(url)
+        self.prefijo = prefijo
+
+    def revocar(self, jti, exp):
+        ttl = max(int(exp - time.time()), 1)
+        self.cliente.set(self.prefijo + jti, 1, ex=ttl)
+
+    def esta_revocado(self, jti):
+        return bool(self.cliente.exists(self.prefijo + jti))
+
+    def purgar_expirados(self):
+        return 0  # Redis elimina las claves al vencer su TTL
+
+
+class RevocacionTokens:
+    """
+    Registro de tokens revocados compartido por todos los workers y nodos.
+    Delante del backend hay una caché LRU del proceso: un token revocado se
+    recuerda hasta su exp (una revocación no se deshace), y un token válido
+    sólo durante TOKEN_REVOCATION_CACHE_TTL segundos, que es el máximo tiempo
+    que otro worker puede tardar en ver un logout.
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.cache = None
+        self.ttl_validos = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        tipo = app.config.get("TOKEN_REVOCATION_BACKEND", "db")
+        if tipo == "redis":
+            self.backend = BackendRedis(app.config["REDIS_URL"])
+        elif tipo == "db":
+            self.backend = BackendDB()
+        else:
+            raise ValueError(f"TOKEN_REVOCATION_BACKEND desconocido: {tipo}")
+        self.cache = CacheLRU(app.config.get("TOKEN_REVOCATION_CACHE_SIZE", 10000))
+        self.ttl_validos = app.config.get("TOKEN_REVOCATION_CACHE_TTL", 5)
+        app.extensions["revocacion_tokens"] = self
+
+    def revocar(self, jti, exp):
+        self.backend.revocar(jti, exp)
+        self.cache.guardar(jti, True, exp)
+
+    def esta_revocado(self, jti, exp):
+        en_cache = self.cache.obtener(jti)
+        if en_cache is not None:
+            return en_cache
+        revocado = self.backend.esta_revocado(jti)
+        if revocado:
+            self.cache.guardar(jti, True, exp)
+        elif self.ttl_validos > 0:
+            self.cache.guardar(jti, False, min(time.time() + self.ttl_validos, exp))
+        return revocado
+
+    def purgar_expirados(self):
+        return self.backend.purgar_expirados()
+
+
+revocacion = RevocacionTokens()
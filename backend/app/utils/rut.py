@@ -0,0 +1,62 @@
+import re
+from sqlalchemy import false
+
+RE_SEPARADORES = re.compile(r"[.\-\s]")
+MAX_CUERPO = 2**31 - 1
+
+
+def calcular_dv(cuerpo):
+    """Dígito verificador del RUT (módulo 11, múltiplos de 2 a 7)."""
+    suma = 0
+    multiplo = 2
+    for c in reversed(str(cuerpo)):
+        suma += int(c) * multiplo
+        multiplo = 2 if multiplo == 7 else multiplo + 1
+    resto = 11 - suma % 11
+    return "K" if resto == 10 else "0" if resto == 11 else str(resto)
+
+
+def partes_rut(rut):
+    """
+    Separa un RUT escrito de cualquier forma ('21.001.625-2', '210016252',
+    '21001625-2') en (cuerpo entero, dígito verificador). Retorna (None, None)
+    si no tiene forma de RUT; no valida el dígito verificador.
+    """
+    if not isinstance(rut, str):
+        return None, None
+    limpio = RE_SEPARADORES.sub("", rut).upper()
+    if len(limpio) < 2 or not limpio[:-1].isdigit() or not (limpio[-1].isdigit() or limpio[-1] == "K"):
+        return None, None
+    return int(limpio[:-1]), limpio[-1]
+
+
+def cuerpos_busqueda(texto):
+    """
+    Cuerpos de RUT candidatos para filtrar. Con guion o DV 'K' la última
+    posición es el DV. Sólo dígitos (con o sin puntos) es ambiguo: '10001994'
+    puede ser el cuerpo completo o el cuerpo 1000199 con DV 4; se toma como
+    cuerpo y, si el último dígito es un DV válido, también la otra lectura.
+    [] si no se puede interpretar como RUT.
+    """
+    if not isinstance(texto, str):
+        return []
+    limpio = RE_SEPARADORES.sub("", texto).upper()
+    if "-" in texto or limpio.endswith("K"):
+        cuerpo, _ = partes_rut(texto)
+        candidatos = [cuerpo] if cuerpo is not None else []
+    elif limpio.isdigit():
+        candidatos = [int(limpio)]
+        if len(limpio) >= 2 and calcular_dv(limpio[:-1]) == limpio[-1]:
+            candidatos.append(int(limpio[:-1]))
+    else:
+        candidatos = []
+    # Las columnas son INTEGER: un número mayor no es un RUT y fallaría en Postgres
+    return [c for c in candidatos if c <= MAX_CUERPO]
+
+
+def filtro_rut(columna_cuerpo, texto):
+    """Condición exacta (búsqueda en índice) sobre la columna del cuerpo normalizado."""
+    cuerpos = cuerpos_busqueda(texto)
+    if not cuerpos:
+        return false()
+    return columna_cuerpo == cuerpos[0] if len(cuerpos) == 1 else columna_cuerpo.in_(cuerpos)
@@ -0,0 +1,102 @@
+import logging
+import zipfile
+from flask import Response, current_app, request, stream_with_context
+
+TAMANO_LOTE = 500
+TAMANO_BLOQUE_ZIP = 64 * 1024
+
+
+def formato_solicitado():
+    """'ndjson' si el cliente lo pide por ?formato= o Accept, si no 'json'."""
+    if request.args.get("formato") == "ndjson":
+        return "ndjson"
+    if request.accept_mimetypes.best == "application/x-ndjson":
+        return "ndjson"
+    return "json"
+
+
+def respuesta_streaming(query, serializar, al_terminar=None, formato=None):
+    """
+    Envía el resultado de la query a medida que se lee de la base, sin
+    materializar la tabla completa. Usa un cursor del lado del servidor
+    (stream_results + yield_per) y escribe un arreglo JSON incremental o
+    NDJSON (una fila por línea). al_terminar recibe la cantidad enviada.
+    """
+    formato = formato or formato_solicitado()
+    dumps = current_app.json.dumps
+
+    def generar():
+        filas = query.execution_options(stream_results=True).yield_per(TAMANO_LOTE)
+        total = 0
+        if formato == "ndjson":
+            for fila in filas:
+                yield dumps(serializar(fila)) + "\n"
+                total += 1
+        else:
+            yield "["
+            for fila in filas:
+                yield ("," if total else "") + dumps(serializar(fila))
+                total += 1
+            yield "]\n"
+        if al_terminar:
+            al_terminar(total)
+
+    mimetype = "application/x-ndjson" if formato == "ndjson" else "application/json"
+    return Response(stream_with_context(generar()), mimetype=mimetype)
+
+
+class _SalidaZip:
+    """Destino sin seek para ZipFile: guarda lo escrito hasta que el generador lo envía."""
+
+    def __init__(self):
+        self.partes = []
+
+    def write(self, datos):
+        self.partes.append(bytes(datos))
+        return len(datos)
+
+    def flush(self):
+        pass
+
+    def vaciar(self):
+        datos = b"".join(self.partes)
+        self.partes.clear()
+        return datos
+
+
+def respuesta_zip(entradas, nombre_descarga, al_terminar=None):
+    """
+    Envía un ZIP armado al vuelo desde entradas (ruta en disco, nombre en
+    el ZIP), leyendo cada archivo por bloques: ni el ZIP ni los archivos
+    quedan completos en memoria o en disco. Las entradas van sin compresión
+    (ZIP_STORED) y, como la salida no admite seek, con CRC y tamaños en el
+    descriptor tras los datos. Los archivos que faltan se omiten con un
+    aviso. al_terminar recibe la cantidad de archivos enviados.
+    """
+    def generar():
+        salida = _SalidaZip()
+        total = 0
+        with zipfile.ZipFile(salida, "w", zipfile.ZIP_STORED) as archivo_zip:
+            for ruta, nombre in entradas:
+                try:
+                    info = zipfile.ZipInfo.from_file(ruta, nombre)
+                    origen = open(ruta, "rb")
+                except OSError as e:
+                    logging.warning("Archivo %s omitido del ZIP %s: %s", ruta, nombre_descarga, e)
+                    continue
+                info.compress_type = zipfile.ZIP_STORED
+                with origen, archivo_zip.open(info, "w") as destino:
+                    for bloque in iter(lambda: origen.read(TAMANO_BLOQUE_ZIP), b""):
+                        destino.write(bloque)
+                        yield salida.vaciar()
+                total += 1
+        # Descriptor de la última entrada y directorio central
+        yield salida.vaciar()
+        if al_terminar:
+            al_terminar(total)
+
+    return Response(
+        stream_with_context(generar()),
+        mimetype="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{nombre_descarga}"'},
+    )
@@ -0,0 +1,133 @@
+import json
+import logging
+import math
+import threading
+
+
+def _anillo_contiene(anillo, longitud, latitud):
+    """Ray casting sobre un anillo GeoJSON ([lon, lat], ...)."""
+    dentro = False
+    j = len(anillo) - 1
+    for i in range(len(anillo)):
+        xi, yi = anillo[i][0], anillo[i][1]
+        xj, yj = anillo[j][0], anillo[j][1]
+        if (yi > latitud) != (yj > latitud) and longitud < (xj - xi) * (latitud - yi) / (yj - yi) + xi:
+            dentro = not dentro
+        j = i
+    return dentro
+
+
+class Poligono:
+    """Polígono GeoJSON (anillo exterior y agujeros) con su caja (oeste, sur, este, norte)."""
+
+    __slots__ = ("nombre", "anillos", "caja")
+
+    def __init__(self, nombre, anillos):
+        self.nombre = nombre
+        self.anillos = anillos
+        longitudes = [p[0] for p in anillos[0]]
+        latitudes = [p[1] for p in anillos[0]]
+        self.caja = (min(longitudes), min(latitudes), max(longitudes), max(latitudes))
+
+    def contiene(self, latitud, longitud):
+        oeste, sur, este, norte = self.caja
+        if not (oeste <= longitud <= este and sur <= latitud <= norte):
+            return False
+        if not _anillo_contiene(self.anillos[0], longitud, latitud):
+            return False
+        return not any(_anillo_contiene(agujero, longitud, latitud) for agujero in self.anillos[1:])
+
+
+def cargar_geojson(ruta, propiedad):
+    """
+    Polígonos de un FeatureCollection (Polygon o MultiPolygon). El nombre
+    de cada zona es feature.properties[propiedad]; se ignoran las features
+    sin nombre o de otro tipo de geometría.
+    """
+    with open(ruta, encoding="utf-8") as archivo:
+        datos = json.load(archivo)
+    poligonos = []
+    for feature in datos.get("features", []):
+        nombre = (feature.get("properties") or {}).get(propiedad)
+        geometria = feature.get("geometry") or {}
+        if not nombre:
+            continue
+        if geometria.get("type") == "Polygon":
+            partes = [geometria["coordinates"]]
+        elif geometria.get("type") == "MultiPolygon":
+            partes = geometria["coordinates"]
+        else:
+            continue
+        poligonos.extend(Poligono(str(nombre)[:100], anillos) for anillos in partes if anillos)
+    return poligonos
+
+
+class IndiceZonas:
+    """
+    Índice de grilla para punto-en-polígono: cada celda de `celda` grados
+    guarda los polígonos cuya caja la toca, así una consulta revisa sólo los
+    pocos candidatos de su celda en vez de todas las zonas.
+    """
+
+    def __init__(self, poligonos, celda=0.05):
+        self.celda = celda
+        self.celdas = {}
+        for poligono in poligonos:
+            oeste, sur, este, norte = poligono.caja
+            for x in range(self._indice(oeste), self._indice(este) + 1):
+                for y in range(self._indice(sur), self._indice(norte) + 1):
+                    self.celdas.setdefault((x, y), []).append(poligono)
+
+    def _indice(self, grados):
+        return math.floor(grados / self.celda)
+
+    def buscar(self, latitud, longitud):
+        for poligono in self.celdas.get((self._indice(longitud), self._indice(latitud)), ()):
+            if poligono.contiene(latitud, longitud):
+                return poligono.nombre
+        return None
+
+
+class Zonas:
+    """
+    Asigna a cada coordenada el nombre de la zona (comuna, sitio) que la
+    contiene, a partir del GeoJSON local de ZONAS_GEOJSON, sin servicios
+    externos. El índice se construye una vez por proceso, en la primera
+    consulta. Sin ZONAS_GEOJSON zona_de() retorna siempre None.
+    """
+
+    def __init__(self, app=None):
+        self.ruta = None
+        self._indice = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.ruta = app.config.get("ZONAS_GEOJSON")
+        self.propiedad = app.config.get("ZONAS_PROPIEDAD", "nombre")
+        self.celda = app.config.get("ZONAS_CELDA_GRADOS", 0.05)
+        self._indice = None
+        app.extensions["zonas"] = self
+
+    @property
+    def activas(self):
+        return bool(self.ruta)
+
+    def indice(self):
+        if self._indice is None:
+            with self._lock:
+                if self._indice is None:
+                    poligonos = cargar_geojson(self.ruta, self.propiedad)
+                    self._indice = IndiceZonas(poligonos, self.celda)
+                    logging.info("Índice de zonas cargado desde %s: %s polígonos, %s celdas",
+                                 self.ruta, len(poligonos), len(self._indice.celdas))
+        return self._indice
+
+    def zona_de(self, latitud, longitud):
+        if not self.ruta or latitud is None or longitud is None:
+            return None
+        return self.indice().buscar(latitud, longitud)
+
+
+zonas = Zonas()
@@ -9,3 +9,51 @@ class Config:
     JWT_SECRET_KEY = os.environ.get("JWT_SECRET_KEY", "jwtsecret")
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(days=365)
     UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), 'app', 'uploads')
+    IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", 2))
+    # Entrega de fotos por el proxy: None, "x-accel" (nginx) o "x-sendfile" (Apache/lighttpd)
+    PHOTO_OFFLOAD = os.environ.get("PHOTO_OFFLOAD") or None
+    X_ACCEL_PREFIX = os.environ.get("X_ACCEL_PREFIX", "/protected-uploads/")
+    USE_X_SENDFILE = PHOTO_OFFLOAD == "x-sendfile"
+    # Revocación de JWT compartida: "db" (tabla token_revocado) o "redis"
+    TOKEN_REVOCATION_BACKEND = os.environ.get("TOKEN_REVOCATION_BACKEND", "db")
+    TOKEN_REVOCATION_CACHE_TTL = int(os.environ.get("TOKEN_REVOCATION_CACHE_TTL", 5))
+    REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+    # Rate limiting compartido entre workers: "memory://" sólo para desarrollo y tests
+    RATELIMIT_STORAGE_URI = os.environ.get("RATELIMIT_STORAGE_URI", "memory://")
+    RATELIMIT_STRATEGY = "moving-window"
+    RATELIMIT_DEFAULT = "1000 per day"
+    RATELIMIT_HEADERS_ENABLED = True
+    # Login: además del límite por RUT, uno por IP (holgado por el NAT compartido de bodega)
+    LOGIN_LIMITE_IP = os.environ.get("LOGIN_LIMITE_IP", "30 per minute")
+    # Logs de auditoría: cola en memoria (los registros que no caben se descartan y se cuentan)
+    LOG_DIR = os.environ.get("LOG_DIR", os.path.join(os.path.dirname(__file__), 'logs'))
+    LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", 10000))
+    LOG_MAX_BYTES = 2 * 1024 * 1024
+    LOG_BACKUP_COUNT = 5
+    # Tabla audit_event: se inserta cada AUDIT_BATCH_SIZE eventos o cada AUDIT_FLUSH_MS ms
+    AUDIT_BATCH_SIZE = int(os.environ.get("AUDIT_BATCH_SIZE", 50))
+    AUDIT_FLUSH_MS = int(os.environ.get("AUDIT_FLUSH_MS", 500))
+    AUDIT_QUEUE_SIZE = int(os.environ.get("AUDIT_QUEUE_SIZE", 10000))
+    # Caché por proceso de rol/nombre de usuario; un cambio de rol tarda a lo más esto en otros workers
+    PRINCIPAL_CACHE_TTL = int(os.environ.get("PRINCIPAL_CACHE_TTL", 60))
+    # Hash de contraseñas (formato de werkzeug): "scrypt:32768:8:1", "pbkdf2:sha256:600000", ...
+    # Al cambiarlo, cada usuario se rehashea en su próximo login exitoso
+    PASSWORD_HASH_METHOD = os.environ.get("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+    PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", 2))
+    PASSWORD_HASH_MAX_PENDING = int(os.environ.get("PASSWORD_HASH_MAX_PENDING", 16))
+    # Caché de páginas del historial con ETag: "redis" si hay varios workers (obligatorio),
+    # "memory" sólo con un worker, "none" (por defecto) la desactiva
+    HISTORIAL_CACHE_BACKEND = os.environ.get("HISTORIAL_CACHE_BACKEND", "none")
+    HISTORIAL_CACHE_TTL = int(os.environ.get("HISTORIAL_CACHE_TTL", 300))
+    HISTORIAL_CACHE_SIZE = int(os.environ.get("HISTORIAL_CACHE_SIZE", 5000))
+    # Zonas (comunas/sitios) para etiquetar movimientos: GeoJSON local, nombre en properties[ZONAS_PROPIEDAD]
+    ZONAS_GEOJSON = os.environ.get("ZONAS_GEOJSON")
+    ZONAS_PROPIEDAD = os.environ.get("ZONAS_PROPIEDAD", "nombre")
+    ZONAS_CELDA_GRADOS = float(os.environ.get("ZONAS_CELDA_GRADOS", 0.05))
+    # Reportes PDF: caché y estado de los trabajos en disco (compartido entre workers)
+    REPORTES_DIR = os.environ.get("REPORTES_DIR", os.path.join(os.path.dirname(__file__), 'reportes'))
+    REPORTES_WORKERS = int(os.environ.get("REPORTES_WORKERS", 2))
+    # Segundos máximos de wkhtmltopdf por reporte y días sin uso antes de `flask purgar-reportes`
+    REPORTES_TIMEOUT = int(os.environ.get("REPORTES_TIMEOUT", 300))
+    REPORTES_RETENCION_DIAS = int(os.environ.get("REPORTES_RETENCION_DIAS", 30))
+    WKHTMLTOPDF_PATH = os.environ.get("WKHTMLTOPDF_PATH")  # si no está en el PATH
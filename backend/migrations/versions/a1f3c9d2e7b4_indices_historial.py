@@ -0,0 +1,66 @@
+"""indices historial
+
+Revision ID: a1f3c9d2e7b4
+Revises: 534549846e07
+Create Date: 2025-08-06 10:12:44.318502
+
+Los índices se crean con CREATE INDEX CONCURRENTLY para poder aplicar la
+migración sobre la base en producción sin bloquear escrituras. CONCURRENTLY
+no puede ejecutarse dentro de una transacción, por eso todo va dentro de
+autocommit_block().
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a1f3c9d2e7b4'
+down_revision = '534549846e07'
+branch_labels = None
+depends_on = None
+
+
+INDICES_BTREE = [
+    ('ix_despacho_usuario_fecha', 'despacho', ['usuario_id', sa.text('fecha DESC')]),
+    ('ix_despacho_rut_guia', 'despacho', ['rut_empresa', 'numero_guia']),
+    ('ix_foto_despacho_despacho_id', 'foto_despacho', ['despacho_id']),
+    ('ix_recepcion_usuario_fecha', 'recepcion', ['usuario_id', sa.text('fecha DESC')]),
+    ('ix_recepcion_rut_guia', 'recepcion', ['rut_empresa', 'numero_guia']),
+    ('ix_foto_recepcion_recepcion_id', 'foto_recepcion', ['recepcion_id']),
+]
+
+# Índices trigram para los filtros ilike '%...%' del historial
+INDICES_TRGM = [
+    ('ix_despacho_rut_empresa_trgm', 'despacho', 'rut_empresa'),
+    ('ix_despacho_numero_guia_trgm', 'despacho', 'numero_guia'),
+    ('ix_recepcion_rut_empresa_trgm', 'recepcion', 'rut_empresa'),
+    ('ix_recepcion_numero_guia_trgm', 'recepcion', 'numero_guia'),
+]
+
+
+def upgrade():
+    es_postgres = op.get_bind().dialect.name == 'postgresql'
+
+    with op.get_context().autocommit_block():
+        for nombre, tabla, columnas in INDICES_BTREE:
+            op.create_index(nombre, tabla, columnas, if_not_exists=True,
+                            postgresql_concurrently=True)
+
+        if es_postgres:
+            op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            for nombre, tabla, columna in INDICES_TRGM:
+                op.create_index(nombre, tabla, [columna], if_not_exists=True,
+                                postgresql_using='gin',
+                                postgresql_ops={columna: 'gin_trgm_ops'},
+                                postgresql_concurrently=True)
+        else:
+            for nombre, tabla, columna in INDICES_TRGM:
+                op.create_index(nombre, tabla, [columna], if_not_exists=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for nombre, tabla, _ in reversed(INDICES_TRGM + INDICES_BTREE):
+            op.drop_index(nombre, table_name=tabla, if_exists=True,
+                          postgresql_concurrently=True)
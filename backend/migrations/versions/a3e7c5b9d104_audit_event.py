@@ -0,0 +1,46 @@
+"""audit event
+
+Revision ID: a3e7c5b9d104
+Revises: f2d8b5e1c370
+Create Date: 2025-08-18 09:12:40.318527
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3e7c5b9d104'
+down_revision = 'f2d8b5e1c370'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('audit_event',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('fecha', sa.DateTime(), nullable=False),
+    sa.Column('usuario_id', sa.Integer(), nullable=True),
+    sa.Column('accion', sa.String(length=20), nullable=False),
+    sa.Column('entidad', sa.String(length=30), nullable=False),
+    sa.Column('entidad_id', sa.Integer(), nullable=True),
+    sa.Column('referencia', sa.String(length=50), nullable=True),
+    sa.Column('ip', sa.String(length=45), nullable=True),
+    sa.Column('detalle', sa.JSON(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('audit_event', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_audit_event_fecha'), ['fecha'], unique=False)
+        batch_op.create_index(batch_op.f('ix_audit_event_referencia'), ['referencia'], unique=False)
+        batch_op.create_index('ix_audit_event_usuario_fecha', ['usuario_id', 'fecha'], unique=False)
+        batch_op.create_index('ix_audit_event_entidad_fecha', ['entidad', 'entidad_id', 'fecha'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('audit_event', schema=None) as batch_op:
+        batch_op.drop_index('ix_audit_event_entidad_fecha')
+        batch_op.drop_index('ix_audit_event_usuario_fecha')
+        batch_op.drop_index(batch_op.f('ix_audit_event_referencia'))
+        batch_op.drop_index(batch_op.f('ix_audit_event_fecha'))
+
+    op.drop_table('audit_event')
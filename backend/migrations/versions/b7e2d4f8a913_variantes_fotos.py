@@ -0,0 +1,36 @@
+"""variantes fotos
+
+Revision ID: b7e2d4f8a913
+Revises: a1f3c9d2e7b4
+Create Date: 2025-08-07 16:41:02.775120
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e2d4f8a913'
+down_revision = 'a1f3c9d2e7b4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('foto_despacho', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('ruta_thumb', sa.String(length=200), nullable=True))
+        batch_op.add_column(sa.Column('ruta_medium', sa.String(length=200), nullable=True))
+
+    with op.batch_alter_table('foto_recepcion', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('ruta_thumb', sa.String(length=200), nullable=True))
+        batch_op.add_column(sa.Column('ruta_medium', sa.String(length=200), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('foto_recepcion', schema=None) as batch_op:
+        batch_op.drop_column('ruta_medium')
+        batch_op.drop_column('ruta_thumb')
+
+    with op.batch_alter_table('foto_despacho', schema=None) as batch_op:
+        batch_op.drop_column('ruta_medium')
+        batch_op.drop_column('ruta_thumb')
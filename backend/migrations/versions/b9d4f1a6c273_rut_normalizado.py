@@ -0,0 +1,102 @@
+"""rut normalizado
+
+Revision ID: b9d4f1a6c273
+Revises: a3e7c5b9d104
+Create Date: 2025-08-20 11:05:17.402856
+
+Agrega el RUT como cuerpo entero + dígito verificador junto al texto
+original, lo completa para las filas existentes por lotes y cambia los
+índices por RUT a las columnas normalizadas. Los índices se crean con
+CONCURRENTLY, igual que en a1f3c9d2e7b4.
+
+"""
+import re
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b9d4f1a6c273'
+down_revision = 'a3e7c5b9d104'
+branch_labels = None
+depends_on = None
+
+
+COLUMNAS = [
+    ('usuario', 'rut', 'rut_cuerpo', 'rut_dv'),
+    ('despacho', 'rut_empresa', 'rut_empresa_cuerpo', 'rut_empresa_dv'),
+    ('recepcion', 'rut_empresa', 'rut_empresa_cuerpo', 'rut_empresa_dv'),
+]
+
+INDICES_NUEVOS = [
+    ('ix_usuario_rut_cuerpo', 'usuario', ['rut_cuerpo']),
+    ('ix_despacho_rut_cuerpo_guia', 'despacho', ['rut_empresa_cuerpo', 'numero_guia']),
+    ('ix_recepcion_rut_cuerpo_guia', 'recepcion', ['rut_empresa_cuerpo', 'numero_guia']),
+]
+
+INDICES_ANTERIORES = [
+    ('ix_despacho_rut_guia', 'despacho', ['rut_empresa', 'numero_guia']),
+    ('ix_recepcion_rut_guia', 'recepcion', ['rut_empresa', 'numero_guia']),
+]
+
+TAMANO_LOTE = 5000
+
+
+def partes_rut(rut):
+    # Copia de app.utils.rut.partes_rut: la migración no debe depender del código de la app
+    limpio = re.sub(r"[.\-\s]", "", rut or "").upper()
+    if len(limpio) < 2 or not limpio[:-1].isdigit() or not (limpio[-1].isdigit() or limpio[-1] == "K"):
+        return None, None
+    return int(limpio[:-1]), limpio[-1]
+
+
+def rellenar(tabla, origen, cuerpo, dv):
+    conexion = op.get_bind()
+    t = sa.table(tabla, sa.column('id'), sa.column(origen), sa.column(cuerpo), sa.column(dv))
+    ultimo_id = 0
+    while True:
+        filas = conexion.execute(
+            sa.select(t.c.id, t.c[origen]).where(t.c.id > ultimo_id).order_by(t.c.id).limit(TAMANO_LOTE)
+        ).all()
+        if not filas:
+            break
+        valores = []
+        for id, rut in filas:
+            c, d = partes_rut(rut)
+            valores.append({'id_': id, 'cuerpo': c, 'dv': d})
+        conexion.execute(
+            t.update().where(t.c.id == sa.bindparam('id_')).values({cuerpo: sa.bindparam('cuerpo'), dv: sa.bindparam('dv')}),
+            valores
+        )
+        ultimo_id = filas[-1].id
+
+
+def upgrade():
+    for tabla, origen, cuerpo, dv in COLUMNAS:
+        with op.batch_alter_table(tabla, schema=None) as batch_op:
+            batch_op.add_column(sa.Column(cuerpo, sa.Integer(), nullable=True))
+            batch_op.add_column(sa.Column(dv, sa.String(length=1), nullable=True))
+        rellenar(tabla, origen, cuerpo, dv)
+
+    with op.get_context().autocommit_block():
+        for nombre, tabla, columnas in INDICES_NUEVOS:
+            op.create_index(nombre, tabla, columnas, if_not_exists=True,
+                            postgresql_concurrently=True)
+        for nombre, tabla, _ in INDICES_ANTERIORES:
+            op.drop_index(nombre, table_name=tabla, if_exists=True,
+                          postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for nombre, tabla, columnas in INDICES_ANTERIORES:
+            op.create_index(nombre, tabla, columnas, if_not_exists=True,
+                            postgresql_concurrently=True)
+        for nombre, tabla, _ in reversed(INDICES_NUEVOS):
+            op.drop_index(nombre, table_name=tabla, if_exists=True,
+                          postgresql_concurrently=True)
+
+    for tabla, _, cuerpo, dv in reversed(COLUMNAS):
+        with op.batch_alter_table(tabla, schema=None) as batch_op:
+            batch_op.drop_column(dv)
+            batch_op.drop_column(cuerpo)
@@ -0,0 +1,35 @@
+"""archivo blob
+
+Revision ID: c4a9e1b3d582
+Revises: b7e2d4f8a913
+Create Date: 2025-08-08 11:05:37.410926
+
+Las fotos existentes se trasladan al almacenamiento por hash con el comando
+`flask migrar-archivos`, que mueve los archivos y actualiza ruta_archivo.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4a9e1b3d582'
+down_revision = 'b7e2d4f8a913'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('archivo_blob',
+    sa.Column('sha256', sa.String(length=64), nullable=False),
+    sa.Column('ruta', sa.String(length=200), nullable=False),
+    sa.Column('tamano', sa.Integer(), nullable=False),
+    sa.Column('referencias', sa.Integer(), nullable=False),
+    sa.Column('fecha_creacion', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('sha256'),
+    sa.UniqueConstraint('ruta')
+    )
+
+
+def downgrade():
+    op.drop_table('archivo_blob')
@@ -0,0 +1,45 @@
+"""estadistica hora
+
+Revision ID: c6e2a8f4b517
+Revises: b9d4f1a6c273
+Create Date: 2025-08-22 16:40:03.117284
+
+La tabla se llena con `flask actualizar-estadisticas --desde <primera fecha>`
+después de aplicar la migración.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c6e2a8f4b517'
+down_revision = 'b9d4f1a6c273'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('estadistica_hora',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('hora', sa.DateTime(), nullable=False),
+    sa.Column('tipo_movimiento', sa.String(length=20), nullable=False),
+    sa.Column('usuario_id', sa.Integer(), nullable=False),
+    sa.Column('rut_empresa_cuerpo', sa.Integer(), nullable=True),
+    sa.Column('movimientos', sa.Integer(), nullable=False),
+    sa.Column('fotos', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('estadistica_hora', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_estadistica_hora_hora'), ['hora'], unique=False)
+        batch_op.create_index('ix_estadistica_hora_usuario_hora', ['usuario_id', 'hora'], unique=False)
+        batch_op.create_index('ix_estadistica_hora_rut_hora', ['rut_empresa_cuerpo', 'hora'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('estadistica_hora', schema=None) as batch_op:
+        batch_op.drop_index('ix_estadistica_hora_rut_hora')
+        batch_op.drop_index('ix_estadistica_hora_usuario_hora')
+        batch_op.drop_index(batch_op.f('ix_estadistica_hora_hora'))
+
+    op.drop_table('estadistica_hora')
@@ -0,0 +1,73 @@
+"""busqueda texto
+
+Revision ID: d3a7f9c1e462
+Revises: c6e2a8f4b517
+Create Date: 2025-08-25 09:31:48.226905
+
+Búsqueda de texto sobre observacion. En Postgres, índice GIN sobre
+to_tsvector('spanish', ...) creado con CONCURRENTLY (igual que en
+a1f3c9d2e7b4); los trigram de numero_guia/rut_empresa ya existen. En
+SQLite, tabla FTS5 de contenido externo con sus triggers, poblada con
+'rebuild'.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3a7f9c1e462'
+down_revision = 'c6e2a8f4b517'
+branch_labels = None
+depends_on = None
+
+
+TABLAS = ['despacho', 'recepcion']
+
+
+def ddl_fts_sqlite(tabla):
+    # Copia de app.utils.busqueda.ddl_fts_sqlite: la migración no debe depender del código de la app
+    fts = f"{tabla}_fts"
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(observacion, content='{tabla}', "
+        f"content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {tabla} BEGIN "
+        f"INSERT INTO {fts}(rowid, observacion) VALUES (new.id, new.observacion); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {tabla} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, observacion) VALUES ('delete', old.id, old.observacion); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF observacion ON {tabla} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, observacion) VALUES ('delete', old.id, old.observacion); "
+        f"INSERT INTO {fts}(rowid, observacion) VALUES (new.id, new.observacion); END",
+    ]
+
+
+def upgrade():
+    dialecto = op.get_bind().dialect.name
+
+    if dialecto == 'postgresql':
+        with op.get_context().autocommit_block():
+            for tabla in TABLAS:
+                op.create_index(f'ix_{tabla}_observacion_fts', tabla,
+                                [sa.text("to_tsvector('spanish'::regconfig, coalesce(observacion, ''))")],
+                                if_not_exists=True, postgresql_using='gin',
+                                postgresql_concurrently=True)
+    elif dialecto == 'sqlite':
+        for tabla in TABLAS:
+            for sentencia in ddl_fts_sqlite(tabla):
+                op.execute(sentencia)
+            op.execute(f"INSERT INTO {tabla}_fts({tabla}_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    dialecto = op.get_bind().dialect.name
+
+    if dialecto == 'postgresql':
+        with op.get_context().autocommit_block():
+            for tabla in reversed(TABLAS):
+                op.drop_index(f'ix_{tabla}_observacion_fts', table_name=tabla, if_exists=True,
+                              postgresql_concurrently=True)
+    elif dialecto == 'sqlite':
+        for tabla in reversed(TABLAS):
+            for sufijo in ('au', 'ad', 'ai'):
+                op.execute(f"DROP TRIGGER IF EXISTS {tabla}_fts_{sufijo}")
+            op.execute(f"DROP TABLE IF EXISTS {tabla}_fts")
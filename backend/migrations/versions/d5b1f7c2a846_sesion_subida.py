@@ -0,0 +1,42 @@
+"""sesion subida
+
+Revision ID: d5b1f7c2a846
+Revises: c4a9e1b3d582
+Create Date: 2025-08-11 09:27:51.204337
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5b1f7c2a846'
+down_revision = 'c4a9e1b3d582'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('sesion_subida',
+    sa.Column('id', sa.String(length=32), nullable=False),
+    sa.Column('usuario_id', sa.Integer(), nullable=False),
+    sa.Column('tipo_movimiento', sa.String(length=20), nullable=False),
+    sa.Column('movimiento_id', sa.Integer(), nullable=False),
+    sa.Column('tipo', sa.String(length=20), nullable=False),
+    sa.Column('extension', sa.String(length=10), nullable=False),
+    sa.Column('tamano_total', sa.Integer(), nullable=False),
+    sa.Column('recibido', sa.Integer(), nullable=False),
+    sa.Column('fecha_creacion', sa.DateTime(), nullable=True),
+    sa.Column('fecha_actualizacion', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['usuario_id'], ['usuario.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('sesion_subida', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_sesion_subida_fecha_actualizacion'), ['fecha_actualizacion'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('sesion_subida', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_sesion_subida_fecha_actualizacion'))
+
+    op.drop_table('sesion_subida')
@@ -0,0 +1,101 @@
+"""geohash movimientos
+
+Revision ID: e5c8a2d7f390
+Revises: d3a7f9c1e462
+Create Date: 2025-08-27 15:12:09.640381
+
+Agrega la celda geohash de latitud/longitud a despacho y recepcion, la
+completa por lotes para las filas existentes y crea el índice
+(geohash, fecha) con CONCURRENTLY, igual que en b9d4f1a6c273.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5c8a2d7f390'
+down_revision = 'd3a7f9c1e462'
+branch_labels = None
+depends_on = None
+
+
+TABLAS = ['despacho', 'recepcion']
+TAMANO_LOTE = 5000
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+PRECISION = 9
+
+
+def codificar(latitud, longitud):
+    # Copia de app.utils.geohash.codificar: la migración no debe depender del código de la app
+    if latitud is None or longitud is None:
+        return None
+    if not (-90 <= latitud <= 90 and -180 <= longitud <= 180):
+        return None
+    lat = [-90.0, 90.0]
+    lon = [-180.0, 180.0]
+    caracteres = []
+    bits = 0
+    valor = 0
+    par = True
+    while len(caracteres) < PRECISION:
+        intervalo, coordenada = (lon, longitud) if par else (lat, latitud)
+        medio = (intervalo[0] + intervalo[1]) / 2
+        if coordenada >= medio:
+            valor = valor * 2 + 1
+            intervalo[0] = medio
+        else:
+            valor = valor * 2
+            intervalo[1] = medio
+        par = not par
+        bits += 1
+        if bits == 5:
+            caracteres.append(BASE32[valor])
+            bits = 0
+            valor = 0
+    return "".join(caracteres)
+
+
+def rellenar(tabla):
+    conexion = op.get_bind()
+    t = sa.table(tabla, sa.column('id'), sa.column('latitud'), sa.column('longitud'), sa.column('geohash'))
+    ultimo_id = 0
+    while True:
+        filas = conexion.execute(
+            sa.select(t.c.id, t.c.latitud, t.c.longitud)
+            .where(t.c.id > ultimo_id).order_by(t.c.id).limit(TAMANO_LOTE)
+        ).all()
+        if not filas:
+            break
+        valores = [{'id_': id, 'geohash': codificar(latitud, longitud)}
+                   for id, latitud, longitud in filas if latitud is not None and longitud is not None]
+        if valores:
+            conexion.execute(
+                t.update().where(t.c.id == sa.bindparam('id_')).values(geohash=sa.bindparam('geohash')),
+                valores
+            )
+        ultimo_id = filas[-1].id
+
+
+def upgrade():
+    for tabla in TABLAS:
+        with op.batch_alter_table(tabla, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('geohash', sa.String(length=12), nullable=True))
+        rellenar(tabla)
+
+    with op.get_context().autocommit_block():
+        for tabla in TABLAS:
+            op.create_index(f'ix_{tabla}_geohash_fecha', tabla, ['geohash', 'fecha'],
+                            if_not_exists=True, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for tabla in reversed(TABLAS):
+            op.drop_index(f'ix_{tabla}_geohash_fecha', table_name=tabla, if_exists=True,
+                          postgresql_concurrently=True)
+
+    # Sin recrear la tabla en SQLite: se perderían los triggers FTS5 de d3a7f9c1e462
+    for tabla in reversed(TABLAS):
+        with op.batch_alter_table(tabla, schema=None, recreate='never') as batch_op:
+            batch_op.drop_column('geohash')
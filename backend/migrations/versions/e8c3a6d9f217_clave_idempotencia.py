@@ -0,0 +1,36 @@
+"""clave idempotencia
+
+Revision ID: e8c3a6d9f217
+Revises: d5b1f7c2a846
+Create Date: 2025-08-12 15:03:18.962045
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8c3a6d9f217'
+down_revision = 'd5b1f7c2a846'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('despacho', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('clave_idempotencia', sa.String(length=64), nullable=True))
+        batch_op.create_unique_constraint('uq_despacho_usuario_clave', ['usuario_id', 'clave_idempotencia'])
+
+    with op.batch_alter_table('recepcion', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('clave_idempotencia', sa.String(length=64), nullable=True))
+        batch_op.create_unique_constraint('uq_recepcion_usuario_clave', ['usuario_id', 'clave_idempotencia'])
+
+
+def downgrade():
+    with op.batch_alter_table('recepcion', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_recepcion_usuario_clave', type_='unique')
+        batch_op.drop_column('clave_idempotencia')
+
+    with op.batch_alter_table('despacho', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_despacho_usuario_clave', type_='unique')
+        batch_op.drop_column('clave_idempotencia')
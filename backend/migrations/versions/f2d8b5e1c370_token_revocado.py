@@ -0,0 +1,33 @@
+"""token revocado
+
+Revision ID: f2d8b5e1c370
+Revises: e8c3a6d9f217
+Create Date: 2025-08-13 10:48:26.591733
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2d8b5e1c370'
+down_revision = 'e8c3a6d9f217'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('token_revocado',
+    sa.Column('jti', sa.String(length=36), nullable=False),
+    sa.Column('expira', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('jti')
+    )
+    with op.batch_alter_table('token_revocado', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_token_revocado_expira'), ['expira'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('token_revocado', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_token_revocado_expira'))
+
+    op.drop_table('token_revocado')
@@ -0,0 +1,46 @@
+"""zona movimientos
+
+Revision ID: f7b3d9e1a524
+Revises: e5c8a2d7f390
+Create Date: 2025-08-29 10:04:52.871930
+
+Agrega la zona (comuna/sitio) de despacho y recepcion con su índice
+(zona, fecha). Las filas existentes se etiquetan después con
+`flask asignar-zonas`, que necesita el GeoJSON de ZONAS_GEOJSON.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f7b3d9e1a524'
+down_revision = 'e5c8a2d7f390'
+branch_labels = None
+depends_on = None
+
+
+TABLAS = ['despacho', 'recepcion']
+
+
+def upgrade():
+    for tabla in TABLAS:
+        with op.batch_alter_table(tabla, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('zona', sa.String(length=100), nullable=True))
+
+    with op.get_context().autocommit_block():
+        for tabla in TABLAS:
+            op.create_index(f'ix_{tabla}_zona_fecha', tabla, ['zona', 'fecha'],
+                            if_not_exists=True, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for tabla in reversed(TABLAS):
+            op.drop_index(f'ix_{tabla}_zona_fecha', table_name=tabla, if_exists=True,
+                          postgresql_concurrently=True)
+
+    # Sin recrear la tabla en SQLite: se perderían los triggers FTS5 de d3a7f9c1e462
+    for tabla in reversed(TABLAS):
+        with op.batch_alter_table(tabla, schema=None, recreate='never') as batch_op:
+            batch_op.drop_column('zona')
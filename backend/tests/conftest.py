@@ -0,0 +1,80 @@
+import shutil
+import pytest
+from config import Config
+
+
+@pytest.fixture(scope="session")
+def app(tmp_path_factory):
+    """
+    Una sola app por sesión sobre SQLite en un directorio temporal: los hilos
+    de auditoría, logs y reportes se crean una vez. Cada test parte con las
+    tablas vacías (fixture `bd`).
+    """
+    base = tmp_path_factory.mktemp("app")
+    with pytest.MonkeyPatch.context() as mp:
+        for nombre, valor in {
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{base / 'test.db'}",
+            "UPLOAD_FOLDER": str(base / "uploads"),
+            "LOG_DIR": str(base / "logs"),
+            "REPORTES_DIR": str(base / "reportes"),
+            "PASSWORD_HASH_METHOD": "pbkdf2:sha256:1000",
+            "TOKEN_REVOCATION_CACHE_TTL": 0,
+            "PRINCIPAL_CACHE_TTL": 0,
+        }.items():
+            mp.setattr(Config, nombre, valor, raising=False)
+        from app import create_app
+        app = create_app()
+    app.config["TESTING"] = True
+    yield app
+    app.extensions["registro"].detener()
+
+
+@pytest.fixture
+def bd(app):
+    """
+    Tablas y carpeta de uploads recreadas para el test. No deja un contexto
+    abierto: así cada solicitud del test client usa su propia sesión, como
+    en producción.
+    """
+    from app import db, limiter
+    shutil.rmtree(app.config["UPLOAD_FOLDER"], ignore_errors=True)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+    limiter.reset()
+    return db
+
+
+@pytest.fixture
+def client(app, bd):
+    return app.test_client()
+
+
+@pytest.fixture
+def usuarios(app, bd):
+    """Admin (id 1) y usuario normal (id 2), ambos con clave 'clave123'."""
+    from app.models import Usuario
+    admin = Usuario(rut="11111111-1", correo="admin@test.cl", nombre="Admin", tipo_usuario="admin")
+    normal = Usuario(rut="22222222-2", correo="normal@test.cl", nombre="Normal", tipo_usuario="usuario")
+    with app.app_context():
+        for u in (admin, normal):
+            u.set_password("clave123")
+        bd.session.add_all([admin, normal])
+        bd.session.commit()
+        return {"admin": admin.id, "normal": normal.id}
+
+
+def _login(client, rut):
+    r = client.post("/auth/login", json={"rut": rut, "password": "clave123"})
+    assert r.status_code == 200, r.get_json()
+    return {"Authorization": f"Bearer {r.get_json()['access_token']}"}
+
+
+@pytest.fixture
+def auth_admin(client, usuarios):
+    return _login(client, "11111111-1")
+
+
+@pytest.fixture
+def auth_usuario(client, usuarios):
+    return _login(client, "22222222-2")
@@ -0,0 +1,104 @@
+import hashlib
+import io
+import os
+import pytest
+from app.models import ArchivoBlob
+from app.utils.file_handler import guardar_archivo, liberar_archivo, ruta_por_hash
+
+CONTENIDO = b"\xff\xd8\xff\xe0 foto de prueba"
+
+
+@pytest.fixture
+def carpeta(app, bd):
+    return app.config["UPLOAD_FOLDER"]
+
+
+def _guardar(carpeta, contenido=CONTENIDO):
+    return guardar_archivo(io.BytesIO(contenido), carpeta, "JPG")
+
+
+def _blob(bd, ruta):
+    return bd.session.execute(bd.select(ArchivoBlob).filter_by(ruta=ruta)).scalar_one_or_none()
+
+
+def test_ruta_por_contenido(app, bd, carpeta):
+    with app.app_context():
+        ruta = _guardar(carpeta)
+        bd.session.commit()
+    sha256 = hashlib.sha256(CONTENIDO).hexdigest()
+    assert ruta == ruta_por_hash(sha256, "jpg") == f"{sha256[:2]}/{sha256[2:4]}/{sha256}.jpg"
+    with open(os.path.join(carpeta, ruta), "rb") as f:
+        assert f.read() == CONTENIDO
+    assert os.listdir(os.path.join(carpeta, "tmp")) == []
+
+
+def test_mismo_contenido_se_guarda_una_vez(app, bd, carpeta):
+    with app.app_context():
+        primera = _guardar(carpeta)
+        segunda = _guardar(carpeta)
+        otra = _guardar(carpeta, b"otro contenido")
+        bd.session.commit()
+        assert primera == segunda != otra
+        assert _blob(bd, primera).referencias == 2
+        assert _blob(bd, otra).referencias == 1
+
+
+def test_liberar_borra_con_la_ultima_referencia(app, bd, carpeta):
+    with app.app_context():
+        ruta = _guardar(carpeta)
+        _guardar(carpeta)
+        bd.session.commit()
+        absoluta = os.path.join(carpeta, ruta)
+
+        liberar_archivo(carpeta, ruta)
+        bd.session.commit()
+        assert _blob(bd, ruta).referencias == 1
+        assert os.path.exists(absoluta)
+
+        liberar_archivo(carpeta, ruta)
+        assert os.path.exists(absoluta), "no se borra antes del commit"
+        bd.session.commit()
+        assert _blob(bd, ruta) is None
+        assert not os.path.exists(absoluta)
+
+
+def test_rollback_conserva_el_archivo_liberado(app, bd, carpeta):
+    with app.app_context():
+        ruta = _guardar(carpeta)
+        bd.session.commit()
+        liberar_archivo(carpeta, ruta)
+        bd.session.rollback()
+        assert _blob(bd, ruta).referencias == 1
+        assert os.path.exists(os.path.join(carpeta, ruta))
+        bd.session.commit()
+        assert os.path.exists(os.path.join(carpeta, ruta))
+
+
+def test_rollback_borra_el_archivo_nuevo(app, bd, carpeta):
+    with app.app_context():
+        ruta = _guardar(carpeta)
+        bd.session.rollback()
+        assert _blob(bd, ruta) is None
+        assert not os.path.exists(os.path.join(carpeta, ruta))
+
+
+def test_eliminar_foto_libera_la_referencia(app, bd, client, auth_admin, carpeta):
+    from app.models import Despacho, FotoDespacho
+    with app.app_context():
+        despachos = [Despacho(numero_guia=f"G{i}", rut_empresa="11111111-1", usuario_id=1) for i in range(2)]
+        bd.session.add_all(despachos)
+        bd.session.flush()
+        fotos = [FotoDespacho(despacho_id=d.id, tipo="carga", ruta_archivo=_guardar(carpeta)) for d in despachos]
+        bd.session.add_all(fotos)
+        bd.session.commit()
+        ruta = fotos[0].ruta_archivo
+        despacho_id, foto_id = despachos[0].id, fotos[1].id
+
+    assert client.delete(f"/admin/despachos/{despacho_id}", headers=auth_admin).status_code == 200
+    with app.app_context():
+        assert _blob(bd, ruta).referencias == 1
+    assert client.delete(f"/admin/fotos_despacho/{foto_id}", headers=auth_admin).status_code == 200
+    with app.app_context():
+        assert _blob(bd, ruta) is None
+        assert bd.session.scalar(bd.select(bd.func.count()).select_from(FotoDespacho)) == 0
+    assert not os.path.exists(os.path.join(carpeta, ruta))
@@ -0,0 +1,96 @@
+import io
+import os
+import zipfile
+from datetime import datetime
+import pytest
+from app.models import Despacho, FotoDespacho, FotoRecepcion, Recepcion
+from app.utils.file_handler import guardar_archivo
+from app.utils.streaming import TAMANO_BLOQUE_ZIP, respuesta_zip
+
+
+@pytest.fixture
+def fotos(app, bd, usuarios):
+    """Una foto por movimiento: tres en mayo (dos del usuario normal, una del admin) y una en junio."""
+    carpeta = app.config["UPLOAD_FOLDER"]
+    with app.app_context():
+        def movimiento(modelo, modelo_foto, columna, guia, fecha, usuario, contenido, tipo="carga"):
+            m = modelo(numero_guia=guia, rut_empresa="11111111-1", fecha=fecha, usuario_id=usuarios[usuario])
+            bd.session.add(m)
+            bd.session.flush()
+            ruta = guardar_archivo(io.BytesIO(contenido), carpeta, "jpg")
+            bd.session.add(modelo_foto(**{columna: m.id}, tipo=tipo, ruta_archivo=ruta))
+            return m
+
+        movimiento(Despacho, FotoDespacho, "despacho_id", "D1", datetime(2025, 5, 2, 9), "normal", b"despacho-normal")
+        movimiento(Recepcion, FotoRecepcion, "recepcion_id", "R1", datetime(2025, 5, 3, 9), "normal", b"recepcion-normal",
+                   tipo="patente")
+        movimiento(Despacho, FotoDespacho, "despacho_id", "D2", datetime(2025, 5, 2, 10), "admin", b"despacho-admin")
+        movimiento(Despacho, FotoDespacho, "despacho_id", "FUERA", datetime(2025, 6, 1), "normal", b"fuera-de-rango")
+        bd.session.commit()
+
+
+def _zip(respuesta):
+    assert respuesta.status_code == 200
+    assert respuesta.mimetype == "application/zip"
+    archivo = zipfile.ZipFile(io.BytesIO(respuesta.get_data()))
+    assert archivo.testzip() is None
+    return {os.path.basename(os.path.dirname(n)): archivo.read(n) for n in archivo.namelist()}
+
+
+def test_exporta_solo_las_fotos_propias_del_rango(client, auth_usuario, fotos):
+    r = client.get("/reportes/fotos?desde=2025-05-01&hasta=2025-05-31", headers=auth_usuario)
+    assert r.is_streamed
+    contenido = _zip(r)
+    assert contenido == {
+        "2025-05-02_despacho_1_D1": b"despacho-normal",
+        "2025-05-03_recepcion_1_R1": b"recepcion-normal",
+    }
+
+
+def test_filtros_de_tipo(client, auth_usuario, fotos):
+    r = client.get("/reportes/fotos?desde=2025-05-01&hasta=2025-05-31&tipo=recepcion", headers=auth_usuario)
+    assert list(_zip(r)) == ["2025-05-03_recepcion_1_R1"]
+    r = client.get("/reportes/fotos?desde=2025-05-01&hasta=2025-05-31&tipo_foto=carnet", headers=auth_usuario)
+    assert _zip(r) == {}
+
+
+def test_admin_ve_todo_o_filtra_por_usuario(client, auth_admin, usuarios, fotos):
+    r = client.get("/reportes/fotos?desde=2025-05-01&hasta=2025-05-31", headers=auth_admin)
+    assert len(_zip(r)) == 3
+    r = client.get(f"/reportes/fotos?desde=2025-05-01&hasta=2025-05-31&usuario_id={usuarios['admin']}",
+                   headers=auth_admin)
+    assert list(_zip(r)) == ["2025-05-02_despacho_2_D2"]
+
+
+def test_archivo_faltante_se_omite(app, client, auth_usuario, fotos):
+    with app.app_context():
+        ruta = FotoRecepcion.query.one().ruta_archivo
+    os.remove(os.path.join(app.config["UPLOAD_FOLDER"], ruta))
+    r = client.get("/reportes/fotos?desde=2025-05-01&hasta=2025-05-31", headers=auth_usuario)
+    assert list(_zip(r)) == ["2025-05-02_despacho_1_D1"]
+
+
+@pytest.mark.parametrize("consulta", ["", "desde=2025-05-01", "desde=01-05-2025&hasta=2025-05-31",
+                                      "desde=2025-05-01&hasta=2025-05-31&tipo=otro"])
+def test_parametros_invalidos(client, auth_usuario, consulta):
+    assert client.get(f"/reportes/fotos?{consulta}", headers=auth_usuario).status_code == 400
+
+
+def test_respuesta_zip_envia_por_bloques(app, tmp_path):
+    grande = os.urandom(TAMANO_BLOQUE_ZIP * 3 + 17)
+    (tmp_path / "grande.bin").write_bytes(grande)
+    (tmp_path / "chica.txt").write_bytes(b"hola")
+    terminados = []
+    entradas = [(str(tmp_path / "grande.bin"), "a/grande.bin"), (str(tmp_path / "no-existe"), "b/falta.bin"),
+                (str(tmp_path / "chica.txt"), "c/chica.txt")]
+
+    with app.test_request_context():
+        respuesta = respuesta_zip(iter(entradas), "prueba.zip", terminados.append)
+        bloques = [b for b in respuesta.response if b]
+    assert len(bloques) > 3
+    assert max(len(b) for b in bloques) <= TAMANO_BLOQUE_ZIP + 1024
+    assert terminados == [2]
+    archivo = zipfile.ZipFile(io.BytesIO(b"".join(bloques)))
+    assert archivo.namelist() == ["a/grande.bin", "c/chica.txt"]
+    assert archivo.read("a/grande.bin") == grande
+    assert all(i.compress_type == zipfile.ZIP_STORED for i in archivo.infolist())
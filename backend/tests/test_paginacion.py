@@ -0,0 +1,65 @@
+from datetime import datetime, timedelta
+import pytest
+from app.models import Despacho
+from app.utils.paginacion import codificar_cursor, decodificar_cursor
+
+
+@pytest.fixture
+def despachos(app, bd, usuarios):
+    """Siete despachos del usuario normal, varios con la misma fecha, y uno del admin."""
+    base = datetime(2025, 1, 10, 12, 0)
+    fechas = [base, base, base, base - timedelta(days=1), base - timedelta(days=1),
+              base - timedelta(days=2), base - timedelta(days=3)]
+    with app.app_context():
+        filas = [Despacho(numero_guia=f"G{i}", rut_empresa="11111111-1", fecha=f, usuario_id=usuarios["normal"])
+                 for i, f in enumerate(fechas)]
+        ajeno = Despacho(numero_guia="AJENO", rut_empresa="11111111-1", fecha=base, usuario_id=usuarios["admin"])
+        bd.session.add_all(filas + [ajeno])
+        bd.session.commit()
+        # Orden de la paginación por keyset: (fecha DESC, id DESC)
+        return [d.id for d in sorted(filas, key=lambda d: (d.fecha, d.id), reverse=True)]
+
+
+def test_cursor_ida_y_vuelta():
+    fecha = datetime(2025, 3, 1, 8, 30, 15)
+    assert decodificar_cursor(codificar_cursor(fecha, 42)) == (fecha, 42)
+
+
+@pytest.mark.parametrize("cursor", ["no-es-un-cursor", "e30", "WzEsMl0"])
+def test_cursor_invalido_se_decodifica_como_none(cursor):
+    assert decodificar_cursor(cursor) is None
+
+
+def test_recorre_todas_las_paginas_sin_repetir(client, auth_usuario, despachos):
+    vistos = []
+    cursor = ""
+    while True:
+        r = client.get(f"/historial/despachos?per_page=3&cursor={cursor}", headers=auth_usuario)
+        assert r.status_code == 200
+        datos = r.get_json()
+        assert datos["current_page"] is None
+        assert len(datos["despachos"]) <= 3
+        vistos.extend(d["id"] for d in datos["despachos"])
+        cursor = datos["next_cursor"]
+        if cursor is None:
+            break
+    assert vistos == despachos
+
+
+def test_cursor_invalido_responde_400(client, auth_usuario, despachos):
+    r = client.get("/historial/despachos?cursor=basura", headers=auth_usuario)
+    assert r.status_code == 400
+    assert "error" in r.get_json()
+
+
+def test_total_none_omite_el_conteo(client, auth_usuario, despachos):
+    datos = client.get("/historial/despachos?cursor=&total=none", headers=auth_usuario).get_json()
+    assert datos["total"] is None and datos["pages"] is None
+    datos = client.get("/historial/despachos?page=1&per_page=3", headers=auth_usuario).get_json()
+    assert datos["total"] == len(despachos) and datos["pages"] == 3
+    assert datos["current_page"] == 1
+
+
+def test_per_page_se_acota_a_uno(client, auth_usuario, despachos):
+    datos = client.get("/historial/despachos?cursor=&per_page=-5", headers=auth_usuario).get_json()
+    assert [d["id"] for d in datos["despachos"]] == despachos[:1]
@@ -0,0 +1,53 @@
+import time
+from datetime import datetime, timedelta
+from app.models import TokenRevocado
+from app.utils.revocacion import revocacion
+
+
+def _login(client):
+    r = client.post("/auth/login", json={"rut": "22222222-2", "password": "clave123"})
+    return {"Authorization": f"Bearer {r.get_json()['access_token']}"}
+
+
+def test_logout_revoca_solo_ese_token(client, usuarios):
+    sesion, otra = _login(client), _login(client)
+    assert client.get("/historial/despachos", headers=sesion).status_code == 200
+
+    assert client.post("/auth/logout", headers=sesion).status_code == 200
+    assert client.get("/historial/despachos", headers=sesion).status_code == 401
+    assert client.post("/auth/logout", headers=sesion).status_code == 401
+    assert client.get("/historial/despachos", headers=otra).status_code == 200
+
+
+def test_revocacion_compartida_sin_cache_local(app, client, usuarios):
+    # Otro worker no tiene el token en su caché: lo encuentra en la tabla
+    sesion = _login(client)
+    client.post("/auth/logout", headers=sesion)
+    revocacion.cache.limpiar()
+    assert client.get("/historial/despachos", headers=sesion).status_code == 401
+    with app.app_context():
+        assert TokenRevocado.query.count() == 1
+
+
+def test_revocar_dos_veces_no_falla(app, bd):
+    exp = time.time() + 3600
+    with app.app_context():
+        revocacion.revocar("jti-repetido", exp)
+        revocacion.revocar("jti-repetido", exp)
+        assert TokenRevocado.query.count() == 1
+        assert revocacion.esta_revocado("jti-repetido", exp)
+
+
+def test_purgar_tokens_elimina_solo_los_expirados(app, bd):
+    with app.app_context():
+        ahora = datetime.utcnow()
+        bd.session.add_all([
+            TokenRevocado(jti="vencido", expira=ahora - timedelta(minutes=1)),
+            TokenRevocado(jti="vigente", expira=ahora + timedelta(hours=1)),
+        ])
+        bd.session.commit()
+    resultado = app.test_cli_runner().invoke(args=["purgar-tokens"])
+    assert resultado.exit_code == 0
+    assert "eliminados: 1" in resultado.output
+    with app.app_context():
+        assert [t.jti for t in TokenRevocado.query.all()] == ["vigente"]
@@ -0,0 +1,118 @@
+import importlib.util
+import os
+import pytest
+import sqlalchemy as sa
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+from app.models import Despacho, Usuario
+from app.utils.rut import MAX_CUERPO, calcular_dv, cuerpos_busqueda, partes_rut
+
+MIGRACION = os.path.join(os.path.dirname(__file__), "..", "migrations", "versions", "b9d4f1a6c273_rut_normalizado.py")
+
+
+@pytest.mark.parametrize("rut, esperado", [
+    ("21.001.625-2", (21001625, "2")),
+    ("21001625-2", (21001625, "2")),
+    ("210016252", (21001625, "2")),
+    (" 9.876.543-k ", (9876543, "K")),
+    ("12.345.678", (1234567, "8")),
+    ("abc", (None, None)),
+    ("1", (None, None)),
+    ("", (None, None)),
+    (None, (None, None)),
+    (12345678, (None, None)),
+])
+def test_partes_rut(rut, esperado):
+    assert partes_rut(rut) == esperado
+
+
+def test_calcular_dv():
+    assert calcular_dv(11111111) == "1"
+    assert calcular_dv("12345678") == "5"
+    assert calcular_dv(10000013) == "K"
+    assert calcular_dv(10000004) == "0"
+
+
+@pytest.mark.parametrize("texto, esperado", [
+    ("12345678-5", [12345678]),
+    ("12.345.678-5", [12345678]),
+    ("9876543-K", [9876543]),
+    ("9876543k", [9876543]),
+    # Sólo dígitos: el cuerpo completo y, si el último dígito es un DV válido, la otra lectura
+    ("123456785", [123456785, 12345678]),
+    ("12345678", [12345678]),
+    ("12.345.678", [12345678]),
+    ("guia-12", []),
+    ("", []),
+    (None, []),
+    (str(MAX_CUERPO + 1), []),
+])
+def test_cuerpos_busqueda(texto, esperado):
+    assert cuerpos_busqueda(texto) == esperado
+
+
+def test_modelos_normalizan_al_asignar(app, bd, usuarios):
+    with app.app_context():
+        despacho = Despacho(numero_guia="G1", rut_empresa="9.876.543-k", usuario_id=usuarios["normal"])
+        assert (despacho.rut_empresa_cuerpo, despacho.rut_empresa_dv) == (9876543, "K")
+        despacho.rut_empresa = "12345678-5"
+        assert (despacho.rut_empresa_cuerpo, despacho.rut_empresa_dv) == (12345678, "5")
+        assert bd.session.get(Usuario, usuarios["admin"]).rut_cuerpo == 11111111
+
+
+def test_filtro_por_rut_en_cualquier_formato(app, bd, client, auth_usuario, usuarios):
+    with app.app_context():
+        bd.session.add_all([
+            Despacho(numero_guia="A", rut_empresa="12.345.678-5", usuario_id=usuarios["normal"]),
+            Despacho(numero_guia="B", rut_empresa="123456785", usuario_id=usuarios["normal"]),
+            Despacho(numero_guia="C", rut_empresa="11111111-1", usuario_id=usuarios["normal"]),
+        ])
+        bd.session.commit()
+    for filtro in ("12345678-5", "12.345.678-5", "12345678", "123456785"):
+        datos = client.get(f"/historial/despachos?rut_empresa={filtro}", headers=auth_usuario).get_json()
+        assert sorted(d["numero_guia"] for d in datos["despachos"]) == ["A", "B"], filtro
+    datos = client.get("/historial/despachos?rut_empresa=no-es-rut", headers=auth_usuario).get_json()
+    assert datos["despachos"] == []
+
+
+def test_login_con_rut_en_otro_formato(client, usuarios):
+    for rut in ("22.222.222-2", "222222222"):
+        assert client.post("/auth/login", json={"rut": rut, "password": "clave123"}).status_code == 200
+
+
+def test_por_rut_con_duplicados(app, bd, usuarios):
+    with app.app_context():
+        duplicado = Usuario(rut="22.222.222-2", correo="dup@test.cl", nombre="Duplicado", tipo_usuario="usuario")
+        duplicado.set_password("otra")
+        bd.session.add(duplicado)
+        bd.session.commit()
+        assert Usuario.por_rut("22222222-2").id == usuarios["normal"]
+        assert Usuario.por_rut("22.222.222-2").id == duplicado.id
+        assert Usuario.por_rut("222222222") is None
+        assert Usuario.por_rut("33333333-3") is None
+
+
+def test_migracion_rellena_filas_existentes(tmp_path):
+    spec = importlib.util.spec_from_file_location("rut_normalizado", MIGRACION)
+    migracion = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(migracion)
+
+    motor = sa.create_engine(f"sqlite:///{tmp_path / 'migracion.db'}")
+    with motor.begin() as conexion:
+        conexion.exec_driver_sql(
+            "CREATE TABLE despacho (id INTEGER PRIMARY KEY, rut_empresa VARCHAR(12), "
+            "rut_empresa_cuerpo INTEGER, rut_empresa_dv VARCHAR(1))"
+        )
+        conexion.execute(sa.text("INSERT INTO despacho (id, rut_empresa) VALUES (:id, :rut)"), [
+            {"id": 1, "rut": "12.345.678-5"},
+            {"id": 2, "rut": "9876543k"},
+            {"id": 3, "rut": "sin rut"},
+            {"id": 4, "rut": None},
+        ])
+        migracion.TAMANO_LOTE = 2  # fuerza varios lotes
+        with Operations.context(MigrationContext.configure(conexion)):
+            migracion.rellenar("despacho", "rut_empresa", "rut_empresa_cuerpo", "rut_empresa_dv")
+        filas = conexion.exec_driver_sql(
+            "SELECT id, rut_empresa_cuerpo, rut_empresa_dv FROM despacho ORDER BY id"
+        ).all()
+    assert filas == [(1, 12345678, "5"), (2, 9876543, "K"), (3, None, None), (4, None, None)]
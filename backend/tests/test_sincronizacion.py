@@ -0,0 +1,71 @@
+import io
+import json
+from app.models import ArchivoBlob, Despacho, FotoDespacho, Recepcion
+
+
+def _movimiento(clave, tipo="despacho", **extra):
+    return {"tipo_movimiento": tipo, "clave_idempotencia": clave, "numero_guia": f"G-{clave}",
+            "rut_empresa": "11111111-1", **extra}
+
+
+def _contar(bd, modelo):
+    return bd.session.scalar(bd.select(bd.func.count()).select_from(modelo))
+
+
+def test_reenvio_no_duplica(app, bd, client, auth_usuario):
+    lote = [_movimiento("a"), _movimiento("b", "recepcion", latitud=-33.4, longitud=-70.6)]
+    primera = client.post("/sincronizar/", json=lote, headers=auth_usuario)
+    assert primera.status_code == 200
+    assert [r["estado"] for r in primera.get_json()["resultados"]] == ["creado", "creado"]
+
+    segunda = client.post("/sincronizar/", json=lote, headers=auth_usuario)
+    assert segunda.status_code == 200
+    resultados = segunda.get_json()["resultados"]
+    assert [r["estado"] for r in resultados] == ["existente", "existente"]
+    assert [r["id"] for r in resultados] == [r["id"] for r in primera.get_json()["resultados"]]
+    with app.app_context():
+        assert _contar(bd, Despacho) == 1 and _contar(bd, Recepcion) == 1
+
+
+def test_reenvio_parcial_crea_solo_lo_nuevo(app, bd, client, auth_usuario):
+    client.post("/sincronizar/", json=[_movimiento("a")], headers=auth_usuario)
+    r = client.post("/sincronizar/", json=[_movimiento("a"), _movimiento("c")], headers=auth_usuario)
+    assert [x["estado"] for x in r.get_json()["resultados"]] == ["existente", "creado"]
+    with app.app_context():
+        assert _contar(bd, Despacho) == 2
+
+
+def test_claves_por_usuario(app, bd, client, auth_usuario, auth_admin):
+    for auth in (auth_usuario, auth_admin):
+        r = client.post("/sincronizar/", json=[_movimiento("misma")], headers=auth)
+        assert r.get_json()["resultados"][0]["estado"] == "creado"
+    with app.app_context():
+        assert _contar(bd, Despacho) == 2
+
+
+def test_reenvio_con_fotos(app, bd, client, auth_usuario):
+    def enviar():
+        datos = {
+            "movimientos": json.dumps([_movimiento("f", fotos=[{"tipo": "carga", "archivo": "foto1"}])]),
+            "foto1": (io.BytesIO(b"\xff\xd8 contenido"), "carga.jpg"),
+        }
+        return client.post("/sincronizar/", data=datos, headers=auth_usuario, content_type="multipart/form-data")
+
+    assert enviar().get_json()["resultados"][0]["estado"] == "creado"
+    assert enviar().get_json()["resultados"][0]["estado"] == "existente"
+    with app.app_context():
+        assert _contar(bd, FotoDespacho) == 1
+        assert bd.session.scalar(bd.select(ArchivoBlob.referencias)) == 1
+
+
+def test_lote_invalido_no_inserta_nada(app, bd, client, auth_usuario):
+    repetida = client.post("/sincronizar/", json=[_movimiento("x"), _movimiento("x")], headers=auth_usuario)
+    assert repetida.status_code == 400
+    assert "clave_idempotencia" in repetida.get_json()["errores"]["1"]
+
+    rut_malo = client.post("/sincronizar/", json=[_movimiento("y"), _movimiento("z", rut_empresa="12345678-0")],
+                           headers=auth_usuario)
+    assert rut_malo.status_code == 400
+    assert list(rut_malo.get_json()["errores"]) == ["1"]
+    with app.app_context():
+        assert _contar(bd, Despacho) == 0